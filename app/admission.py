@@ -0,0 +1,205 @@
+"""Admission control for upload and parse requests.
+
+Parsing is CPU-heavy and runs in the shared worker threadpool, so a burst
+of large uploads could otherwise take every thread and hold every request
+body in memory at once. ``AdmissionMiddleware`` sits in front of the
+parsing routes and applies three limits before the request body is read:
+
+* in-flight upload bytes, using ``Content-Length`` (429 when exceeded),
+* concurrently running parse jobs, kept below the threadpool size so reads
+  always have threads left,
+* a bounded wait queue for jobs beyond that (503 when full or when a
+  request waits longer than the queue timeout).
+
+429 and 503 responses carry ``Retry-After``. Waiting requests hold no worker
+thread. Slots are handed over under a lock, so the controller works no
+matter which event loop a request runs on.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from collections import Counter, deque
+from threading import Lock
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.config import Settings
+
+# (method, path) pairs that start a parse job.
+ADMITTED_ROUTES = {("POST", "/upload"), ("POST", "/parse/trigger")}
+# Finalizing a resumable upload parses bytes that are already staged, so it
+# takes a job slot but needs no Content-Length.
+FINALIZE_ROUTE = re.compile(r"^/uploads/[^/]+/finalize$")
+
+
+class Rejection(Exception):
+    def __init__(self, status_code: int, reason: str, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+
+
+class _Waiter:
+    __slots__ = ("loop", "event", "granted")
+
+    def __init__(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """Byte and job-slot accounting shared by every request."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_jobs: int,
+        queue_size: int,
+        queue_timeout: float = 30.0,
+        retry_after: int = 5,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_jobs = max_jobs
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._lock = Lock()
+        self._waiters: Deque[_Waiter] = deque()
+        self.inflight_bytes = 0
+        self.active_jobs = 0
+        self.admitted = 0
+        self.peak_queue = 0
+        self.rejected: Counter[str] = Counter()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "AdmissionController":
+        return cls(
+            max_bytes=settings.admission_max_bytes,
+            max_jobs=settings.admission_max_jobs,
+            queue_size=settings.admission_queue_size,
+            queue_timeout=settings.admission_queue_timeout,
+            retry_after=settings.admission_retry_after,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_jobs > 0
+
+    def reject(self, status_code: int, reason: str, detail: str) -> Rejection:
+        self.rejected[reason] += 1
+        return Rejection(status_code, reason, detail)
+
+    async def acquire(self, nbytes: int) -> None:
+        """Reserve ``nbytes`` and a job slot, waiting in the queue if needed.
+
+        Raises ``Rejection`` when the request cannot be admitted.
+        """
+
+        waiter: Optional[_Waiter] = None
+        with self._lock:
+            if nbytes > self.max_bytes:
+                raise self.reject(413, "too_large", f"Upload exceeds the {self.max_bytes} byte limit")
+            if self.inflight_bytes + nbytes > self.max_bytes:
+                raise self.reject(429, "bytes", "Too many upload bytes in flight")
+            if self.active_jobs >= self.max_jobs:
+                if len(self._waiters) >= self.queue_size:
+                    raise self.reject(503, "queue_full", "Parse queue is full")
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+                self.peak_queue = max(self.peak_queue, len(self._waiters))
+            else:
+                self.active_jobs += 1
+            self.inflight_bytes += nbytes
+
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.event.wait(), self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+                with self._lock:
+                    if not waiter.granted:
+                        self._waiters.remove(waiter)
+                        self.inflight_bytes -= nbytes
+                        if isinstance(exc, asyncio.CancelledError):
+                            raise
+                        raise self.reject(503, "queue_timeout", "Timed out waiting for a parse slot")
+                if isinstance(exc, asyncio.CancelledError):
+                    self.release(nbytes)
+                    raise
+        with self._lock:
+            self.admitted += 1
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self.inflight_bytes -= nbytes
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter.
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.loop.call_soon_threadsafe(waiter.event.set)
+            else:
+                self.active_jobs -= 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "active_jobs": self.active_jobs,
+                "max_jobs": self.max_jobs,
+                "queue_depth": len(self._waiters),
+                "peak_queue_depth": self.peak_queue,
+                "queue_size": self.queue_size,
+                "inflight_bytes": self.inflight_bytes,
+                "max_bytes": self.max_bytes,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+
+def _content_length(scope) -> Optional[int]:
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an ``AdmissionController`` to parse routes."""
+
+    def __init__(self, app, controller: AdmissionController) -> None:
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send) -> None:
+        route: Tuple[str, str] = (scope.get("method", ""), scope.get("path", ""))
+        finalize = route[0] == "POST" and FINALIZE_ROUTE.match(route[1]) is not None
+        if scope["type"] != "http" or not self.controller.enabled or (route not in ADMITTED_ROUTES and not finalize):
+            await self.app(scope, receive, send)
+            return
+
+        nbytes = _content_length(scope)
+        if finalize:
+            nbytes = nbytes or 0
+        try:
+            if nbytes is None:
+                raise self.controller.reject(411, "no_length", "Content-Length is required")
+            await self.controller.acquire(nbytes)
+        except Rejection as rejection:
+            # Only capacity rejections are worth retrying.
+            retryable = rejection.status_code in (429, 503)
+            headers = {"Retry-After": str(self.controller.retry_after)} if retryable else None
+            response = JSONResponse({"detail": rejection.detail}, status_code=rejection.status_code, headers=headers)
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(nbytes)
@@ -0,0 +1,240 @@
+"""Monthly spend rollups by vendor, part and GL account.
+
+``persist_invoice`` adds each new invoice's contribution and
+``refresh_invoice`` swaps the old contribution for the new one, so the
+rollup tables always match the stored invoices without re-reading them.
+Amounts are kept in integer cents so repeated add/subtract cycles do not
+drift. ``GET /analytics/spend`` reads only these tables; ``python -m
+app.analytics rebuild`` recomputes them from history.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session, selectinload
+
+from app.models import AccountSpendRollups, Invoices, PartSpendRollups, VendorSpendRollups
+
+logger = logging.getLogger(__name__)
+
+# Rollup model -> key columns, counter columns.
+ROLLUPS = {
+    VendorSpendRollups: (("month", "vendor"), ("invoice_count", "subtotal_cents", "tax_cents", "freight_cents", "total_cents")),
+    PartSpendRollups: (("month", "part_number"), ("line_count", "quantity", "extended_cents")),
+    AccountSpendRollups: (("month", "account_code"), ("allocation_count", "amount_cents")),
+}
+# ``by`` parameter of the endpoint -> rollup model and its dimension column.
+DIMENSIONS = {
+    "vendor": (VendorSpendRollups, "vendor"),
+    "part": (PartSpendRollups, "part_number"),
+    "account": (AccountSpendRollups, "account_code"),
+}
+# Rollup deltas: model -> key -> counter -> amount.
+Deltas = Dict[type, Dict[Tuple[str, str], Dict[str, int]]]
+
+
+def cents(amount: Optional[float]) -> int:
+    return int(round((amount or 0.0) * 100))
+
+
+def month_key(invoice: Invoices) -> str:
+    stamp = invoice.invoice_date or invoice.created_at or datetime.utcnow()
+    return stamp.strftime("%Y-%m")
+
+
+def invoice_deltas(invoice: Invoices, lines: Iterable, allocations: Iterable, sign: int = 1) -> Deltas:
+    """Contribution of one invoice; ``lines``/``allocations`` may be ORM rows or parsed schemas."""
+
+    from app.services import normalize_vendor
+
+    month = month_key(invoice)
+    deltas: Deltas = {model: defaultdict(lambda: defaultdict(int)) for model in ROLLUPS}
+    vendor = deltas[VendorSpendRollups][(month, normalize_vendor(invoice.vendor_name))]
+    vendor["invoice_count"] += sign
+    vendor["subtotal_cents"] += sign * cents(invoice.subtotal)
+    vendor["tax_cents"] += sign * cents(invoice.tax)
+    vendor["freight_cents"] += sign * cents(invoice.freight)
+    vendor["total_cents"] += sign * cents(invoice.total)
+    for line in lines:
+        part = deltas[PartSpendRollups][(month, line.part_number)]
+        part["line_count"] += sign
+        part["quantity"] += sign * (line.quantity or 0)
+        part["extended_cents"] += sign * cents(line.extended_cost)
+    for allocation in allocations:
+        account = deltas[AccountSpendRollups][(month, allocation.account_code)]
+        account["allocation_count"] += sign
+        account["amount_cents"] += sign * cents(allocation.amount)
+    return deltas
+
+
+def merge_deltas(target: Deltas, source: Deltas) -> Deltas:
+    for model, rows in source.items():
+        for key, counters in rows.items():
+            bucket = target.setdefault(model, defaultdict(lambda: defaultdict(int)))[key]
+            for name, value in counters.items():
+                bucket[name] += value
+    return target
+
+
+def _upsert(db: Session, model: type, values: dict, key_names: Tuple[str, ...], counter_names: Tuple[str, ...]) -> None:
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(model).values(**values)
+        table = model.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_names),
+            set_={name: table.c[name] + stmt.excluded[name] for name in counter_names},
+        )
+        db.execute(stmt)
+        return
+    row = db.get(model, tuple(values[name] for name in key_names))
+    if row is None:
+        db.add(model(**values))
+    else:
+        for name in counter_names:
+            setattr(row, name, getattr(row, name) + values[name])
+
+
+def apply_deltas(db: Session, deltas: Deltas) -> None:
+    """Add ``deltas`` to the rollup tables and drop rows that reach zero."""
+
+    for model, rows in deltas.items():
+        key_names, counter_names = ROLLUPS[model]
+        count_column = getattr(model, counter_names[0])
+        emptied = []
+        for key, counters in rows.items():
+            if not any(counters.values()):
+                continue
+            values = dict(zip(key_names, key))
+            values.update({name: counters.get(name, 0) for name in counter_names})
+            _upsert(db, model, values, key_names, counter_names)
+            if counters.get(counter_names[0], 0) < 0:
+                emptied.append(key)
+        for key in emptied:
+            conditions = [getattr(model, name) == value for name, value in zip(key_names, key)]
+            db.execute(delete(model).where(*conditions, count_column <= 0))
+
+
+def record_invoice(db: Session, invoice: Invoices, lines: Iterable, allocations: Iterable) -> None:
+    apply_deltas(db, invoice_deltas(invoice, lines, allocations))
+
+
+def rebuild(db: Session, batch_size: int = 500) -> Dict[str, int]:
+    """Recompute every rollup from the stored invoices."""
+
+    for model in ROLLUPS:
+        db.execute(delete(model))
+    totals: Deltas = {}
+    stmt = (
+        select(Invoices)
+        .options(selectinload(Invoices.lines), selectinload(Invoices.allocations))
+        .order_by(Invoices.id)
+        .execution_options(yield_per=batch_size)
+    )
+    invoices = 0
+    for invoice in db.scalars(stmt):
+        merge_deltas(totals, invoice_deltas(invoice, invoice.lines, invoice.allocations))
+        invoices += 1
+    apply_deltas(db, totals)
+    db.commit()
+    counts = {model.__tablename__: db.scalar(select(func.count()).select_from(model)) for model in ROLLUPS}
+    logger.info("Rebuilt spend rollups from %s invoices: %s", invoices, counts)
+    return {"invoices": invoices, **counts}
+
+
+def check_rollups(db: Session) -> bool:
+    """Warn when invoices exist but the rollups are empty (a database that predates them).
+
+    The backfill is a full ``rebuild``; it is left to ``python -m
+    app.analytics rebuild`` rather than run at startup, where it would delay
+    the server and race with invoices ingested meanwhile.
+    """
+
+    if db.scalar(select(VendorSpendRollups.month).limit(1)) is None and db.scalar(select(Invoices.id).limit(1)) is not None:
+        logger.warning("Spend rollups are empty; run `python -m app.analytics rebuild` to backfill /analytics/spend")
+        return False
+    return True
+
+
+def spend_report(
+    db: Session,
+    by: str = "vendor",
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    key: Optional[str] = None,
+    by_month: bool = True,
+    limit: int = 100,
+) -> List[dict]:
+    """Grouped spend from the rollup tables, largest first within each month.
+
+    With ``by_month`` the ``limit`` applies to each month, not to the whole
+    report. A vendor ``key`` is normalized like the rollups' vendor column.
+    """
+
+    model, dimension = DIMENSIONS[by]
+    key_names, counter_names = ROLLUPS[model]
+    amount = getattr(model, counter_names[-1])
+    dimension_column = getattr(model, dimension)
+    group = [model.month, dimension_column] if by_month else [dimension_column]
+    columns = [func.sum(getattr(model, name)).label(name) for name in counter_names]
+    stmt = select(*group, *columns).group_by(*group)
+    if month_from:
+        stmt = stmt.where(model.month >= month_from)
+    if month_to:
+        stmt = stmt.where(model.month <= month_to)
+    if key is not None:
+        if by == "vendor":
+            from app.services import normalize_vendor
+
+            key = normalize_vendor(key)
+        stmt = stmt.where(dimension_column == key)
+    if by_month:
+        rank = func.row_number().over(partition_by=model.month, order_by=(func.sum(amount).desc(), dimension_column))
+        ranked = stmt.add_columns(rank.label("rank")).subquery()
+        stmt = (
+            select(*(ranked.c[name] for name in ("month", dimension, *counter_names)))
+            .where(ranked.c.rank <= limit)
+            .order_by(ranked.c.month, ranked.c.rank)
+        )
+    else:
+        stmt = stmt.order_by(func.sum(amount).desc(), dimension_column).limit(limit)
+
+    results = []
+    for row in db.execute(stmt):
+        item = {"month": row.month} if by_month else {}
+        item[dimension] = getattr(row, dimension)
+        for name in counter_names:
+            value = getattr(row, name)
+            if name.endswith("_cents"):
+                item[name[: -len("_cents")]] = value / 100
+            else:
+                item[name] = value
+        results.append(item)
+    return results
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description="Spend rollup maintenance")
+    cli.add_argument("command", choices=["rebuild"])
+    cli.parse_args()
+
+    from app.database import SessionLocal, ensure_schema, init_engine
+
+    ensure_schema(init_engine())
+    with SessionLocal() as db:
+        print(rebuild(db))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,308 @@
+"""Cold storage for the bulky parts of old invoices.
+
+``archive_invoices`` moves the content of invoices dated before a cutoff
+out of the hot tables. That content is ``invoices.raw_text``, the
+``invoice_pages`` rows and the ``charges`` rows. It goes to a SQLite
+sidecar (``InvoiceArchive``) as one zlib-compressed JSON blob per invoice,
+already in the API response shape. An ``archived_invoices`` row marks each
+moved invoice.
+
+The header, lines, allocations, order references and shipments stay hot.
+Reports, the spend rollups, re-parse deltas and receiving all read them.
+
+``serializers.invoice_payloads`` and ``serialize_invoice`` call
+``rehydrate``, so ``/invoices/{id}``, the list and upload responses return
+the same bytes as before archiving. Re-parsing an archived invoice writes
+fresh content to the hot tables and drops its marker.
+
+``python -m app.archive run`` archives, optionally VACUUMs, and reports
+hot-table sizes and read latency before and after. ``python -m app.archive
+stats`` reports them without archiving.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sqlite3
+import statistics
+import time
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import ArchivedInvoices, Charges, InvoicePages, Invoices
+from app.schemas import Invoice
+from app.serializers import CHILD_SHAPES, INVOICE_SHAPE, _load_children, dumps, invoice_payloads
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILENAME = "invoice_archive.sqlite3"
+# Serializer child shapes moved to the archive, with their hot tables.
+ARCHIVED_CHILDREN = {"pages": InvoicePages, "charges": Charges}
+
+
+class InvoiceArchive:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS archived_invoices ("
+                "invoice_id INTEGER PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, archived_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def put_many(self, bodies: Dict[int, bytes]) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO archived_invoices (invoice_id, body, size, archived_at) VALUES (?, ?, ?, ?)",
+                    [(invoice_id, body, len(body), now) for invoice_id, body in bodies.items()],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_many(self, invoice_ids: Iterable[int]) -> Dict[int, dict]:
+        ids = list(invoice_ids)
+        found: Dict[int, dict] = {}
+        with self._lock:
+            conn = self._connection()
+            # Stay under SQLite's bound-parameter limit.
+            for start in range(0, len(ids), 500):
+                batch = ids[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for invoice_id, body in conn.execute(
+                    f"SELECT invoice_id, body FROM archived_invoices WHERE invoice_id IN ({placeholders})", batch
+                ):
+                    found[invoice_id] = json.loads(zlib.decompress(body))
+        return found
+
+    def prune(self, keep: Iterable[int]) -> int:
+        """Delete blobs whose invoice is no longer archived (re-parsed since)."""
+
+        keep = set(keep)
+        with self._lock:
+            conn = self._connection()
+            stale = [row[0] for row in conn.execute("SELECT invoice_id FROM archived_invoices") if row[0] not in keep]
+            conn.executemany("DELETE FROM archived_invoices WHERE invoice_id = ?", [(invoice_id,) for invoice_id in stale])
+        return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM archived_invoices").fetchone()
+        return {"entries": entries, "bytes": size, "file_bytes": self.path.stat().st_size if self.path.exists() else 0}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_archive: Optional[InvoiceArchive] = None
+
+
+def get_invoice_archive() -> InvoiceArchive:
+    global _archive
+    settings = get_settings()
+    path = settings.invoice_archive_path or settings.storage_path / ARCHIVE_FILENAME
+    if _archive is None or _archive.path != path:
+        if _archive is not None:
+            _archive.close()
+        _archive = InvoiceArchive(path)
+    return _archive
+
+
+def archive_cutoff(months: int, today: Optional[date] = None) -> date:
+    return (today or date.today()) - timedelta(days=round(months * 30.44))
+
+
+def archive_invoices(db: Session, before: date, batch_size: int = 200) -> dict:
+    """Move content of invoices dated before ``before`` to the archive."""
+
+    age = func.coalesce(Invoices.invoice_date, func.date(Invoices.created_at))
+    archive = get_invoice_archive()
+    totals = {"invoices": 0, "raw_bytes": 0, "stored_bytes": 0}
+    while True:
+        ids = db.scalars(
+            select(Invoices.id)
+            .outerjoin(ArchivedInvoices, ArchivedInvoices.invoice_id == Invoices.id)
+            .where(ArchivedInvoices.invoice_id.is_(None), age < before)
+            .order_by(Invoices.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+
+        raw_text = dict(db.execute(select(Invoices.id, Invoices.raw_text).where(Invoices.id.in_(ids))).all())
+        children = {name: _load_children(db, CHILD_SHAPES[name], ids) for name in ARCHIVED_CHILDREN}
+        bodies: Dict[int, bytes] = {}
+        markers = []
+        for invoice_id in ids:
+            payload = dumps({"raw_text": raw_text[invoice_id], **{name: rows.get(invoice_id, []) for name, rows in children.items()}})
+            bodies[invoice_id] = zlib.compress(payload, 6)
+            markers.append(ArchivedInvoices(invoice_id=invoice_id, raw_bytes=len(payload), stored_bytes=len(bodies[invoice_id])))
+
+        # Cold copy first: a crash before the hot commit only leaves a blob
+        # that the next run overwrites.
+        archive.put_many(bodies)
+        totals["invoices"] += len(ids)
+        totals["raw_bytes"] += sum(marker.raw_bytes for marker in markers)
+        totals["stored_bytes"] += sum(marker.stored_bytes for marker in markers)
+        for model in ARCHIVED_CHILDREN.values():
+            db.execute(delete(model).where(model.invoice_id.in_(ids)))
+        db.execute(update(Invoices).where(Invoices.id.in_(ids)).values(raw_text=None).execution_options(synchronize_session=False))
+        db.add_all(markers)
+        db.commit()
+    return totals
+
+
+def archived_ids_statement(payloads: List[dict]):
+    return select(ArchivedInvoices.invoice_id).where(ArchivedInvoices.invoice_id.in_([payload["id"] for payload in payloads]))
+
+
+def restore_archived(payloads: List[dict], archived: List[int]) -> int:
+    """Fill the sidecar content of the ``archived`` ids back into ``payloads``."""
+
+    if not archived:
+        return 0
+    stored = get_invoice_archive().get_many(archived)
+    for payload in payloads:
+        content = stored.get(payload["id"])
+        if content is not None:
+            payload.update(content)
+        elif payload["id"] in archived:
+            logger.error("Archived content for invoice %s is missing from %s", payload["id"], get_invoice_archive().path)
+    return len(stored)
+
+
+def rehydrate(db: Session, payloads: List[dict]) -> int:
+    """Fill archived content back into invoice payloads; returns how many."""
+
+    if not payloads:
+        return 0
+    return restore_archived(payloads, db.scalars(archived_ids_statement(payloads)).all())
+
+
+def rehydrate_invoice(db: Session, invoice: Invoice) -> Invoice:
+    payload = invoice.model_dump()
+    return Invoice.model_validate(payload) if rehydrate(db, [payload]) else invoice
+
+
+def forget_archived(db: Session, invoice_id: int) -> None:
+    """The invoice's content is hot again (re-parsed); its blob is pruned later."""
+
+    db.execute(delete(ArchivedInvoices).where(ArchivedInvoices.invoice_id == invoice_id))
+
+
+def hot_table_stats(db: Session) -> dict:
+    """Row counts and text bytes of the hot tables, plus SQLite page usage."""
+
+    stats = {
+        "tables": {
+            "invoices": {"rows": db.scalar(select(func.count()).select_from(Invoices))},
+            "invoice_pages": {"rows": db.scalar(select(func.count()).select_from(InvoicePages))},
+            "charges": {"rows": db.scalar(select(func.count()).select_from(Charges))},
+        },
+        "text_bytes": (db.scalar(select(func.coalesce(func.sum(func.length(Invoices.raw_text)), 0))) or 0)
+        + (db.scalar(select(func.coalesce(func.sum(func.length(InvoicePages.text_content)), 0))) or 0),
+        "archived_invoices": db.scalar(select(func.count()).select_from(ArchivedInvoices)),
+    }
+    if db.get_bind().dialect.name == "sqlite":
+        page_size = db.connection().exec_driver_sql("PRAGMA page_size").scalar()
+        stats["file_bytes"] = db.connection().exec_driver_sql("PRAGMA page_count").scalar() * page_size
+        stats["free_bytes"] = db.connection().exec_driver_sql("PRAGMA freelist_count").scalar() * page_size
+        try:
+            # dbstat is optional in SQLite builds.
+            for name, size in db.connection().exec_driver_sql("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"):
+                if name in stats["tables"]:
+                    stats["tables"][name]["bytes"] = size
+        except OperationalError:
+            db.rollback()
+    return stats
+
+
+def _timed_ms(fn, repeats: int) -> List[float]:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def read_latency(db: Session, sample: int = 50, repeats: int = 3) -> dict:
+    """Median/max milliseconds for the hot read paths on recent invoices."""
+
+    recent = db.scalars(select(Invoices.id).order_by(Invoices.id.desc()).limit(sample)).all()
+    detail = [ms for invoice_id in recent for ms in _timed_ms(lambda: invoice_payloads(db, [invoice_id]), repeats)]
+    headers = _timed_ms(
+        lambda: db.execute(select(*INVOICE_SHAPE.columns).order_by(Invoices.created_at.desc()).limit(100)).all(), repeats * 5
+    )
+    return {
+        "invoice_detail_ms": {"median": statistics.median(detail), "max": max(detail)} if detail else None,
+        "invoice_headers_ms": {"median": statistics.median(headers), "max": max(headers)},
+    }
+
+
+def vacuum(db: Session) -> None:
+    db.commit()
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+
+
+def run(db: Session, before: date, compact: bool = False) -> dict:
+    report = {"before": {**hot_table_stats(db), "latency": read_latency(db)}}
+    report["archived"] = archive_invoices(db, before)
+    report["pruned"] = get_invoice_archive().prune(db.scalars(select(ArchivedInvoices.invoice_id)))
+    if compact and db.get_bind().dialect.name == "sqlite":
+        vacuum(db)
+    report["after"] = {**hot_table_stats(db), "latency": read_latency(db)}
+    report["archive"] = get_invoice_archive().stats()
+    logger.info("Archived %s invoices before %s: %s", report["archived"]["invoices"], before, report)
+    return report
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description="Invoice archival")
+    cli.add_argument("command", choices=["run", "stats"])
+    cli.add_argument("--before", type=date.fromisoformat, help="archive invoices dated before this day (YYYY-MM-DD)")
+    cli.add_argument("--vacuum", action="store_true", help="VACUUM the hot SQLite database afterwards")
+    args = cli.parse_args()
+
+    from app.database import SessionLocal, ensure_schema, init_engine
+
+    ensure_schema(init_engine())
+    with SessionLocal() as db:
+        if args.command == "stats":
+            print(json.dumps({**hot_table_stats(db), "latency": read_latency(db), "archive": get_invoice_archive().stats()}, indent=2))
+            return
+        months = get_settings().invoice_archive_after_months
+        if args.before is None and not months:
+            cli.error("pass --before or set PARTSUITE_INVOICE_ARCHIVE_AFTER_MONTHS")
+        before = args.before or archive_cutoff(months)
+        print(json.dumps(run(db, before, compact=args.vacuum), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,213 @@
+"""Routes served on the async engine when ``async_mode`` is on.
+
+``create_app`` imports this module and registers ``async_router`` ahead of
+the sync routes only in async mode, so the default deployment never loads
+``sqlalchemy.ext.asyncio``.
+
+The invoice reads, the not-received report and file downloads await their
+queries on the async engine and share the sync handlers' statements, ETags
+and invoice cache, so responses are identical. Parsing, the idempotency
+bookkeeping, the part index sync, the spend rollups and the duplicate report
+are sync code paths; parsing and the bookkeeping run on a dedicated executor
+with their own sync sessions, and the reports go through
+``AsyncSession.run_sync``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.analytics import spend_report
+from app.cache import invoice_cache
+from app.config import get_settings
+from app.database import SessionLocal, get_async_db, get_engine
+from app.main import (
+    INVOICE_CACHE_CONTROL,
+    MONTH_PATTERN,
+    duplicates_report,
+    etag_matches,
+    file_cache_control,
+    file_etag,
+    finalize_upload,
+    ingest_upload,
+    invoice_etag,
+    is_content_addressed,
+    reparse_file,
+    replay_response,
+    request_name,
+    stored_file_response,
+)
+from app.memory_profile import memory_stage, profile_upload
+from app.models import Files, Invoices, Parts
+from app.part_index import part_index
+from app.schemas import Invoice as InvoiceSchema, ParseTrigger, UploadResponse
+from app.serializers import invoice_json_async, invoice_list_json_async
+from app.storage import hash_stored
+from app.uploads import claim_idempotency_key, release_idempotency_key, store_idempotent_response
+
+async_router = APIRouter()
+_parse_executor: Optional[ThreadPoolExecutor] = None
+
+
+def parse_executor() -> ThreadPoolExecutor:
+    global _parse_executor
+    if _parse_executor is None:
+        workers = max(get_settings().admission_max_jobs, 1)
+        _parse_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse")
+    return _parse_executor
+
+
+def shutdown_parse_executor() -> None:
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=True)
+        _parse_executor = None
+
+
+def _in_session(fn, *args):
+    get_engine()
+    with SessionLocal() as db:
+        return fn(db, *args)
+
+
+async def run_parse(fn, *args):
+    # Copy the context so request-scoped state (SQL and memory profiling)
+    # follows the job.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(parse_executor(), context.run, _in_session, fn, *args)
+
+
+async def idempotent_async(key: Optional[str], request: Request, produce: Callable[[], Awaitable[Any]]) -> Any:
+    if not key:
+        return await produce()
+    stored = await run_parse(claim_idempotency_key, key, request_name(request))
+    if stored is not None:
+        return replay_response(stored)
+    try:
+        result = await produce()
+    except BaseException:
+        await run_parse(release_idempotency_key, key)
+        raise
+    await run_parse(store_idempotent_response, key, jsonable_encoder(result))
+    return result
+
+
+@async_router.post("/upload", response_model=List[UploadResponse])
+async def upload_files_async(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    async def ingest_all() -> List[UploadResponse]:
+        results: List[UploadResponse] = []
+        for upload in files:
+            with profile_upload(upload.filename) as memory:
+                with memory_stage("read"):
+                    data = await upload.read()
+                result = await run_parse(ingest_upload, upload.filename, data)
+            if memory is not None:
+                result.memory = memory.result
+            results.append(result)
+        return results
+
+    return await idempotent_async(idempotency_key, request, ingest_all)
+
+
+@async_router.post("/uploads/{session_id}/finalize", response_model=UploadResponse)
+async def finalize_upload_async(
+    session_id: str,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    x_content_sha256: Optional[str] = Header(None),
+):
+    return await idempotent_async(idempotency_key, request, lambda: run_parse(finalize_upload, session_id, x_content_sha256))
+
+
+@async_router.post("/parse/trigger", response_model=List[InvoiceSchema])
+async def trigger_parse_async(body: ParseTrigger):
+    return [await run_parse(reparse_file, file_id) for file_id in body.file_ids]
+
+
+@async_router.get("/invoices", response_model=List[InvoiceSchema])
+async def list_parsed_invoices_async(db: AsyncSession = Depends(get_async_db)):
+    return Response(content=await invoice_list_json_async(db), media_type="application/json")
+
+
+@async_router.get("/invoices/{invoice_id}", response_model=InvoiceSchema)
+async def get_invoice_async(invoice_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    version = await db.scalar(select(Invoices.version).where(Invoices.id == invoice_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    etag = invoice_etag(invoice_id, version)
+    headers = {"ETag": etag, "Cache-Control": INVOICE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = invoice_cache.get(invoice_id, version)
+    if body is None:
+        body = await invoice_json_async(db, invoice_id)
+        invoice_cache.put(invoice_id, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@async_router.get("/files/{file_id}")
+async def get_file_async(file_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    file = await db.get(Files, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not is_content_addressed(file):
+        current = await run_in_threadpool(hash_stored, file.original_path)
+        if current != file.content_hash:
+            file.content_hash = current
+            await db.commit()
+    etag = file_etag(file.content_hash)
+    headers = {"ETag": etag, "Cache-Control": file_cache_control(file)}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return stored_file_response(file.original_path, file.filename, headers, request.headers.get("range"))
+
+
+@async_router.get("/reports/not-received")
+async def not_received_report_async(db: AsyncSession = Depends(get_async_db)):
+    entries = await db.scalars(select(Parts).where(Parts.received.is_(False)))
+    return [{"part_number": part.part_number, "description": part.description, "received": part.received} for part in entries]
+
+
+@async_router.get("/parts/search")
+async def search_parts_async(
+    prefix: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(20, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+):
+    settings = get_settings()
+    if not part_index.loaded or time.monotonic() - part_index.synced_at >= settings.part_index_sync_seconds:
+        await db.run_sync(part_index.ensure_current, settings.part_index_sync_seconds, settings.part_index_reload_seconds)
+    return [entry.to_dict() for entry in part_index.search(prefix, limit)]
+
+
+@async_router.get("/analytics/spend")
+async def spend_analytics_async(
+    by: Literal["vendor", "part", "account"] = "vendor",
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    key: Optional[str] = None,
+    by_month: bool = True,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await db.run_sync(spend_report, by, month_from, month_to, key, by_month, limit)
+
+
+@async_router.get("/reports/duplicates")
+async def duplicates_report_async(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(duplicates_report)
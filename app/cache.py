@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """Small thread-safe LRU map; a ``maxsize`` of 0 disables caching."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, V] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def resize(self, maxsize: int) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class InvoiceCache:
+    """Serialized invoice JSON keyed by invoice id and tagged with its version."""
+
+    def __init__(self, maxsize: int) -> None:
+        self._lru: LRUCache[tuple[int, bytes]] = LRUCache(maxsize)
+
+    def get(self, invoice_id: int, version: int) -> Optional[bytes]:
+        entry = self._lru.get(invoice_id)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def put(self, invoice_id: int, version: int, body: bytes) -> None:
+        self._lru.put(invoice_id, (version, body))
+
+    def resize(self, maxsize: int) -> None:
+        self._lru.resize(maxsize)
+
+    def invalidate(self, invoice_id: int) -> None:
+        self._lru.invalidate(invoice_id)
+
+    def clear(self) -> None:
+        self._lru.clear()
+
+
+# Sized from settings by ``create_app``.
+invoice_cache = InvoiceCache(0)
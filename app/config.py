@@ -1,19 +1,118 @@
 from pathlib import Path
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./dev.db"
     storage_path: Path = Path("storage")
+    invoice_cache_size: int = 256
+    # Invoices persisted per transaction while ingesting a packet.
+    ingest_commit_every: int = 50
+    # A running ingestion job not updated for this long is presumed dead
+    # (its worker crashed) and the next upload of the same bytes resumes it.
+    ingest_job_lease_seconds: float = 600.0
+    # Page-parallel PDF extraction; 0 or 1 keeps extraction in-process.
+    extract_workers: int = 0
+    extract_chunk_pages: int = 25
+    # Read line items from PDF character coordinates when a table is found.
+    table_layout: bool = True
+    # Record per-pattern timings for /debug/parser-profile.
+    parser_profile: bool = False
+    # Parse time budget per document, charged only while parsing; see
+    # parser.iter_parsed_invoices. 0 disables the budget.
+    parser_time_budget_ms: int = 10_000
+    # Per-request SQL statement profiling (Server-Timing header and
+    # /debug/sql-profile). Statements slower than sql_slow_ms are logged,
+    # with the SQLite query plan when sql_explain_slow is set.
+    sql_profile: bool = False
+    sql_slow_ms: float = 100.0
+    sql_explain_slow: bool = False
+    sql_profile_top: int = 5
+    # tracemalloc profile of every upload by ingestion stage, returned as
+    # "memory" in the upload response. Uploads whose traced peak exceeds
+    # memory_budget_mb (0 = no budget) are logged.
+    memory_profile: bool = False
+    memory_budget_mb: float = 512.0
+    memory_profile_top: int = 5
+    # Expose /debug/* endpoints (development only).
+    debug_endpoints: bool = False
+    # Serve reads from async routes on an async engine (aiosqlite for SQLite)
+    # and run parsing on a dedicated executor. Off keeps the sync routes.
+    async_mode: bool = False
+    # Originals are sharded by content hash, this many two-character levels.
+    storage_shard_depth: int = 2
+    # Retention (python -m app.storage retention); 0 disables each step.
+    storage_compress_after_days: int = 0
+    storage_archive_after_months: int = 0
+    storage_hot_max_bytes: int = 0
+    # Archive tier location; defaults to <storage_path>/archive.
+    storage_archive_path: Optional[Path] = None
+    # Invoice archival (python -m app.archive run): page text, raw text and
+    # charges of invoices older than this move to a compressed SQLite
+    # sidecar; 0 disables it. The sidecar defaults to
+    # <storage_path>/invoice_archive.sqlite3.
+    invoice_archive_after_months: int = 0
+    invoice_archive_path: Optional[Path] = None
+    # /parts/search picks up parts written by other processes this often,
+    # and reloads the whole index (refreshing billed/invoiced/received)
+    # every part_index_reload_seconds; 0 never reloads.
+    part_index_sync_seconds: float = 5.0
+    part_index_reload_seconds: float = 300.0
+    # Admission control for /upload and /parse/trigger. Parse jobs beyond
+    # admission_max_jobs wait in a queue of admission_queue_size; 0 jobs
+    # disables admission control.
+    admission_max_bytes: int = 512 * 1024 * 1024
+    admission_max_jobs: int = 4
+    admission_queue_size: int = 16
+    admission_queue_timeout: float = 30.0
+    admission_retry_after: int = 5
+    # Worker threads for sync routes; parse jobs never take more than
+    # admission_max_jobs of them, the rest stay free for reads.
+    worker_threads: int = 40
+    # Compressed size bound for the extracted-text cache; 0 disables it.
+    extraction_cache_max_bytes: int = 256 * 1024 * 1024
+    # Resumable uploads (/uploads): largest accepted chunk and whole upload,
+    # and how long an untouched session and its staged bytes are kept.
+    upload_chunk_max_bytes: int = 32 * 1024 * 1024
+    upload_max_bytes: int = 512 * 1024 * 1024
+    upload_session_ttl_hours: float = 24.0
+    # Responses remembered for Idempotency-Key replays.
+    idempotency_ttl_hours: float = 24.0
+    # An Idempotency-Key still "processing", or an upload session still
+    # "finalizing", this long after it was claimed is presumed abandoned and
+    # can be claimed again by a retry.
+    upload_lease_seconds: float = 600.0
 
     class Config:
         env_prefix = "PARTSUITE_"
         env_file = ".env"
 
+    def ensure_directories(self) -> None:
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        (self.storage_path / "originals").mkdir(parents=True, exist_ok=True)
+        (self.storage_path / "summaries").mkdir(parents=True, exist_ok=True)
+        (self.storage_path / "uploads").mkdir(parents=True, exist_ok=True)
+
+
+_settings: Optional[Settings] = None
+
 
 def get_settings() -> Settings:
-    settings = Settings()
-    settings.storage_path.mkdir(parents=True, exist_ok=True)
-    (settings.storage_path / "originals").mkdir(parents=True, exist_ok=True)
-    (settings.storage_path / "summaries").mkdir(parents=True, exist_ok=True)
+    """Return the process-wide settings, reading the environment only once.
+
+    Directories are created by the app lifespan and by storage writes, not
+    here, so importing a module that needs settings has no side effects.
+    """
+
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
+
+
+def configure_settings(settings: Settings) -> Settings:
+    global _settings
+    _settings = settings
     return settings
@@ -1,23 +1,115 @@
-from sqlalchemy import create_engine, inspect
-from sqlalchemy.orm import declarative_base, sessionmaker
+from __future__ import annotations
 
-from app.config import get_settings
+import logging
+from typing import Optional
 
-settings = get_settings()
-engine = create_engine(settings.database_url, connect_args={"check_same_thread": False} if settings.database_url.startswith("sqlite") else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from sqlalchemy import create_engine, inspect, literal
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+
+from app.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+_engine: Optional[Engine] = None
+# Async mode only; created by init_async_engine so the asyncio extension and
+# aiosqlite are not imported otherwise.
+_async_engine = None
+_async_sessionmaker = None
+
+
+def create_db_engine(database_url: str) -> Engine:
+    return create_engine(database_url, connect_args={"check_same_thread": False} if database_url.startswith("sqlite") else {})
+
+
+def init_engine(settings: Optional[Settings] = None) -> Engine:
+    """Create the engine for ``settings`` and bind ``SessionLocal`` to it."""
+
+    global _engine
+    settings = settings or get_settings()
+    dispose_engine()
+    _engine = create_db_engine(settings.database_url)
+    if settings.sql_profile:
+        from app.sql_profile import instrument
+
+        instrument(_engine)
+    SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_engine() -> Engine:
+    return _engine if _engine is not None else init_engine()
+
+
+def dispose_engine() -> None:
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def async_database_url(database_url: str) -> str:
+    """Map a sync URL to its async driver (``sqlite://`` -> ``sqlite+aiosqlite://``)."""
+
+    drivers = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+    scheme, sep, rest = database_url.partition("://")
+    return f"{drivers.get(scheme, scheme)}{sep}{rest}"
 
-def ensure_schema():
-    """Create tables and repair a mismatched SQLite schema.
 
-    When the dev SQLite database exists from an older revision, new columns
-    (for example, recent billing period fields) are missing. SQLite will not
-    add them automatically on ``create_all``; instead we drop and recreate the
-    tables when we detect a mismatch. This keeps local runs from failing with
-    ``OperationalError: table invoices has no column ...`` while avoiding
-    destructive behavior on non-SQLite databases.
+def init_async_engine(settings: Optional[Settings] = None):
+    """Create the async engine and session factory used by the async routes."""
+
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    global _async_engine, _async_sessionmaker
+    settings = settings or get_settings()
+    _async_engine = create_async_engine(async_database_url(settings.database_url))
+    if settings.sql_profile:
+        from app.sql_profile import instrument
+
+        instrument(_async_engine.sync_engine)
+    _async_sessionmaker = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = _async_sessionmaker = None
+
+
+def _add_column_sql(engine: Engine, table_name: str, column) -> str:
+    """``ALTER TABLE ... ADD COLUMN`` for a model column missing from the database."""
+
+    dialect = engine.dialect
+    quote = dialect.identifier_preparer.quote
+    ddl = f"ALTER TABLE {quote(table_name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        ddl += f" DEFAULT {literal(default).compile(dialect=dialect, compile_kwargs={'literal_binds': True})}"
+    if not column.nullable:
+        if default is None:
+            # Existing rows have no value to give it; new rows get the ORM default.
+            logger.warning("Adding %s.%s as nullable: no scalar default for existing rows", table_name, column.name)
+        else:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def ensure_schema(engine: Optional[Engine] = None):
+    """Create missing tables, columns and indexes without touching existing data.
+
+    ``create_all`` only creates whole tables, so a database from an older
+    revision would fail with ``OperationalError: table invoices has no
+    column ...``. Columns added to an existing model since (dedupe keys,
+    invoice versions, file content hashes) are added with ``ALTER TABLE ...
+    ADD COLUMN``, using the column's scalar default for existing rows, and
+    any index the models declare but the database lacks is created.
+    Invoices stored before duplicate keys existed are given their key.
     """
 
     # Ensure all ORM models are registered on ``Base.metadata`` even if this
@@ -25,24 +117,40 @@ def ensure_schema():
     # partially populated schema when new columns are added in future merges.
     import app.models  # noqa: F401
 
+    engine = engine or get_engine()
     inspector = inspect(engine)
-    # Only auto-recreate the schema for SQLite dev environments.
-    if engine.url.get_backend_name() == "sqlite":
-        existing_tables = inspector.get_table_names()
-        if "invoices" in existing_tables:
-            existing_columns = {col["name"] for col in inspector.get_columns("invoices")}
-            expected_columns = set(Base.metadata.tables["invoices"].c.keys())
-            if not expected_columns.issubset(existing_columns):
-                Base.metadata.drop_all(bind=engine)
-                Base.metadata.create_all(bind=engine)
-                return
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for name, table in Base.metadata.tables.items():
+            if name not in existing_tables:
+                continue
+            existing_columns = {col["name"] for col in inspector.get_columns(name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    logger.info("Adding column %s.%s", name, column.name)
+                    conn.exec_driver_sql(_add_column_sql(engine, name, column))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
 
     Base.metadata.create_all(bind=engine)
 
+    from app.services import backfill_dedupe_keys
+
+    with Session(bind=engine) as db:
+        backfill_dedupe_keys(db)
+
 
 def get_db():
+    get_engine()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    if _async_sessionmaker is None:
+        init_async_engine()
+    async with _async_sessionmaker() as db:
+        yield db
@@ -0,0 +1,190 @@
+"""pdfminer text extraction, optionally split across worker processes.
+
+Large statements are split into page ranges; each worker opens the same file
+read-only through ``mmap`` and extracts only its range. pdfminer ends every
+page with a form feed, so concatenating the ranges in order reproduces the
+single-process output exactly.
+
+Layout line-item tables (``app.tables``) come from the same pass: the
+converter that writes a page's text also hands the page's characters to the
+table reader when the text looks like it has a table header, so a PDF is
+only interpreted once, serially or in the workers.
+"""
+
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from io import BytesIO, StringIO
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from app.config import get_settings
+from app.schemas import InvoiceLine
+from app.storage import is_compressed
+from app.tables import HEADER_HINT, page_table_lines, page_words
+
+logger = logging.getLogger(__name__)
+
+# Keyword arguments for pdfminer's ``LAParams``; part of the extraction cache
+# key, so changing them invalidates cached text.
+LAYOUT_PARAMS: dict = {}
+
+# Worker processes are started on first use and kept for the life of the
+# process (the app lifespan shuts them down), so a large PDF does not pay
+# for interpreter start-up and pdfminer imports in every worker. A call with
+# a different worker count replaces the pool.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = Lock()
+
+
+def extract_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    stale = None
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers:
+            stale, _pool = _pool, None
+        if _pool is None:
+            _pool, _pool_workers = ProcessPoolExecutor(max_workers=workers), workers
+        pool = _pool
+    if stale is not None:
+        # Extractions already submitted to the old pool still finish.
+        stale.shutdown(wait=False)
+    return pool
+
+
+def shutdown_extract_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def pdf_page_count(fp) -> int:
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    document = PDFDocument(PDFParser(fp))
+    return int(resolve1(document.catalog["Pages"])["Count"])
+
+
+def page_ranges(page_count: int, chunk_pages: int) -> List[Tuple[int, int]]:
+    chunk_pages = max(chunk_pages, 1)
+    return [(start, min(start + chunk_pages, page_count)) for start in range(0, page_count, chunk_pages)]
+
+
+PageTables = Dict[int, List[InvoiceLine]]
+
+
+@lru_cache(maxsize=None)
+def _converter_class():
+    from pdfminer.converter import TextConverter
+
+    class TextAndTablesConverter(TextConverter):
+        """``TextConverter`` that also reads line-item tables from each page."""
+
+        def __init__(self, *args, first_page: int = 0, tables: bool = False, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            self.page_index = first_page
+            self.read_tables = tables
+            self.tables: PageTables = {}
+            self._page_text: List[str] = []
+
+        def write_text(self, text: str) -> None:
+            self._page_text.append(text)
+            super().write_text(text)
+
+        def receive_layout(self, ltpage) -> None:
+            self._page_text = []
+            super().receive_layout(ltpage)
+            # Layout analysis keeps every character, so the table reader sees
+            # the same coordinates it would get from a separate raw pass.
+            if self.read_tables and HEADER_HINT.search("".join(self._page_text)):
+                lines = page_table_lines(page_words(ltpage))
+                if lines:
+                    self.tables[self.page_index] = lines
+            self.page_index += 1
+
+    return TextAndTablesConverter
+
+
+def extract_pages(fp: BinaryIO, pages: Optional[Iterable[int]] = None, first_page: int = 0, tables: bool = False) -> Tuple[str, PageTables]:
+    """Text of ``pages`` (all by default) and, with ``tables``, their line-item tables."""
+
+    # Same pipeline as ``pdfminer.high_level.extract_text``, which refuses
+    # mmap objects as input.
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    with StringIO() as output:
+        manager = PDFResourceManager(caching=True)
+        device = _converter_class()(manager, output, codec="utf-8", laparams=LAParams(**LAYOUT_PARAMS), first_page=first_page, tables=tables)
+        interpreter = PDFPageInterpreter(manager, device)
+        for page in PDFPage.get_pages(fp, pages):
+            interpreter.process_page(page)
+        return output.getvalue(), device.tables
+
+
+def extract_page_range(path: str, start: int, stop: int, tables: bool = False) -> Tuple[str, PageTables]:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        return extract_pages(view, range(start, stop), first_page=start, tables=tables)
+
+
+def extract_pdf(data: bytes, path: Optional[Path] = None, tables: bool = False) -> Tuple[str, PageTables]:
+    """Extract text with pdfminer, fanning out by page range for big PDFs.
+
+    With ``tables``, line items are read from the page layout in the same
+    pass and returned by zero-based page index. Parallel extraction kicks in
+    when ``extract_workers`` is above 1 and the document has more than
+    ``extract_chunk_pages`` pages. Workers read from ``path`` when the bytes
+    are already on disk, otherwise from a temporary copy.
+    """
+
+    settings = get_settings()
+    if settings.extract_workers > 1:
+        try:
+            page_count = pdf_page_count(BytesIO(data))
+        except Exception:
+            page_count = 0
+        if page_count > settings.extract_chunk_pages:
+            return _extract_parallel(data, path, page_count, settings.extract_chunk_pages, settings.extract_workers, tables)
+    return extract_pages(BytesIO(data), tables=tables)
+
+
+def extract_pdf_text(data: bytes, path: Optional[Path] = None) -> str:
+    return extract_pdf(data, path)[0]
+
+
+def _extract_parallel(data: bytes, path: Optional[Path], page_count: int, chunk_pages: int, workers: int, tables: bool) -> Tuple[str, PageTables]:
+    ranges = page_ranges(page_count, chunk_pages)
+    logger.info("Extracting %s pages in %s ranges across %s workers", page_count, len(ranges), workers)
+    temp_path: Optional[str] = None
+    # Workers map the file directly, so a compressed original needs a copy.
+    if path is None or is_compressed(path) or not Path(path).exists():
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(data)
+            temp_path = tmp.name
+    source = temp_path or os.fspath(path)
+    try:
+        chunks = list(extract_pool(workers).map(extract_page_range, [source] * len(ranges), *zip(*ranges), [tables] * len(ranges)))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start fresh next time.
+        shutdown_extract_pool()
+        raise
+    finally:
+        if temp_path is not None:
+            os.unlink(temp_path)
+    page_tables: PageTables = {}
+    for _, chunk_tables in chunks:
+        page_tables.update(chunk_tables)
+    return "".join(text for text, _ in chunks), page_tables
@@ -0,0 +1,168 @@
+"""Persistent cache of extracted PDF text.
+
+Entries live in a SQLite sidecar next to the stored originals, keyed by the
+content SHA-256, the extractor version and the layout parameters, and hold
+zlib-compressed text (pages stay separated by form feeds). The cache is
+bounded by compressed size and evicts least recently used entries.
+
+The cache must never fail an upload: any SQLite error (a sidecar locked by
+another worker, a corrupt file) is logged and treated as a miss or a
+skipped write. Hits do not write; their access times are batched and
+written with the next ``put`` or every ``TOUCH_BATCH`` hits.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from importlib import metadata
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction output changes for the same pdfminer release.
+EXTRACTOR_REVISION = 2
+CACHE_FILENAME = "extraction_cache.sqlite3"
+# Pending access times written together once this many hits accumulate.
+TOUCH_BATCH = 64
+# Seconds to wait for a sidecar locked by another worker before giving up.
+LOCK_TIMEOUT = 1.0
+
+
+def extractor_version() -> str:
+    try:
+        pdfminer_version = metadata.version("pdfminer.six")
+    except metadata.PackageNotFoundError:  # pragma: no cover
+        pdfminer_version = "unknown"
+    return f"pdfminer.six-{pdfminer_version}/r{EXTRACTOR_REVISION}"
+
+
+class ExtractionCache:
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False, isolation_level=None)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "key TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_extractions_last_access ON extractions (last_access)")
+        return self._conn
+
+    @staticmethod
+    def key(content_hash: str, layout_params: dict) -> str:
+        """Cache key for a PDF by its SHA-256 hex digest."""
+
+        return f"{content_hash}:{extractor_version()}:{json.dumps(layout_params, sort_keys=True)}"
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with self._lock:
+                row = self._connection().execute("SELECT body FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                text = zlib.decompress(row[0]).decode("utf-8")
+                self.hits += 1
+                self._touched[key] = time.time()
+                if len(self._touched) >= TOUCH_BATCH:
+                    self._flush_touches(self._connection())
+                return text
+        except (sqlite3.Error, zlib.error) as exc:
+            logger.warning("Extraction cache read failed, treating as a miss: %s", exc)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, text: str) -> None:
+        body = zlib.compress(text.encode("utf-8"), 6)
+        if len(body) > self.max_bytes:
+            return
+        try:
+            with self._lock:
+                conn = self._connection()
+                self._flush_touches(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO extractions (key, body, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, body, len(body), time.time()),
+                )
+                self._evict(conn)
+        except sqlite3.Error as exc:
+            logger.warning("Extraction cache write skipped: %s", exc)
+
+    def _flush_touches(self, conn: sqlite3.Connection) -> None:
+        touched, self._touched = self._touched, {}
+        if touched:
+            conn.executemany("UPDATE extractions SET last_access = ? WHERE key = ?", [(at, key) for key, at in touched.items()])
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM extractions ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        try:
+            with self._lock:
+                entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("Extraction cache stats unavailable: %s", exc)
+            entries = size = None
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._flush_touches(self._conn)
+                except sqlite3.Error as exc:
+                    logger.warning("Extraction cache access times not saved: %s", exc)
+                self._conn.close()
+                self._conn = None
+
+
+_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Return the cache for the current settings, or None when disabled."""
+
+    global _cache
+    settings = get_settings()
+    if settings.extraction_cache_max_bytes <= 0:
+        return None
+    path = settings.storage_path / CACHE_FILENAME
+    if _cache is None or _cache.path != path:
+        if _cache is not None:
+            _cache.close()
+        _cache = ExtractionCache(path, settings.extraction_cache_max_bytes)
+    _cache.max_bytes = settings.extraction_cache_max_bytes
+    return _cache
@@ -1,30 +1,64 @@
 from __future__ import annotations
 
 import logging
-from typing import List
-
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
-from fastapi.responses import FileResponse, HTMLResponse
-from sqlalchemy.orm import Session
-
-from app.config import get_settings
-from app.database import Base, engine, ensure_schema, get_db
+from contextlib import asynccontextmanager
+from pathlib import PurePath
+from typing import Any, Callable, Iterator, List, Literal, Optional, Tuple
+
+import anyio.to_thread
+from fastapi import APIRouter, Depends, FastAPI, File, Header, HTTPException, Path, Query, Request, Response, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, object_session
+
+from app.admission import AdmissionController, AdmissionMiddleware
+from app.analytics import check_rollups, spend_report
+from app.archive import rehydrate_invoice
+from app.cache import invoice_cache
+from app.config import Settings, configure_settings, get_settings
+from app.database import (
+    SessionLocal,
+    dispose_async_engine,
+    dispose_engine,
+    ensure_schema,
+    get_db,
+    init_async_engine,
+    init_engine,
+)
+from app.extraction import shutdown_extract_pool
+from app.extraction_cache import get_extraction_cache
+from app.memory_profile import memory_stage, profile_upload
 from app.models import Files, Invoices, Parts
-from app.schemas import FileRecord, Invoice as InvoiceSchema, ParseTrigger, UploadResponse
-from app.services import list_invoices, retryable_process
-
-logging.basicConfig(level=logging.INFO)
-settings = get_settings()
-
-app = FastAPI(title="Invoice Parser API")
-
-# Ensure tables exist after all models are loaded so the schema includes
-# every column (e.g., billing period fields).
-ensure_schema()
+from app.parser_profile import profile_log
+from app.part_index import part_index
+from app.schemas import FileRecord, Invoice as InvoiceSchema, ParseTrigger, UploadResponse, UploadSession, UploadSessionCreate
+from app.serializers import invoice_json, invoice_list_json
+from app.services import file_invoice_ids, find_near_duplicates, retryable_process
+from app.sql_profile import SQLProfileMiddleware, profile_store
+from app.storage import hash_stored, is_compressed, open_stored, read_stored, stored_size
+from app.uploads import (
+    StoredResponse,
+    UploadRejected,
+    append_chunk,
+    begin_finalize,
+    claim_idempotency_key,
+    complete_session,
+    create_session,
+    get_session,
+    release_idempotency_key,
+    reopen_session,
+    store_idempotent_response,
+)
+from app.vendor_templates import registry
+
+router = APIRouter()
 
 
 def serialize_invoice(invoice: Invoices) -> InvoiceSchema:
-    return InvoiceSchema.from_orm(invoice)
+    schema = InvoiceSchema.from_orm(invoice)
+    db = object_session(invoice)
+    return rehydrate_invoice(db, schema) if db is not None else schema
 
 
 def serialize_file(file: Files) -> FileRecord:
@@ -32,18 +66,241 @@ def serialize_file(file: Files) -> FileRecord:
     return FileRecord.from_orm(file)
 
 
-@app.post("/upload", response_model=List[UploadResponse])
-def upload_files(files: List[UploadFile] = File(...), db: Session = Depends(get_db)):
-    results: List[UploadResponse] = []
-    for upload in files:
-        data = upload.file.read()
-        invoice = retryable_process(db, upload.filename, data)
-        record = db.query(Files).filter_by(invoice_id=invoice.id).order_by(Files.uploaded_at.desc()).first()
-        results.append(UploadResponse(invoice=serialize_invoice(invoice), file=serialize_file(record)))
-    return results
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+# Invoices can be re-parsed, so clients must revalidate; stored PDFs never
+# change once written.
+INVOICE_CACHE_CONTROL = "private, no-cache"
+FILE_CACHE_CONTROL = "private, max-age=86400"
+# Originals saved under their upload name (before content-addressed storage)
+# could be overwritten in place, so they are re-hashed and revalidated.
+LEGACY_FILE_CACHE_CONTROL = "private, no-cache"
+
+
+def invoice_etag(invoice_id: int, version: int) -> str:
+    return f'"invoice-{invoice_id}-v{version}"'
+
+
+def file_etag(content_hash: str) -> str:
+    return f'"{content_hash}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def is_content_addressed(file: Files) -> bool:
+    return bool(file.content_hash) and PurePath(file.original_path).name.split(".")[0] == file.content_hash
+
+
+def file_cache_control(file: Files) -> str:
+    return FILE_CACHE_CONTROL if is_content_addressed(file) else LEGACY_FILE_CACHE_CONTROL
+
+
+def file_content_hash(db: Session, file: Files) -> str:
+    """Return the SHA-256 of a stored file, re-hashing originals that can change."""
+
+    if not is_content_addressed(file):
+        current = hash_stored(file.original_path)
+        if current != file.content_hash:
+            file.content_hash = current
+            db.commit()
+    return file.content_hash
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Resolve a single ``bytes=`` range to inclusive offsets.
+
+    Returns None for a missing or multi-range header (the whole file is
+    sent) and raises 416 when the range cannot be satisfied.
+    """
+
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes=") :].strip().partition("-")
+    try:
+        if start_text:
+            start, end = int(start_text), int(end_text) if end_text else size - 1
+        else:
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def stored_file_response(path: str, filename: str, headers: dict, range_header: Optional[str]) -> Response:
+    """Stream a stored original, decompressing archived files on the fly."""
+
+    if not is_compressed(path):
+        # FileResponse handles Range requests itself.
+        return FileResponse(path=path, filename=filename, media_type="application/pdf", headers=headers)
+
+    size = stored_size(path)
+    span = parse_range(range_header, size)
+    start, end = span or (0, size - 1)
+
+    def chunks() -> Iterator[bytes]:
+        with open_stored(path) as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(1 << 16, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    headers = {
+        **headers,
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    if span is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(chunks(), status_code=206 if span else 200, media_type="application/pdf", headers=headers)
+
+
+def upload_response(db: Session, invoice: Invoices) -> UploadResponse:
+    record = db.query(Files).filter_by(invoice_id=invoice.id).order_by(Files.uploaded_at.desc()).first()
+    return UploadResponse(invoice=serialize_invoice(invoice), file=serialize_file(record))
+
+
+def ingest_upload(db: Session, filename: str, data: bytes) -> UploadResponse:
+    return upload_response(db, retryable_process(db, filename, data))
+
+
+def finalize_upload(db: Session, session_id: str, checksum: Optional[str] = None) -> UploadResponse:
+    session = get_session(db, session_id)
+    if session.status == "completed":
+        return upload_response(db, db.get(Invoices, session.invoice_id))
+    filename = session.filename
+    with profile_upload(filename) as memory:
+        with memory_stage("read"):
+            data = begin_finalize(db, session_id, checksum)
+        try:
+            result = ingest_upload(db, filename, data)
+        except BaseException:
+            reopen_session(db, session_id)
+            raise
+    complete_session(db, session_id, result.invoice.id)
+    if memory is not None:
+        result.memory = memory.result
+    return result
+
+
+def request_name(request: Request) -> str:
+    return f"{request.method} {request.url.path}"
+
 
+def replay_response(stored: StoredResponse) -> JSONResponse:
+    return JSONResponse(stored.body, status_code=stored.status_code, headers={"Idempotent-Replayed": "true"})
 
-@app.get("/", response_class=HTMLResponse)
+
+def idempotent(db: Session, key: Optional[str], request: Request, produce: Callable[[], Any]) -> Any:
+    """Run ``produce`` once per ``Idempotency-Key``; retries get the stored response."""
+
+    if not key:
+        return produce()
+    stored = claim_idempotency_key(db, key, request_name(request))
+    if stored is not None:
+        return replay_response(stored)
+    try:
+        result = produce()
+    except BaseException:
+        release_idempotency_key(db, key)
+        raise
+    store_idempotent_response(db, key, jsonable_encoder(result))
+    return result
+
+
+def reparse_file(db: Session, file_id: int) -> InvoiceSchema:
+    file = db.query(Files).get(file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found")
+    data = read_stored(file.original_path)
+    own_invoice_id = file.invoice_id
+    invoice = retryable_process(db, file.filename, data, reparse=file_invoice_ids(db, file))
+    # Report the file's own invoice, refreshed in place.
+    return serialize_invoice(db.get(Invoices, own_invoice_id) if own_invoice_id is not None else invoice)
+
+
+@router.post("/upload", response_model=List[UploadResponse])
+def upload_files(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: Session = Depends(get_db),
+):
+    def ingest_all() -> List[UploadResponse]:
+        results: List[UploadResponse] = []
+        for upload in files:
+            with profile_upload(upload.filename) as memory:
+                with memory_stage("read"):
+                    data = upload.file.read()
+                result = ingest_upload(db, upload.filename, data)
+            if memory is not None:
+                result.memory = memory.result
+            results.append(result)
+        return results
+
+    return idempotent(db, idempotency_key, request, ingest_all)
+
+
+@router.post("/uploads", response_model=UploadSession, status_code=201)
+def start_upload(body: UploadSessionCreate, db: Session = Depends(get_db)):
+    return create_session(db, body.filename, body.total_bytes)
+
+
+@router.get("/uploads/{session_id}", response_model=UploadSession)
+def upload_status(session_id: str, db: Session = Depends(get_db)):
+    return get_session(db, session_id)
+
+
+async def read_chunk(request: Request) -> bytes:
+    """The request body, refused once it passes ``upload_chunk_max_bytes``."""
+
+    limit = get_settings().upload_chunk_max_bytes
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail=f"Chunks are limited to {limit} bytes")
+    data = bytearray()
+    async for block in request.stream():
+        data += block
+        if len(data) > limit:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {limit} bytes")
+    return bytes(data)
+
+
+@router.put("/uploads/{session_id}/chunks/{index}", response_model=UploadSession)
+async def upload_chunk(
+    session_id: str,
+    request: Request,
+    index: int = Path(..., ge=0),
+    x_chunk_sha256: str = Header(..., min_length=64, max_length=64),
+    db: Session = Depends(get_db),
+):
+    data = await read_chunk(request)
+    return await run_in_threadpool(append_chunk, db, session_id, index, data, x_chunk_sha256)
+
+
+@router.post("/uploads/{session_id}/finalize", response_model=UploadResponse)
+def finalize_upload_route(
+    session_id: str,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    x_content_sha256: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    return idempotent(db, idempotency_key, request, lambda: finalize_upload(db, session_id, x_content_sha256))
+
+
+@router.get("/", response_class=HTMLResponse)
 def root() -> str:
     """Friendly landing page to confirm the API is online."""
 
@@ -143,7 +400,7 @@ def root() -> str:
     """
 
 
-@app.get("/upload")
+@router.get("/upload")
 def upload_instructions() -> dict[str, str]:
     """Explain how to use the upload endpoint when accessed via GET."""
 
@@ -153,7 +410,7 @@ def upload_instructions() -> dict[str, str]:
     }
 
 
-@app.get("/upload-ui", response_class=HTMLResponse)
+@router.get("/upload-ui", response_class=HTMLResponse)
 def upload_ui() -> str:
     """Simple browser UI for uploading PDFs to the parser API."""
 
@@ -369,42 +626,175 @@ def upload_ui() -> str:
     """
 
 
-@app.post("/parse/trigger", response_model=List[InvoiceSchema])
+@router.post("/parse/trigger", response_model=List[InvoiceSchema])
 def trigger_parse(body: ParseTrigger, db: Session = Depends(get_db)):
-    invoices: List[InvoiceSchema] = []
-    for file_id in body.file_ids:
-        file = db.query(Files).get(file_id)
-        if not file:
-            raise HTTPException(status_code=404, detail=f"File {file_id} not found")
-        with open(file.original_path, "rb") as f:
-            data = f.read()
-        invoice = retryable_process(db, file.filename, data)
-        invoices.append(serialize_invoice(invoice))
-    return invoices
-
-
-@app.get("/invoices", response_model=List[InvoiceSchema])
+    return [reparse_file(db, file_id) for file_id in body.file_ids]
+
+
+@router.get("/invoices", response_model=List[InvoiceSchema])
 def list_parsed_invoices(db: Session = Depends(get_db)):
-    return [serialize_invoice(inv) for inv in list_invoices(db)]
+    return Response(content=invoice_list_json(db), media_type="application/json")
 
 
-@app.get("/invoices/{invoice_id}", response_model=InvoiceSchema)
-def get_invoice(invoice_id: int, db: Session = Depends(get_db)):
-    invoice = db.query(Invoices).get(invoice_id)
-    if not invoice:
+@router.get("/invoices/{invoice_id}", response_model=InvoiceSchema)
+def get_invoice(invoice_id: int, request: Request, db: Session = Depends(get_db)):
+    version = db.query(Invoices.version).filter(Invoices.id == invoice_id).scalar()
+    if version is None:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    return serialize_invoice(invoice)
+    etag = invoice_etag(invoice_id, version)
+    headers = {"ETag": etag, "Cache-Control": INVOICE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = invoice_cache.get(invoice_id, version)
+    if body is None:
+        body = invoice_json(db, invoice_id)
+        invoice_cache.put(invoice_id, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
-@app.get("/files/{file_id}")
-def get_file(file_id: int, db: Session = Depends(get_db)):
+@router.get("/files/{file_id}")
+def get_file(file_id: int, request: Request, db: Session = Depends(get_db)):
     file = db.query(Files).get(file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path=file.original_path, filename=file.filename, media_type="application/pdf")
+    etag = file_etag(file_content_hash(db, file))
+    headers = {"ETag": etag, "Cache-Control": file_cache_control(file)}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return stored_file_response(file.original_path, file.filename, headers, request.headers.get("range"))
 
 
-@app.get("/reports/not-received")
+@router.get("/reports/not-received")
 def not_received_report(db: Session = Depends(get_db)):
     entries = db.query(Parts).filter(Parts.received.is_(False)).all()
     return [{"part_number": part.part_number, "description": part.description, "received": part.received} for part in entries]
+
+
+@router.get("/reports/duplicates")
+def duplicates_report(db: Session = Depends(get_db)):
+    return find_near_duplicates(db)
+
+
+@router.get("/parts/search")
+def search_parts(prefix: str = Query(..., min_length=1, max_length=64), limit: int = Query(20, ge=1, le=200), db: Session = Depends(get_db)):
+    settings = get_settings()
+    part_index.ensure_current(db, settings.part_index_sync_seconds, settings.part_index_reload_seconds)
+    return [entry.to_dict() for entry in part_index.search(prefix, limit)]
+
+
+@router.get("/analytics/spend")
+def spend_analytics(
+    by: Literal["vendor", "part", "account"] = "vendor",
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    key: Optional[str] = None,
+    by_month: bool = True,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    return spend_report(db, by=by, month_from=month_from, month_to=month_to, key=key, by_month=by_month, limit=limit)
+
+
+@router.get("/status/admission")
+def admission_status(request: Request):
+    return request.app.state.admission.stats()
+
+
+def require_debug_endpoints() -> None:
+    if not get_settings().debug_endpoints:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@router.get("/debug/parser-profile", dependencies=[Depends(require_debug_endpoints)])
+def parser_profile_report():
+    cache = get_extraction_cache()
+    return {
+        "profile": profile_log.aggregate(),
+        "templates": registry.timings(),
+        "extraction_cache": cache.stats() if cache is not None else None,
+    }
+
+
+@router.get("/debug/sql-profile", dependencies=[Depends(require_debug_endpoints)])
+def sql_profile_report(reset: bool = False):
+    report = profile_store.report()
+    if reset:
+        profile_store.clear()
+    return report
+
+
+# The app whose lifespan is running; see create_app.
+_running_app: Optional[FastAPI] = None
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Configure the process for ``settings`` and build the API on it.
+
+    This is not an isolated factory: settings, the engine behind
+    ``SessionLocal``, the invoice cache, the part index and ``router`` are
+    process-wide. The lifespan makes ``settings`` the process settings on
+    startup, and only one app can run (be inside its lifespan) at a time;
+    starting a second one raises RuntimeError.
+
+    The engine, schema check and storage directories are set up by the
+    lifespan handler when the server starts, so importing this module stays
+    cheap for workers and test collection.
+    """
+
+    settings = settings if settings is not None else get_settings()
+
+    admission = AdmissionController.from_settings(settings)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        global _running_app
+        if _running_app is not None:
+            raise RuntimeError("Another app is already running in this process; settings and the engine are process-wide")
+        _running_app = app
+        try:
+            configure_settings(settings)
+            invoice_cache.resize(settings.invoice_cache_size)
+            logging.basicConfig(level=logging.INFO)
+            anyio.to_thread.current_default_thread_limiter().total_tokens = max(settings.worker_threads, settings.admission_max_jobs + 1)
+            settings.ensure_directories()
+            # Ensure tables exist after all models are loaded so the schema
+            # includes every column (e.g., billing period fields).
+            ensure_schema(init_engine(settings))
+            with SessionLocal() as db:
+                check_rollups(db)
+                part_index.load(db)
+            if settings.async_mode:
+                init_async_engine(settings)
+            yield
+            if settings.async_mode:
+                from app.async_api import shutdown_parse_executor
+
+                shutdown_parse_executor()
+                await dispose_async_engine()
+            shutdown_extract_pool()
+            dispose_engine()
+        finally:
+            _running_app = None
+
+    app = FastAPI(title="Invoice Parser API", lifespan=lifespan)
+    app.state.settings = settings
+    app.state.admission = admission
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
+    @app.exception_handler(UploadRejected)
+    async def upload_rejected(request: Request, exc: UploadRejected) -> JSONResponse:
+        return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+
+    if settings.sql_profile:
+        # Added last so it is outermost and also times rejected requests.
+        app.add_middleware(SQLProfileMiddleware, top=settings.sql_profile_top)
+    if settings.async_mode:
+        from app.async_api import async_router
+
+        app.include_router(async_router)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,209 @@
+"""Opt-in per-upload memory profiling with tracemalloc.
+
+``profile_upload`` activates a ``MemoryProfile`` for one uploaded document,
+and the ingestion pipeline marks its stages with ``memory_stage``: read,
+store, extract, parse, persist and commit. For each stage the profile
+records calls, time, the traced peak above the upload's starting level,
+and the memory retained when the stage ends. The first time a stage ends,
+a snapshot is diffed against the previous one to list the allocation
+sites that stage left behind. ``summary()`` also reports process RSS
+growth and the sites still holding memory at the end of the upload.
+
+tracemalloc is process-wide, so concurrent uploads blur each other's
+numbers; profile with ``admission_max_jobs=1`` for clean attribution.
+Tracing slows Python allocation noticeably, so this is off by default.
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Iterator, List, Optional
+
+from app.config import get_settings
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+_IGNORED = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>")
+
+# Profiles that need tracing, so overlapping uploads keep it on until the
+# last one finishes. Tracing already on for other reasons is never stopped.
+_tracing_lock = Lock()
+_tracing_users = 0
+_started_tracing = False
+
+
+def _acquire_tracing() -> None:
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_users += 1
+
+
+def _release_tracing() -> None:
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def rss_peak_bytes() -> Optional[int]:
+    """Process high-water RSS (``ru_maxrss`` is KiB on Linux, bytes on macOS)."""
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _site(frame: tracemalloc.Frame) -> str:
+    parts = frame.filename.replace("\\", "/").split("/")
+    return f"{'/'.join(parts[-2:])}:{frame.lineno}"
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, pattern) for pattern in _IGNORED])
+
+
+def _top_sites(current: tracemalloc.Snapshot, previous: Optional[tracemalloc.Snapshot], limit: int) -> List[dict]:
+    if previous is None:
+        stats = [(stat.size, stat.count, stat.traceback[0]) for stat in current.statistics("lineno")]
+    else:
+        stats = [(stat.size_diff, stat.count_diff, stat.traceback[0]) for stat in current.compare_to(previous, "lineno")]
+    stats = sorted((entry for entry in stats if entry[0] > 0), key=lambda entry: entry[0], reverse=True)[:limit]
+    return [{"site": _site(frame), "size_kb": round(size / 1024, 1), "count": count} for size, count, frame in stats]
+
+
+class _Frame:
+    __slots__ = ("name", "started", "start_current", "peak")
+
+    def __init__(self, name: str, current: int) -> None:
+        self.name = name
+        self.started = time.perf_counter()
+        self.start_current = current
+        self.peak = current
+
+
+class MemoryProfile:
+    def __init__(self, filename: str, top: int = 5) -> None:
+        self.filename = filename
+        self.top = top
+        _acquire_tracing()
+        tracemalloc.reset_peak()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        self.rss_start = rss_peak_bytes()
+        self.stages: Dict[str, dict] = {}
+        self._stack: List[_Frame] = []
+        self._first = _snapshot()
+        self._last = self._first
+        self.result: Optional[dict] = None
+
+    def enter(self, name: str) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1].peak = max(self._stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+        self._stack.append(_Frame(name, current))
+
+    def exit(self) -> None:
+        frame = self._stack.pop()
+        current, peak = tracemalloc.get_traced_memory()
+        frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+        if self._stack:
+            # A nested stage's peak is also its parent's.
+            self._stack[-1].peak = max(self._stack[-1].peak, frame.peak)
+
+        stage = self.stages.setdefault(frame.name, {"calls": 0, "seconds": 0.0, "peak_mb": 0.0, "retained_mb": 0.0})
+        stage["calls"] += 1
+        stage["seconds"] += time.perf_counter() - frame.started
+        stage["peak_mb"] = max(stage["peak_mb"], (frame.peak - self.baseline) / MB)
+        stage["retained_mb"] += (current - frame.start_current) / MB
+        if "top_sites" not in stage:
+            snapshot = _snapshot()
+            stage["top_sites"] = _top_sites(snapshot, self._last, self.top)
+            self._last = snapshot
+
+    def finish(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory()
+        traced_peak = max([peak] + [stage["peak_mb"] * MB + self.baseline for stage in self.stages.values()])
+        final = _snapshot()
+        _release_tracing()
+        rss_end = rss_peak_bytes()
+        budget_mb = get_settings().memory_budget_mb
+        self.result = {
+            "filename": self.filename,
+            "traced_peak_mb": round((traced_peak - self.baseline) / MB, 3),
+            "retained_mb": round((current - self.baseline) / MB, 3),
+            "rss_peak_mb": round(rss_end / MB, 1) if rss_end is not None else None,
+            "rss_growth_mb": round((rss_end - self.rss_start) / MB, 1) if rss_end is not None else None,
+            "budget_mb": budget_mb,
+            "over_budget": bool(budget_mb) and (traced_peak - self.baseline) / MB > budget_mb,
+            "stages": {
+                name: {**stage, "seconds": round(stage["seconds"], 4), "peak_mb": round(stage["peak_mb"], 3), "retained_mb": round(stage["retained_mb"], 3)}
+                for name, stage in self.stages.items()
+            },
+            "top_retained_sites": _top_sites(final, self._first, self.top),
+        }
+        return self.result
+
+
+current_memory_profile: ContextVar[Optional[MemoryProfile]] = ContextVar("current_memory_profile", default=None)
+
+
+@contextmanager
+def memory_stage(name: str) -> Iterator[None]:
+    profile = current_memory_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+@contextmanager
+def profile_upload(filename: str) -> Iterator[Optional[MemoryProfile]]:
+    """Profile one upload when ``memory_profile`` is on; yields None otherwise.
+
+    The summary is available as ``profile.result`` after the block, and
+    documents over ``memory_budget_mb`` are logged.
+    """
+
+    settings = get_settings()
+    if not settings.memory_profile or current_memory_profile.get() is not None:
+        yield None
+        return
+    profile = MemoryProfile(filename, settings.memory_profile_top)
+    token = current_memory_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_memory_profile.reset(token)
+        summary = profile.finish()
+        if summary["over_budget"]:
+            stages = ", ".join(f"{name} {stage['peak_mb']:.1f} MB" for name, stage in summary["stages"].items())
+            logger.warning(
+                "Upload %s peaked at %.1f MB traced, over the %s MB budget (%s)",
+                filename,
+                summary["traced_peak_mb"],
+                summary["budget_mb"],
+                stages,
+            )
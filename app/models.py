@@ -16,6 +16,7 @@ class Files(Base):
     filename: Mapped[str] = mapped_column(String, nullable=False)
     original_path: Mapped[str] = mapped_column(String, nullable=False)
     summary_path: Mapped[Optional[str]] = mapped_column(String)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True)
     uploaded_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     invoice_id: Mapped[Optional[int]] = mapped_column(ForeignKey("invoices.id"), nullable=True)
 
@@ -42,6 +43,8 @@ class Invoices(Base):
     total: Mapped[Optional[float]] = mapped_column(Float)
     parsing_confidence: Mapped[float] = mapped_column(Float, default=0.0)
     raw_text: Mapped[Optional[str]] = mapped_column(Text)
+    dedupe_key: Mapped[Optional[str]] = mapped_column(String, index=True)
+    version: Mapped[int] = mapped_column(Integer, default=1, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     pages: Mapped[List[InvoicePages]] = relationship("InvoicePages", back_populates="invoice", cascade="all, delete-orphan")
@@ -57,7 +60,7 @@ class InvoicePages(Base):
     __tablename__ = "invoice_pages"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), index=True)
     page_number: Mapped[int] = mapped_column(Integer)
     text_content: Mapped[str] = mapped_column(Text)
     is_summary: Mapped[bool] = mapped_column(Boolean, default=False)
@@ -82,7 +85,7 @@ class InvoiceLines(Base):
     __tablename__ = "invoice_lines"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), index=True)
     order_reference_id: Mapped[Optional[int]] = mapped_column(ForeignKey("order_references.id"))
     part_id: Mapped[Optional[int]] = mapped_column(ForeignKey("parts.id"))
     part_number: Mapped[str] = mapped_column(String)
@@ -104,7 +107,7 @@ class Shipments(Base):
     __tablename__ = "shipments"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), index=True)
     description: Mapped[Optional[str]] = mapped_column(String)
     received: Mapped[bool] = mapped_column(Boolean, default=False)
 
@@ -115,7 +118,7 @@ class Charges(Base):
     __tablename__ = "charges"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), index=True)
     type: Mapped[str] = mapped_column(String)
     amount: Mapped[float] = mapped_column(Float)
 
@@ -126,7 +129,7 @@ class GLAllocations(Base):
     __tablename__ = "gl_allocations"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), index=True)
     account_code: Mapped[str] = mapped_column(String)
     amount: Mapped[float] = mapped_column(Float)
     memo: Mapped[Optional[str]] = mapped_column(String)
@@ -153,7 +156,7 @@ class OrderReferences(Base):
     __tablename__ = "order_references"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), index=True)
     order_number: Mapped[str] = mapped_column(String, index=True)
     order_type: Mapped[Optional[str]] = mapped_column(String)
     release_number: Mapped[Optional[str]] = mapped_column(String)
@@ -161,3 +164,92 @@ class OrderReferences(Base):
 
     invoice: Mapped[Invoices] = relationship("Invoices", back_populates="orders")
     lines: Mapped[List[InvoiceLines]] = relationship("InvoiceLines", back_populates="order_reference")
+
+
+class IngestionJobs(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64), index=True)
+    filename: Mapped[str] = mapped_column(String)
+    status: Mapped[str] = mapped_column(String, default="running")
+    invoices_done: Mapped[int] = mapped_column(Integer, default=0)
+    first_invoice_id: Mapped[Optional[int]] = mapped_column(ForeignKey("invoices.id"))
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ArchivedInvoices(Base):
+    """Invoices whose text, pages and charges live in the cold archive."""
+
+    __tablename__ = "archived_invoices"
+
+    invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"), primary_key=True)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Serialized size of the moved content, and its compressed size.
+    raw_bytes: Mapped[int] = mapped_column(Integer, default=0)
+    stored_bytes: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class UploadSessions(Base):
+    """A resumable upload; chunks are appended to a staging file until finalize."""
+
+    __tablename__ = "upload_sessions"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    filename: Mapped[str] = mapped_column(String)
+    total_bytes: Mapped[Optional[int]] = mapped_column(Integer)
+    received_bytes: Mapped[int] = mapped_column(Integer, default=0)
+    chunk_count: Mapped[int] = mapped_column(Integer, default=0)
+    # Comma-separated SHA-256 of each received chunk, in order.
+    chunk_hashes: Mapped[str] = mapped_column(Text, default="")
+    status: Mapped[str] = mapped_column(String, default="open")
+    invoice_id: Mapped[Optional[int]] = mapped_column(ForeignKey("invoices.id"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+
+class IdempotencyKeys(Base):
+    """Stored result of a request made with an ``Idempotency-Key`` header."""
+
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    request: Mapped[str] = mapped_column(String)
+    status: Mapped[str] = mapped_column(String, default="processing")
+    status_code: Mapped[Optional[int]] = mapped_column(Integer)
+    response_body: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class VendorSpendRollups(Base):
+    """Invoice totals per month and normalized vendor, kept current on ingest."""
+
+    __tablename__ = "vendor_spend_monthly"
+
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    vendor: Mapped[str] = mapped_column(String, primary_key=True, index=True)
+    invoice_count: Mapped[int] = mapped_column(Integer, default=0)
+    subtotal_cents: Mapped[int] = mapped_column(Integer, default=0)
+    tax_cents: Mapped[int] = mapped_column(Integer, default=0)
+    freight_cents: Mapped[int] = mapped_column(Integer, default=0)
+    total_cents: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class PartSpendRollups(Base):
+    __tablename__ = "part_spend_monthly"
+
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    part_number: Mapped[str] = mapped_column(String, primary_key=True, index=True)
+    line_count: Mapped[int] = mapped_column(Integer, default=0)
+    quantity: Mapped[int] = mapped_column(Integer, default=0)
+    extended_cents: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class AccountSpendRollups(Base):
+    __tablename__ = "account_spend_monthly"
+
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    account_code: Mapped[str] = mapped_column(String, primary_key=True, index=True)
+    allocation_count: Mapped[int] = mapped_column(Integer, default=0)
+    amount_cents: Mapped[int] = mapped_column(Integer, default=0)
@@ -1,27 +1,95 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
 import re
 from datetime import datetime
-from io import BytesIO
-from typing import Iterable, List, Optional
-
-from pdfminer.high_level import extract_text
-
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+from app.config import get_settings
+from app.extraction import LAYOUT_PARAMS, extract_pdf
+from app.extraction_cache import get_extraction_cache
+from app.memory_profile import memory_stage
+from app.parser_profile import (
+    BUDGET_CHECK_EVERY,
+    ParseBudget,
+    ParseBudgetExceeded,
+    ParseProfile,
+    check_budget,
+    current_budget,
+    current_profile,
+    pattern_timer,
+    profile_log,
+)
 from app.schemas import Charge, GLAllocation, Invoice, InvoiceLine, InvoicePage
+from app.tables import TABLE_EXTRACTOR_REVISION, extract_text_table
+from app.vendor_templates import VendorTemplate, registry
 
+logger = logging.getLogger(__name__)
+
+# Confidence reported for invoices cut short by the parse time budget.
+ABORTED_CONFIDENCE = 0.1
 
 FCA_HINTS = ["FCA", "FCA US LLC", "FCA Invoice", "FCA Canada"]
+FCA_PATTERN = re.compile("|".join(re.escape(hint) for hint in sorted(FCA_HINTS, key=len, reverse=True)), re.IGNORECASE)
+PAGE_MARKER = re.compile(r"Page\s+\d+")
+INVOICE_HEADER = re.compile(r"Invoice\s*#")
 
 
 def is_fca_invoice(text: str) -> bool:
-    return any(hint.lower() in text.lower() for hint in FCA_HINTS)
+    return FCA_PATTERN.search(text) is not None
+
+
+def extract_text_from_pdf(data: bytes, path: Optional[Path] = None) -> str:
+    return extract_document(data, path, tables=False)[0]
+
+
+def extract_document(
+    data: bytes, path: Optional[Path] = None, tables: bool = True, content_hash: Optional[str] = None
+) -> Tuple[str, Dict[int, List[InvoiceLine]]]:
+    """Text and layout line items per page, from the cache or one pdfminer pass.
 
+    Tables are only read from PDFs, and only when ``table_layout`` is on.
+    ``content_hash`` is the SHA-256 of ``data`` when the caller already has it.
+    """
+
+    tables = tables and data.startswith(b"%PDF") and get_settings().table_layout
+    cache = get_extraction_cache()
+    if cache is not None:
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        text_key = cache.key(content_hash, LAYOUT_PARAMS)
+        # Tables come from the layout analysis, so layout changes invalidate them too.
+        tables_key = cache.key(content_hash, {"tables": TABLE_EXTRACTOR_REVISION, "layout": LAYOUT_PARAMS})
+        cached_text = cache.get(text_key)
+        cached_tables = cache.get(tables_key) if tables and cached_text is not None else None
+        if cached_text is not None and (cached_tables is not None or not tables):
+            page_tables = json.loads(cached_tables) if cached_tables is not None else {}
+            return cached_text, {int(page): [InvoiceLine(**line) for line in lines] for page, lines in page_tables.items()}
+
+    text, page_tables, extracted = _extract_uncached(data, path, tables)
+    # Only pdfminer output is cached. The fallback after a failure, which
+    # may be transient (a dead worker, memory pressure), is retried next time.
+    if cache is not None and extracted:
+        cache.put(text_key, text)
+        if tables:
+            cache.put(tables_key, json.dumps({page: [line.model_dump(exclude_none=True) for line in lines] for page, lines in page_tables.items()}))
+    return text, page_tables
+
+
+def _extract_uncached(data: bytes, path: Optional[Path], tables: bool) -> Tuple[str, Dict[int, List[InvoiceLine]], bool]:
+    """Return the document text, its page tables and whether pdfminer extracted them."""
 
-def extract_text_from_pdf(data: bytes) -> str:
     parsed_text = ""
+    page_tables: Dict[int, List[InvoiceLine]] = {}
+    extracted = False
     try:
-        parsed_text = extract_text(BytesIO(data)) or ""
+        parsed_text, page_tables = extract_pdf(data, path, tables=tables)
+        extracted = True
     except Exception:
+        if data.startswith(b"%PDF"):
+            logger.warning("pdfminer failed to extract text; falling back to the raw bytes", exc_info=True)
         parsed_text = ""
 
     try:
@@ -29,79 +97,146 @@ def extract_text_from_pdf(data: bytes) -> str:
     except Exception:
         decoded_text = ""
 
-    # Prefer the richer of the two attempts so that plain-text fixtures and
-    # PDFs both produce usable content.
-    return parsed_text if len(parsed_text.strip()) >= len(decoded_text.strip()) else decoded_text
+    # A real PDF decodes to its raw object syntax, which is always "longer"
+    # than the extracted text, so trust pdfminer whenever it found any.
+    if data.startswith(b"%PDF") and parsed_text.strip():
+        return parsed_text, page_tables, extracted
+    # Otherwise prefer the richer of the two attempts so that plain-text
+    # fixtures and PDFs both produce usable content.
+    if len(parsed_text.strip()) >= len(decoded_text.strip()):
+        return parsed_text, page_tables, extracted
+    return decoded_text, {}, extracted
 
 
-def segment_pages(text: str) -> List[str]:
-    segments: List[str] = []
+def iter_pages(text: str) -> Iterator[str]:
     buffer: List[str] = []
     for line in text.splitlines():
-        if re.search(r"Page\s+\d+", line) and buffer:
-            segments.append("\n".join(buffer))
+        if PAGE_MARKER.search(line) and buffer:
+            yield "\n".join(buffer)
             buffer = [line]
         else:
             buffer.append(line)
     if buffer:
-        segments.append("\n".join(buffer))
-    return segments or [text]
-
-
-def parse_invoice_text(text: str) -> Invoice:
-    pages = [InvoicePage(page_number=i + 1, text_content=segment, is_summary=is_summary_page(segment)) for i, segment in enumerate(segment_pages(text))]
-    header = text.split("\n")[:20]
-    invoice_number = search_first(header, r"Invoice\s*#:?\s*([\w-]+)")
-    invoice_date_raw = search_first(header, r"Date\s*:?\s*([\d/.-]{6,10})")
-    invoice_date = None
-    if invoice_date_raw:
-        for fmt in ("%m/%d/%Y", "%Y-%m-%d", "%m-%d-%Y"):
-            try:
-                invoice_date = datetime.strptime(invoice_date_raw, fmt).date()
-                break
-            except ValueError:
-                continue
-
-    order_number = search_first(text, r"(?:PO|Order)\s*#:?\s*([\w-]+)")
-    vendor = search_first(text, r"Vendor\s*:?\s*([\w\s,&.]+)")
-    customer = search_first(text, r"Customer\s*:?\s*([\w\s,&.]+)")
-
-    subtotal = to_float(search_first(text, r"Subtotal\s*:?\s*([\d,.]+)"))
-    tax = to_float(search_first(text, r"Tax\s*:?\s*([\d,.]+)"))
-    freight = to_float(search_first(text, r"Freight\s*:?\s*([\d,.]+)"))
-    total = to_float(search_first(text, r"Total\s*:?\s*([\d,.]+)"))
-
-    lines = extract_line_items(text)
-    charges = extract_charges(text)
-    allocations = extract_allocations(text)
-
-    confidence = 0.5 + 0.1 * sum(bool(x) for x in [invoice_number, invoice_date, order_number])
-    if is_fca_invoice(text):
-        confidence += 0.2
+        yield "\n".join(buffer)
+
+
+def segment_pages(text: str) -> List[str]:
+    return list(iter_pages(text)) or [text]
+
+
+def parse_invoice_text(
+    text: str,
+    template: Optional[VendorTemplate] = None,
+    table_lines: Optional[List[InvoiceLine]] = None,
+    budget: Optional[ParseBudget] = None,
+) -> Invoice:
+    """Parse one invoice segment.
+
+    ``table_lines`` are line items already read from the PDF layout; when
+    given, the text-based line extraction is skipped. ``budget`` is the
+    document's parse budget (``iter_parsed_invoices`` shares one across a
+    packet); without it the invoice gets a configured budget of its own.
+    When it runs out the fields found so far are returned with
+    ``ABORTED_CONFIDENCE``.
+    """
+
+    template = template or registry.select(text)
+    settings = get_settings()
+    if budget is None:
+        budget = ParseBudget(settings.parser_time_budget_ms)
+    profile = ParseProfile(template.name) if settings.parser_profile else None
+    profile_token = current_profile.set(profile)
+    budget_token = current_budget.set(budget)
+    try:
+        with registry.timed(template), budget.running():
+            return _parse_with_template(text, template, table_lines)
+    finally:
+        current_budget.reset(budget_token)
+        current_profile.reset(profile_token)
+        if profile is not None:
+            profile.finish()
+            profile_log.add(profile)
+
+
+def _parse_with_template(text: str, template: VendorTemplate, table_lines: Optional[List[InvoiceLine]] = None) -> Invoice:
+    found: dict = {}
+    aborted = False
+    try:
+        with pattern_timer("summary") as timer:
+            found["pages"] = [
+                InvoicePage(page_number=i + 1, text_content=segment, is_summary=is_summary_page(segment, template))
+                for i, segment in enumerate(iter_pages(text))
+            ] or [InvoicePage(page_number=1, text_content=text, is_summary=is_summary_page(text, template))]
+            timer.matches = sum(page.is_summary for page in found["pages"])
+
+        header = text.split("\n")[:20]
+        for name, pattern in template.header_fields.items():
+            found[name] = _search(f"header.{name}", header, pattern)
+        invoice_date_raw = found.pop("invoice_date", None)
+        if invoice_date_raw:
+            for fmt in template.date_formats:
+                try:
+                    found["invoice_date"] = datetime.strptime(invoice_date_raw, fmt).date()
+                    break
+                except ValueError:
+                    continue
+
+        for name, pattern in template.fields.items():
+            found[name] = _search(f"field.{name}", text, pattern)
+
+        with pattern_timer("lines") as timer:
+            # A layout table that yielded no rows falls back to the text.
+            found["lines"] = table_lines or extract_line_items(text, template)
+            timer.matches = len(found["lines"])
+        found["charges"] = extract_charges(text, template)
+        with pattern_timer("allocations") as timer:
+            found["allocations"] = extract_allocations(text, template)
+            timer.matches = len(found["allocations"])
+    except ParseBudgetExceeded as exc:
+        logger.warning("Parse budget exceeded at %s; returning partial invoice", exc)
+        aborted = True
+
+    confidence = 0.5 + 0.1 * sum(bool(found.get(x)) for x in ["invoice_number", "invoice_date", "order_number"])
+    confidence += template.confidence_bonus
 
     return Invoice(
-        invoice_number=invoice_number,
-        invoice_date=invoice_date,
-        order_number=order_number,
-        vendor_name=vendor,
-        customer_name=customer,
-        subtotal=subtotal,
-        tax=tax,
-        freight=freight,
-        total=total,
-        parsing_confidence=min(confidence, 1.0),
+        invoice_number=found.get("invoice_number"),
+        invoice_date=found.get("invoice_date"),
+        order_number=found.get("order_number"),
+        vendor_name=found.get("vendor_name"),
+        customer_name=found.get("customer_name"),
+        subtotal=to_float(found.get("subtotal")),
+        tax=to_float(found.get("tax")),
+        freight=to_float(found.get("freight")),
+        total=to_float(found.get("total")),
+        parsing_confidence=ABORTED_CONFIDENCE if aborted else min(confidence, 1.0),
         raw_text=text,
-        pages=pages,
-        lines=lines,
-        charges=charges,
-        allocations=allocations,
+        pages=found.get("pages", []),
+        lines=found.get("lines", []),
+        charges=found.get("charges", []),
+        allocations=found.get("allocations", []),
     )
 
 
-def extract_line_items(text: str) -> List[InvoiceLine]:
+def _search(name: str, source: str | Iterable[str], pattern: Pattern[str]) -> Optional[str]:
+    with pattern_timer(name) as timer:
+        value = search_first(source, pattern)
+        timer.matches = int(value is not None)
+    return value
+
+
+def extract_line_items(text: str, template: Optional[VendorTemplate] = None) -> List[InvoiceLine]:
+    pattern = (template or registry.fallback).line_pattern
+    region_lines = extract_text_table(text, pattern)
+    if region_lines:
+        return region_lines
+
+    # No table heading found, or no rows read under it: scan the whole text
+    # as a last resort.
     lines: List[InvoiceLine] = []
-    pattern = re.compile(r"(?P<part>\w{3,})\s+(?P<qty>\d+)\s+(?P<price>[\d,.]+)\s+(?P<ext>[\d,.]+)")
     for match in pattern.finditer(text):
+        if len(lines) % BUDGET_CHECK_EVERY == 0:
+            check_budget("lines")
         part_number = match.group("part")
         qty = int(match.group("qty"))
         unit_cost = to_float(match.group("price"))
@@ -118,19 +253,21 @@ def extract_line_items(text: str) -> List[InvoiceLine]:
     return lines
 
 
-def extract_charges(text: str) -> List[Charge]:
+def extract_charges(text: str, template: Optional[VendorTemplate] = None) -> List[Charge]:
     charges: List[Charge] = []
-    for label in ["Freight", "Tax", "Fees"]:
-        amount = search_first(text, rf"{label}\s*:?\s*([\d,.]+)")
+    for label, pattern in (template or registry.fallback).charge_fields.items():
+        amount = _search(f"charge.{label}", text, pattern)
         if amount:
-            charges.append(Charge(type=label.lower(), amount=to_float(amount) or 0.0))
+            charges.append(Charge(type=label, amount=to_float(amount) or 0.0))
     return charges
 
 
-def extract_allocations(text: str) -> List[GLAllocation]:
+def extract_allocations(text: str, template: Optional[VendorTemplate] = None) -> List[GLAllocation]:
     allocations: List[GLAllocation] = []
-    pattern = re.compile(r"(?m)^GL\s*(?P<acct>\d{3,})\s+(?P<amount>[\d,.]+)\s*(?P<memo>.*)$")
-    for line in text.splitlines():
+    pattern = (template or registry.fallback).allocation_pattern
+    for index, line in enumerate(text.splitlines()):
+        if index % BUDGET_CHECK_EVERY == 0:
+            check_budget("allocations")
         match = pattern.match(line)
         if match:
             allocations.append(
@@ -143,14 +280,13 @@ def extract_allocations(text: str) -> List[GLAllocation]:
     return allocations
 
 
-def is_summary_page(text: str) -> bool:
-    markers = ["Summary", "GL", "Allocation"]
-    return any(marker.lower() in text.lower() for marker in markers)
+def is_summary_page(text: str, template: Optional[VendorTemplate] = None) -> bool:
+    return (template or registry.fallback).summary_pattern.search(text) is not None
 
 
-def search_first(source: str | Iterable[str], pattern: str) -> Optional[str]:
+def search_first(source: str | Iterable[str], pattern: str | Pattern[str]) -> Optional[str]:
     text = source if isinstance(source, str) else "\n".join(source)
-    match = re.search(pattern, text, re.IGNORECASE)
+    match = pattern.search(text) if isinstance(pattern, re.Pattern) else re.search(pattern, text, re.IGNORECASE)
     return match.group(1).strip() if match else None
 
 
@@ -163,28 +299,106 @@ def to_float(value: Optional[str]) -> Optional[float]:
         return None
 
 
-def parse_pdf_bytes(data: bytes) -> List[Invoice]:
-    text = extract_text_from_pdf(data)
-    invoices: List[Invoice] = []
-    for segment in split_invoices(text):
-        invoices.append(parse_invoice_text(segment))
-    return invoices
+def parse_pdf_bytes(data: bytes, path: Optional[Path] = None) -> List[Invoice]:
+    return list(iter_parsed_invoices(data, path))
+
+
+def iter_parsed_invoices(data: bytes, path: Optional[Path] = None, skip: int = 0, content_hash: Optional[str] = None) -> Iterator[Invoice]:
+    """Yield parsed invoices one at a time, skipping the first ``skip`` segments.
+
+    Skipped segments are never parsed, which is what lets an interrupted
+    packet resume cheaply. For PDFs, line items come from the page layout
+    when a page owned by the segment has a detected table.
+
+    The parse time budget covers the parsing of all segments yielded by this
+    call, not the time the consumer spends between them. An invoice that
+    uses up a fresh budget on its own is pathological and comes back partial.
+    When the budget instead runs out part way through a packet,
+    ``ParseBudgetExceeded`` is raised before that invoice is yielded, so no
+    placeholder is stored and the caller can resume at the same segment with
+    a new budget.
+    """
+
+    with memory_stage("extract"):
+        text, page_tables = extract_document(data, path, content_hash=content_hash)
+    budget = ParseBudget(get_settings().parser_time_budget_ms)
+    parsed = 0
+    pages = text.split("\f")
+    for index, (segment, owned_pages) in enumerate(iter_segments_with_pages(text)):
+        if index < skip:
+            continue
+        # Packets can mix vendors, so each invoice is fingerprinted. Its first
+        # page is used rather than the segment, because the banner above an
+        # invoice header ends up in the previous segment.
+        template = registry.select(pages[owned_pages[0]] if owned_pages else segment)
+        table_lines = None
+        if owned_pages and any(page in page_tables for page in owned_pages):
+            table_lines = [line for page in owned_pages for line in page_tables.get(page, [])]
+        with memory_stage("parse"):
+            invoice = parse_invoice_text(segment, template, table_lines, budget)
+        if budget.aborted and parsed:
+            raise ParseBudgetExceeded(f"parse budget spent after {parsed} invoices; stopped at segment {index}")
+        parsed += 1
+        yield invoice
+
+
+def iter_invoice_segments(text: str) -> Iterator[str]:
+    for segment, _ in iter_segments_with_pages(text):
+        yield segment
+
+
+def iter_segments_with_pages(text: str) -> Iterator[Tuple[str, List[int]]]:
+    """Split text into invoice segments, reporting the pages each one owns.
+
+    Pages are delimited by form feeds. A page belongs to the segment holding
+    its first invoice header; a page without a header (a continuation page)
+    belongs to the segment it starts in. Page-level layout data can then be
+    attributed to exactly one invoice.
+    """
 
-
-def split_invoices(text: str) -> List[str]:
-    chunks: List[str] = []
     current: List[str] = []
     has_invoice_header = False
-
-    for line in text.splitlines():
-        is_invoice_header = bool(re.search(r"Invoice\s*#", line))
+    emitted = False
+    page, at_page_start = 0, True
+    header_pages: set = set()
+    started_pages: List[int] = []
+    header_page: Optional[int] = None
+
+    def owned(next_header_page: Optional[int]) -> List[int]:
+        pages = set(started_pages)
+        if next_header_page is not None and next_header_page != header_page:
+            pages.discard(next_header_page)
+        if header_page is not None:
+            pages.add(header_page)
+        return sorted(pages)
+
+    for raw in text.splitlines(keepends=True):
+        line = raw.rstrip("\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+        is_invoice_header = bool(INVOICE_HEADER.search(line))
         if is_invoice_header and has_invoice_header:
-            chunks.append("\n".join(current))
+            yield "\n".join(current), owned(page)
+            emitted = True
             current = [line]
+            started_pages = [page] if at_page_start else []
+            header_page = None if page in header_pages else page
         else:
             current.append(line)
+            if at_page_start:
+                started_pages.append(page)
+            if is_invoice_header and not has_invoice_header:
+                header_page = page
+        if is_invoice_header:
+            header_pages.add(page)
         has_invoice_header = has_invoice_header or is_invoice_header
+        at_page_start = raw.endswith("\f")
+        if at_page_start:
+            page += 1
 
     if current:
-        chunks.append("\n".join(current))
-    return chunks or [text]
+        yield "\n".join(current), owned(None)
+    elif not emitted:
+        yield text, []
+
+
+def split_invoices(text: str) -> List[str]:
+    return list(iter_invoice_segments(text))
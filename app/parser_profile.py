@@ -0,0 +1,159 @@
+"""Per-pattern parser profiling and the per-document parse time budget.
+
+``iter_parsed_invoices`` creates one ``ParseBudget`` for the document and
+``parse_invoice_text`` activates it, plus a ``ParseProfile`` when profiling
+is on, for each invoice. Only time spent inside ``parse_invoice_text`` is
+charged, so persisting the invoices in between does not use up the budget.
+Pattern calls run inside ``pattern_timer`` which checks the budget first,
+so a pathological extraction stops at the next pattern or row instead of
+stalling the worker. Python's ``re`` cannot be
+interrupted mid-call, which is why unbounded patterns are also kept to a
+single line.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Deque, Dict, Iterator, List, Optional
+
+# Loops over rows re-check the time budget this often.
+BUDGET_CHECK_EVERY = 256
+
+
+class ParseBudgetExceeded(Exception):
+    """Raised inside the parser when an invoice runs past its time budget."""
+
+
+class MatchCounter:
+    __slots__ = ("matches",)
+
+    def __init__(self) -> None:
+        self.matches = 0
+
+
+class ParseProfile:
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.started = time.perf_counter()
+        self.aborted_at: Optional[str] = None
+        self.elapsed = 0.0
+        # name -> [calls, matches, seconds, max_seconds]
+        self.patterns: Dict[str, List[float]] = {}
+
+    def record(self, name: str, seconds: float, matches: int) -> None:
+        entry = self.patterns.setdefault(name, [0, 0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += matches
+        entry[2] += seconds
+        entry[3] = max(entry[3], seconds)
+
+    def finish(self) -> None:
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self) -> dict:
+        return {
+            "template": self.template,
+            "seconds": self.elapsed,
+            "aborted_at": self.aborted_at,
+            "patterns": {
+                name: {"calls": int(calls), "matches": int(matches), "seconds": seconds, "max_seconds": peak}
+                for name, (calls, matches, seconds, peak) in self.patterns.items()
+            },
+        }
+
+
+class ParseBudget:
+    """Parse time left for one document; ``budget_ms`` of 0 means unlimited."""
+
+    def __init__(self, budget_ms: int) -> None:
+        self.remaining: Optional[float] = budget_ms / 1000 if budget_ms > 0 else None
+        # ``time.perf_counter()`` value past which the running parse is cut short.
+        self.deadline: Optional[float] = None
+        self.aborted = False
+
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        """Charge the time spent inside the block against the budget."""
+
+        started = time.perf_counter()
+        if self.remaining is not None:
+            self.deadline = started + self.remaining
+        try:
+            yield
+        finally:
+            if self.remaining is not None:
+                self.remaining -= time.perf_counter() - started
+            self.deadline = None
+
+
+current_profile: ContextVar[Optional[ParseProfile]] = ContextVar("current_parse_profile", default=None)
+current_budget: ContextVar[Optional[ParseBudget]] = ContextVar("current_parse_budget", default=None)
+
+
+@contextmanager
+def pattern_timer(name: str) -> Iterator[MatchCounter]:
+    counter = MatchCounter()
+    check_budget(name)
+    profile = current_profile.get()
+    if profile is None:
+        yield counter
+        return
+    start = time.perf_counter()
+    try:
+        yield counter
+    finally:
+        profile.record(name, time.perf_counter() - start, counter.matches)
+
+
+def check_budget(name: str = "") -> None:
+    budget = current_budget.get()
+    if budget is not None and budget.deadline is not None and time.perf_counter() > budget.deadline:
+        budget.aborted = True
+        profile = current_profile.get()
+        if profile is not None:
+            profile.aborted_at = profile.aborted_at or name or "unknown"
+        raise ParseBudgetExceeded(name)
+
+
+class ProfileLog:
+    """Bounded history of recent invoice profiles."""
+
+    def __init__(self, maxlen: int = 200) -> None:
+        self._profiles: Deque[dict] = deque(maxlen=maxlen)
+        self._lock = Lock()
+
+    def add(self, profile: ParseProfile) -> None:
+        with self._lock:
+            self._profiles.append(profile.summary())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._profiles.clear()
+
+    def aggregate(self) -> dict:
+        with self._lock:
+            profiles = list(self._profiles)
+        patterns: Dict[str, dict] = {}
+        for profile in profiles:
+            for name, stats in profile["patterns"].items():
+                entry = patterns.setdefault(name, {"calls": 0, "matches": 0, "seconds": 0.0, "max_seconds": 0.0})
+                entry["calls"] += stats["calls"]
+                entry["matches"] += stats["matches"]
+                entry["seconds"] += stats["seconds"]
+                entry["max_seconds"] = max(entry["max_seconds"], stats["max_seconds"])
+        for entry in patterns.values():
+            entry["mean_seconds"] = entry["seconds"] / entry["calls"] if entry["calls"] else 0.0
+        return {
+            "invoices": len(profiles),
+            "aborted": sum(1 for profile in profiles if profile["aborted_at"]),
+            "seconds": sum(profile["seconds"] for profile in profiles),
+            "patterns": dict(sorted(patterns.items(), key=lambda item: item[1]["seconds"], reverse=True)),
+            "slowest": sorted(profiles, key=lambda profile: profile["seconds"], reverse=True)[:5],
+        }
+
+
+profile_log = ProfileLog()
@@ -0,0 +1,150 @@
+"""In-memory prefix index over the part catalog for type-ahead search.
+
+Keys are normalized part numbers (upper case, separators removed, so
+"68211-234AA" matches "68211234") kept in one sorted list; a prefix search
+is two ``bisect`` calls plus a slice. The index is loaded at startup and
+parts committed by ``get_or_create_part`` are added as their transaction
+commits; rolled-back inserts never appear. ``sync`` picks up rows written
+by other processes: anything with an id above ``synced_id``, the highest id
+seen by the last load or sync. Parts added locally do not move that mark,
+so a lower id committed by another worker afterwards is still found. The
+search endpoint syncs at most every ``part_index_sync_seconds``.
+
+The billed, invoiced and received flags are copied when a part is indexed
+and ``sync`` only reads new rows, so flags changed later show up on the next
+full ``load``, which the endpoint runs every ``part_index_reload_seconds``.
+"""
+
+from __future__ import annotations
+
+import bisect
+import re
+import time
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.models import Parts
+
+_SEPARATORS = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_part_number(value: str) -> str:
+    return _SEPARATORS.sub("", value.upper())
+
+
+class PartEntry(NamedTuple):
+    id: int
+    part_number: str
+    description: Optional[str]
+    billed: bool
+    invoiced: bool
+    received: bool
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "part_number": self.part_number,
+            "description": self.description,
+            "billed": self.billed,
+            "invoiced": self.invoiced,
+            "received": self.received,
+            "outstanding": not self.received,
+        }
+
+
+PART_COLUMNS = (Parts.id, Parts.part_number, Parts.description, Parts.billed, Parts.invoiced, Parts.received)
+
+
+class PartIndex:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._keys: List[Tuple[str, str]] = []
+        self._entries: Dict[str, PartEntry] = {}
+        self.synced_id = 0
+        self.loaded = False
+        self.loaded_at = 0.0
+        self.synced_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys = []
+            self._entries = {}
+            self.synced_id = 0
+            self.loaded = False
+            self.loaded_at = 0.0
+            self.synced_at = 0.0
+
+    def load(self, db: Session) -> None:
+        entries = {row.part_number: PartEntry(*row) for row in db.execute(select(*PART_COLUMNS))}
+        keys = sorted((normalize_part_number(number), number) for number in entries)
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self.synced_id = max((entry.id for entry in entries.values()), default=0)
+            self.loaded = True
+            self.loaded_at = self.synced_at = time.monotonic()
+
+    def add(self, entry: PartEntry) -> None:
+        with self._lock:
+            if entry.part_number not in self._entries:
+                bisect.insort(self._keys, (normalize_part_number(entry.part_number), entry.part_number))
+            self._entries[entry.part_number] = entry
+
+    def sync(self, db: Session) -> int:
+        """Add parts inserted since the last load or sync; returns how many."""
+
+        rows = db.execute(select(*PART_COLUMNS).where(Parts.id > self.synced_id).order_by(Parts.id)).all()
+        for row in rows:
+            self.add(PartEntry(*row))
+        if rows:
+            self.synced_id = max(self.synced_id, rows[-1].id)
+        self.synced_at = time.monotonic()
+        return len(rows)
+
+    def ensure_current(self, db: Session, max_age: float, reload_age: float = 0.0) -> None:
+        """Sync when older than ``max_age``; reload everything when loaded over ``reload_age`` ago (0 = never)."""
+
+        now = time.monotonic()
+        if not self.loaded or (reload_age > 0 and now - self.loaded_at >= reload_age):
+            self.load(db)
+        elif now - self.synced_at >= max_age:
+            self.sync(db)
+
+    def search(self, prefix: str, limit: int = 20) -> List[PartEntry]:
+        key = normalize_part_number(prefix)
+        with self._lock:
+            start = bisect.bisect_left(self._keys, (key,))
+            # Normalized keys are [0-9A-Z] only, so "\x7f" sorts after every
+            # key that starts with the prefix.
+            end = bisect.bisect_left(self._keys, (key + "\x7f",), lo=start)
+            return [self._entries[number] for _, number in self._keys[start : min(end, start + limit)]]
+
+
+part_index = PartIndex()
+
+_PENDING = "part_index_pending"
+
+
+def stage_part(db: Session, part: Parts) -> None:
+    """Queue a freshly flushed part for the index until its commit."""
+
+    db.info.setdefault(_PENDING, []).append(
+        PartEntry(part.id, part.part_number, part.description, bool(part.billed), bool(part.invoiced), bool(part.received))
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_staged_parts(session: Session) -> None:
+    for entry in session.info.pop(_PENDING, ()):
+        part_index.add(entry)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_staged_parts(session: Session) -> None:
+    session.info.pop(_PENDING, None)
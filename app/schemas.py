@@ -1,5 +1,5 @@
 from datetime import date, datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -94,6 +94,25 @@ class FileRecord(ORMModel):
 class UploadResponse(ORMModel):
     invoice: Invoice
     file: FileRecord
+    # Per-stage memory summary, present when memory profiling is enabled.
+    memory: Optional[Dict[str, Any]] = None
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(min_length=1)
+    total_bytes: Optional[int] = Field(None, ge=0)
+
+
+class UploadSession(ORMModel):
+    id: str
+    filename: str
+    total_bytes: Optional[int] = None
+    received_bytes: int
+    chunk_count: int
+    status: str
+    invoice_id: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
 
 
 class ParseTrigger(BaseModel):
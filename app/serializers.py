@@ -0,0 +1,178 @@
+"""Read-side serialization straight from Core rows to JSON bytes.
+
+The API's response models stay the source of truth for field names, order
+and types; this module only skips building and re-validating pydantic
+objects for every nested page, line and allocation on read endpoints.
+"""
+
+from __future__ import annotations
+
+import json
+import types
+import typing
+from collections import defaultdict
+from datetime import date
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Sequence
+
+from pydantic import BaseModel
+from sqlalchemy import Table, select
+from sqlalchemy.orm import Session
+
+from app.models import Charges, GLAllocations, InvoiceLines, InvoicePages, Invoices, OrderReferences
+from app.schemas import Charge, GLAllocation, Invoice, InvoiceLine, InvoicePage, OrderReference
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+try:  # pragma: no cover - exercised when the optional dependency is installed
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def _is_float_field(annotation: Any) -> bool:
+    if annotation is float:
+        return True
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        return float in typing.get_args(annotation)
+    return False
+
+
+class RowShape:
+    """Column list and float coercions for one response model over one table."""
+
+    def __init__(self, model: type[BaseModel], table: Table, parent_key: Optional[str] = None) -> None:
+        self.fields = [name for name in model.model_fields if name in table.c]
+        self.float_fields = {name for name in self.fields if _is_float_field(model.model_fields[name].annotation)}
+        self.columns = [table.c[name] for name in self.fields]
+        self.table = table
+        self.parent_column = table.c[parent_key] if parent_key else None
+
+    def to_dict(self, row: Sequence[Any], offset: int = 0) -> dict:
+        item = dict(zip(self.fields, row[offset:]))
+        # pydantic renders ints in float fields as ``1.0``; match it byte for byte.
+        for name in self.float_fields:
+            value = item[name]
+            if value is not None and not isinstance(value, float):
+                item[name] = float(value)
+        return item
+
+
+INVOICE_SHAPE = RowShape(Invoice, Invoices.__table__)
+CHILD_SHAPES: dict[str, RowShape] = {
+    "pages": RowShape(InvoicePage, InvoicePages.__table__, "invoice_id"),
+    "lines": RowShape(InvoiceLine, InvoiceLines.__table__, "invoice_id"),
+    "charges": RowShape(Charge, Charges.__table__, "invoice_id"),
+    "allocations": RowShape(GLAllocation, GLAllocations.__table__, "invoice_id"),
+    "orders": RowShape(OrderReference, OrderReferences.__table__, "invoice_id"),
+}
+NESTED_FIELDS = [name for name in Invoice.model_fields if name in CHILD_SHAPES]
+
+
+def _children_statement(shape: RowShape, invoice_ids: List[int]):
+    return (
+        select(shape.parent_column, *shape.columns)
+        .where(shape.parent_column.in_(invoice_ids))
+        .order_by(shape.parent_column, shape.table.c.id)
+    )
+
+
+def _group_children(shape: RowShape, rows: Iterable[Sequence[Any]]) -> dict[int, List[dict]]:
+    children: dict[int, List[dict]] = defaultdict(list)
+    for row in rows:
+        children[row[0]].append(shape.to_dict(row, offset=1))
+    return children
+
+
+def _load_children(db: Session, shape: RowShape, invoice_ids: List[int]) -> dict[int, List[dict]]:
+    return _group_children(shape, db.execute(_children_statement(shape, invoice_ids)))
+
+
+def _header_statement(invoice_ids: Optional[Iterable[int]], order_by: Sequence[Any]):
+    stmt = select(*INVOICE_SHAPE.columns)
+    if invoice_ids is not None:
+        stmt = stmt.where(Invoices.id.in_(list(invoice_ids)))
+    return stmt.order_by(*order_by)
+
+
+def _attach_children(headers: List[dict], children: dict[str, dict[int, List[dict]]]) -> None:
+    for header in headers:
+        for name in NESTED_FIELDS:
+            header[name] = children[name].get(header["id"], [])
+
+
+def invoice_payloads(db: Session, invoice_ids: Optional[Iterable[int]] = None, order_by: Sequence[Any] = (Invoices.id,)) -> List[dict]:
+    """Build plain dicts shaped exactly like ``schemas.Invoice``.
+
+    One query loads the headers and one query per child table loads every
+    nested row, so the cost no longer grows with a lazy load per invoice.
+    Content of archived invoices is filled back in from the cold archive.
+    """
+
+    headers = [INVOICE_SHAPE.to_dict(row) for row in db.execute(_header_statement(invoice_ids, order_by))]
+    if not headers:
+        return []
+
+    from app.archive import rehydrate
+
+    ids = [header["id"] for header in headers]
+    _attach_children(headers, {name: _load_children(db, CHILD_SHAPES[name], ids) for name in NESTED_FIELDS})
+    rehydrate(db, headers)
+    return headers
+
+
+async def invoice_payloads_async(db: AsyncSession, invoice_ids: Optional[Iterable[int]] = None, order_by: Sequence[Any] = (Invoices.id,)) -> List[dict]:
+    """``invoice_payloads`` over an ``AsyncSession``, awaiting each query."""
+
+    headers = [INVOICE_SHAPE.to_dict(row) for row in await db.execute(_header_statement(invoice_ids, order_by))]
+    if not headers:
+        return []
+
+    from starlette.concurrency import run_in_threadpool
+
+    from app.archive import archived_ids_statement, restore_archived
+
+    ids = [header["id"] for header in headers]
+    children = {}
+    for name in NESTED_FIELDS:
+        shape = CHILD_SHAPES[name]
+        children[name] = _group_children(shape, await db.execute(_children_statement(shape, ids)))
+    _attach_children(headers, children)
+    archived = (await db.scalars(archived_ids_statement(headers))).all()
+    if archived:
+        # The sidecar is a blocking sqlite3 read.
+        await run_in_threadpool(restore_archived, headers, archived)
+    return headers
+
+
+def invoice_json(db: Session, invoice_id: int) -> Optional[bytes]:
+    payloads = invoice_payloads(db, [invoice_id])
+    return dumps(payloads[0]) if payloads else None
+
+
+async def invoice_json_async(db: AsyncSession, invoice_id: int) -> Optional[bytes]:
+    payloads = await invoice_payloads_async(db, [invoice_id])
+    return dumps(payloads[0]) if payloads else None
+
+
+LIST_ORDER = (Invoices.created_at.desc(), Invoices.id.desc())
+
+
+def invoice_list_json(db: Session) -> bytes:
+    return dumps(invoice_payloads(db, order_by=LIST_ORDER))
+
+
+async def invoice_list_json_async(db: AsyncSession) -> bytes:
+    return dumps(await invoice_payloads_async(db, order_by=LIST_ORDER))
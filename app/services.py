@@ -1,45 +1,253 @@
 from __future__ import annotations
 
+import hashlib
 import logging
-from typing import Iterable, List
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
 
+from sqlalchemy import or_, update
 from sqlalchemy.orm import Session
 
-from app import parser
-from app.models import Charges, Files, GLAllocations, InvoiceLines, InvoicePages, Invoices, Parts, Shipments
+from app import analytics, archive, parser
+from app.cache import invoice_cache
+from app.config import get_settings
+from app.memory_profile import memory_stage
+from app.models import Charges, Files, GLAllocations, IngestionJobs, InvoiceLines, InvoicePages, Invoices, Parts, Shipments
+from app.part_index import stage_part
 from app.storage import save_pdf
 
 logger = logging.getLogger(__name__)
 
 
-def process_upload(db: Session, filename: str, data: bytes) -> Invoices:
+def process_upload(db: Session, filename: str, data: bytes, reparse: Optional[List[int]] = None) -> Invoices:
+    """Store and parse an upload, streaming invoices into the database.
+
+    Invoices are parsed one at a time and committed every
+    ``ingest_commit_every`` invoices together with the progress of an
+    ``IngestionJobs`` row, so memory stays bounded and a packet that failed
+    part way resumes after its last committed invoice. A failed job is marked
+    ``failed``; only failed jobs and running jobs whose lease expired are
+    resumed. Exact duplicates are skipped.
+
+    ``reparse`` lists the ids of the invoices stored from these bytes before
+    (``file_invoice_ids``), in parse order. Each fresh parse then updates one
+    of them in place: the one with the same duplicate key, else the next one
+    not yet updated. Invoices whose number, date or total changed are thus
+    refreshed rather than copied. Segments that match another upload's
+    invoice are skipped, and extra segments are stored as new invoices.
+    """
+
     logger.info("Processing upload for %s", filename)
-    original_path, summary_path = save_pdf(filename, data)
-    invoice_models = []
-    for inv in parser.parse_pdf_bytes(data):
-        invoice_model = persist_invoice(db, inv, filename, original_path.as_posix(), summary_path.as_posix())
-        invoice_models.append(invoice_model)
-    db.commit()
-    return invoice_models[0]
-
-
-def persist_invoice(db: Session, invoice_data: parser.Invoice, filename: str, original_path: str, summary_path: str) -> Invoices:
-    invoice = Invoices(
-        invoice_number=invoice_data.invoice_number,
-        invoice_date=invoice_data.invoice_date,
-        order_number=invoice_data.order_number,
-        vendor_name=invoice_data.vendor_name,
-        customer_name=invoice_data.customer_name,
-        subtotal=invoice_data.subtotal,
-        tax=invoice_data.tax,
-        freight=invoice_data.freight,
-        total=invoice_data.total,
-        parsing_confidence=invoice_data.parsing_confidence,
-        raw_text=invoice_data.raw_text,
+    with memory_stage("store"):
+        original_path, summary_path = save_pdf(filename, data)
+        content_hash = hashlib.sha256(data).hexdigest()
+    commit_every = max(get_settings().ingest_commit_every, 1)
+    job = start_or_resume_job(db, content_hash, filename)
+    job_id = job.id
+    unmatched: Optional[Dict[int, Optional[str]]] = None
+    if reparse is not None:
+        keys = dict(db.query(Invoices.id, Invoices.dedupe_key).filter(Invoices.id.in_(reparse)).all())
+        # A resumed re-parse already updated the first ``invoices_done``.
+        unmatched = {invoice_id: keys.get(invoice_id) for invoice_id in reparse[job.invoices_done :]}
+
+    try:
+        invoices = parser.iter_parsed_invoices(data, path=original_path, skip=job.invoices_done, content_hash=content_hash)
+        for index, inv in enumerate(invoices, start=job.invoices_done):
+            with memory_stage("persist"):
+                key = duplicate_key(inv)
+                target_id = reparse_target(db, unmatched, key) if unmatched is not None else None
+                if target_id is not None:
+                    invoice_model = refresh_invoice(db, db.get(Invoices, target_id), inv)
+                elif (invoice_model := find_duplicate(db, key)) is not None:
+                    logger.info("Skipping duplicate invoice %s (matches invoice %s)", inv.invoice_number, invoice_model.id)
+                else:
+                    invoice_model = persist_invoice(
+                        db,
+                        inv,
+                        filename,
+                        original_path.as_posix(),
+                        summary_path.as_posix(),
+                        dedupe_key=key,
+                        content_hash=content_hash,
+                    )
+                if job.first_invoice_id is None:
+                    db.flush()
+                    job.first_invoice_id = invoice_model.id
+                job.invoices_done = index + 1
+            if job.invoices_done % commit_every == 0:
+                with memory_stage("commit"):
+                    db.commit()
+                    # Drop committed rows from the identity map so it does not
+                    # grow with the packet.
+                    db.expunge_all()
+                    job = db.get(IngestionJobs, job_id)
+
+        job.status = "completed"
+        with memory_stage("commit"):
+            db.commit()
+    except parser.ParseBudgetExceeded:
+        # Raised between invoices, so everything persisted so far is whole;
+        # keep it and let the retry resume at the next invoice.
+        db.commit()
+        set_job_status(db, job_id, "running", "failed")
+        raise
+    except BaseException:
+        # Committed invoices stay; release the job so a retry resumes it.
+        db.rollback()
+        set_job_status(db, job_id, "running", "failed")
+        raise
+    return db.get(Invoices, job.first_invoice_id)
+
+
+def file_invoice_ids(db: Session, file: Files) -> List[int]:
+    """Ids of the invoices stored from the same upload as ``file``, in parse order."""
+
+    same_upload = Files.content_hash == file.content_hash if file.content_hash else Files.original_path == file.original_path
+    return [invoice_id for (invoice_id,) in db.query(Files.invoice_id).filter(same_upload, Files.invoice_id.isnot(None)).order_by(Files.invoice_id)]
+
+
+def reparse_target(db: Session, unmatched: Dict[int, Optional[str]], key: Optional[str]) -> Optional[int]:
+    """Take the stored invoice a re-parsed segment replaces out of ``unmatched``."""
+
+    target_id = next((invoice_id for invoice_id, stored_key in unmatched.items() if key is not None and stored_key == key), None)
+    if target_id is None and unmatched:
+        duplicate = find_duplicate(db, key)
+        if duplicate is None or duplicate.id in unmatched:
+            target_id = next(iter(unmatched))
+    unmatched.pop(target_id, None)
+    return target_id
+
+
+def start_or_resume_job(db: Session, content_hash: str, filename: str) -> IngestionJobs:
+    """Claim an abandoned job for these bytes, or start a new one.
+
+    A job that is running under a live lease belongs to another request and
+    is left alone. Failed jobs and jobs whose lease expired are claimed with
+    a conditional update, so two uploads of the same bytes never resume the
+    same job.
+    """
+
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=get_settings().ingest_job_lease_seconds)
+    job = (
+        db.query(IngestionJobs)
+        .filter(
+            IngestionJobs.content_hash == content_hash,
+            or_(
+                IngestionJobs.status == "failed",
+                (IngestionJobs.status == "running") & (IngestionJobs.updated_at < lease_expired),
+            ),
+        )
+        .order_by(IngestionJobs.id.desc())
+        .first()
     )
+    if job is not None:
+        claimed = db.execute(
+            update(IngestionJobs)
+            .where(IngestionJobs.id == job.id, IngestionJobs.status == job.status, IngestionJobs.updated_at == job.updated_at)
+            .values(status="running", updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if claimed:
+            db.refresh(job)
+            logger.info("Resuming ingestion of %s after %s invoices", filename, job.invoices_done)
+            return job
+    job = IngestionJobs(content_hash=content_hash, filename=filename, status="running", invoices_done=0)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def set_job_status(db: Session, job_id: int, current: str, status: str) -> bool:
+    changed = db.execute(
+        update(IngestionJobs)
+        .where(IngestionJobs.id == job_id, IngestionJobs.status == current)
+        .values(status=status, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return bool(changed)
+
+
+def persist_invoice(
+    db: Session,
+    invoice_data: parser.Invoice,
+    filename: str,
+    original_path: str,
+    summary_path: str,
+    dedupe_key: Optional[str] = None,
+    content_hash: Optional[str] = None,
+) -> Invoices:
+    invoice = Invoices(dedupe_key=dedupe_key if dedupe_key is not None else duplicate_key(invoice_data))
+    apply_header_fields(invoice, invoice_data)
     db.add(invoice)
     db.flush()
 
+    add_invoice_children(db, invoice, invoice_data)
+    analytics.record_invoice(db, invoice, invoice_data.lines, invoice_data.allocations)
+
+    db.add(
+        Files(
+            filename=filename,
+            original_path=original_path,
+            summary_path=summary_path,
+            content_hash=content_hash,
+            invoice_id=invoice.id,
+        )
+    )
+
+    db.add(Shipments(invoice_id=invoice.id, description="Auto-created shipment placeholder", received=False))
+
+    logger.info("Persisted invoice %s", invoice.invoice_number)
+    return invoice
+
+
+def refresh_invoice(db: Session, invoice: Invoices, invoice_data: parser.Invoice) -> Invoices:
+    """Replace the parsed content of a stored invoice and bump its version.
+
+    Shipments and file records are left alone because they carry receiving
+    state and provenance rather than parsed data.
+    """
+
+    previous = analytics.invoice_deltas(invoice, invoice.lines, invoice.allocations, sign=-1)
+    apply_header_fields(invoice, invoice_data)
+    invoice.dedupe_key = duplicate_key(invoice_data)
+    invoice.pages.clear()
+    invoice.lines.clear()
+    invoice.charges.clear()
+    invoice.allocations.clear()
+    invoice.version = (invoice.version or 1) + 1
+    archive.forget_archived(db, invoice.id)
+    db.flush()
+
+    add_invoice_children(db, invoice, invoice_data)
+    current = analytics.invoice_deltas(invoice, invoice_data.lines, invoice_data.allocations)
+    analytics.apply_deltas(db, analytics.merge_deltas(previous, current))
+    db.expire(invoice, ["pages", "lines", "charges", "allocations"])
+    invoice_cache.invalidate(invoice.id)
+
+    logger.info("Re-parsed invoice %s (version %s)", invoice.invoice_number, invoice.version)
+    return invoice
+
+
+def apply_header_fields(invoice: Invoices, invoice_data: parser.Invoice) -> None:
+    invoice.invoice_number = invoice_data.invoice_number
+    invoice.invoice_date = invoice_data.invoice_date
+    invoice.order_number = invoice_data.order_number
+    invoice.vendor_name = invoice_data.vendor_name
+    invoice.customer_name = invoice_data.customer_name
+    invoice.subtotal = invoice_data.subtotal
+    invoice.tax = invoice_data.tax
+    invoice.freight = invoice_data.freight
+    invoice.total = invoice_data.total
+    invoice.parsing_confidence = invoice_data.parsing_confidence
+    invoice.raw_text = invoice_data.raw_text
+
+
+def add_invoice_children(db: Session, invoice: Invoices, invoice_data: parser.Invoice) -> None:
     for page in invoice_data.pages:
         db.add(
             InvoicePages(
@@ -60,7 +268,11 @@ def persist_invoice(db: Session, invoice_data: parser.Invoice, filename: str, or
                 description=line.description,
                 quantity=line.quantity,
                 unit_cost=line.unit_cost,
+                list_price=line.list_price,
+                net_price=line.net_price,
+                discount_percent=line.discount_percent,
                 extended_cost=line.extended_cost,
+                uom=line.uom,
             )
         )
 
@@ -77,12 +289,93 @@ def persist_invoice(db: Session, invoice_data: parser.Invoice, filename: str, or
             )
         )
 
-    db.add(Files(filename=filename, original_path=original_path, summary_path=summary_path, invoice_id=invoice.id))
 
-    db.add(Shipments(invoice_id=invoice.id, description="Auto-created shipment placeholder", received=False))
+def normalize_vendor(vendor: Optional[str]) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", vendor or "").lower().split())
 
-    logger.info("Persisted invoice %s", invoice.invoice_number)
-    return invoice
+
+def normalize_invoice_number(number: Optional[str]) -> str:
+    return re.sub(r"[^0-9A-Za-z]", "", number or "").upper().lstrip("0")
+
+
+def duplicate_key(invoice_data: parser.Invoice) -> Optional[str]:
+    """Build the exact-duplicate key: vendor, cleaned number, date, total in cents.
+
+    Invoices without a usable number cannot be told apart reliably, so they get
+    no key and are always persisted.
+    """
+
+    number = normalize_invoice_number(invoice_data.invoice_number)
+    if not number:
+        return None
+    invoice_date = invoice_data.invoice_date.isoformat() if invoice_data.invoice_date else ""
+    total = f"{round(invoice_data.total, 2):.2f}" if invoice_data.total is not None else ""
+    return "|".join([normalize_vendor(invoice_data.vendor_name), number, invoice_date, total])
+
+
+def backfill_dedupe_keys(db: Session) -> int:
+    """Key invoices stored before duplicate keys existed, so re-scans of them are caught.
+
+    Stored rows carry the same vendor, number, date and total fields as a
+    parse, so they get the key a fresh parse of them would. Returns how many
+    were keyed.
+    """
+
+    rows = db.query(Invoices.id, Invoices.vendor_name, Invoices.invoice_number, Invoices.invoice_date, Invoices.total).filter(
+        Invoices.dedupe_key.is_(None), Invoices.invoice_number.isnot(None)
+    )
+    keyed = [{"id": row.id, "dedupe_key": key} for row in rows if (key := duplicate_key(row))]
+    if keyed:
+        db.execute(update(Invoices), keyed)
+        logger.info("Backfilled duplicate keys for %s invoices", len(keyed))
+    db.commit()
+    return len(keyed)
+
+
+def find_duplicate(db: Session, key: Optional[str]) -> Optional[Invoices]:
+    if key is None:
+        return None
+    return db.query(Invoices).filter_by(dedupe_key=key).order_by(Invoices.id).first()
+
+
+def find_near_duplicates(db: Session) -> List[dict]:
+    """Group invoices that look alike without sharing an exact duplicate key.
+
+    Two invoices are near matches when they share vendor and cleaned invoice
+    number (but differ in date or total), or share vendor, date and total under
+    different invoice numbers. Groups whose members all share one duplicate
+    key are exact duplicates and are left out.
+    """
+
+    rows = db.query(
+        Invoices.id, Invoices.vendor_name, Invoices.invoice_number, Invoices.invoice_date, Invoices.total, Invoices.dedupe_key
+    ).all()
+    by_number: dict[tuple, list] = defaultdict(list)
+    by_amount: dict[tuple, list] = defaultdict(list)
+    for row in rows:
+        vendor = normalize_vendor(row.vendor_name)
+        number = normalize_invoice_number(row.invoice_number)
+        if number:
+            by_number[(vendor, number)].append(row)
+        if row.invoice_date is not None and row.total is not None:
+            by_amount[(vendor, row.invoice_date, round(row.total, 2))].append(row)
+
+    groups: List[dict] = []
+    for (vendor, number), members in by_number.items():
+        if len({m.dedupe_key for m in members}) > 1:
+            groups.append({"reason": "same_number", "vendor": vendor, "invoice_number": number, "invoice_ids": sorted(m.id for m in members)})
+    for (vendor, invoice_date, total), members in by_amount.items():
+        if len({normalize_invoice_number(m.invoice_number) for m in members}) > 1:
+            groups.append(
+                {
+                    "reason": "same_date_and_total",
+                    "vendor": vendor,
+                    "invoice_date": invoice_date.isoformat(),
+                    "total": total,
+                    "invoice_ids": sorted(m.id for m in members),
+                }
+            )
+    return groups
 
 
 def get_or_create_part(db: Session, part_number: str, description: str | None):
@@ -91,16 +384,19 @@ def get_or_create_part(db: Session, part_number: str, description: str | None):
         part = Parts(part_number=part_number, description=description)
         db.add(part)
         db.flush()
+        stage_part(db, part)
     return part
 
 
-def retryable_process(db: Session, filename: str, data: bytes, attempts: int = 3) -> Invoices:
+def retryable_process(db: Session, filename: str, data: bytes, attempts: int = 3, reparse: Optional[List[int]] = None) -> Invoices:
     last_exc: Exception | None = None
     for _ in range(attempts):
         try:
-            return process_upload(db, filename, data)
+            return process_upload(db, filename, data, reparse=reparse)
         except Exception as exc:  # pragma: no cover - logging path
             logger.exception("Error processing upload: %s", exc)
+            # Committed invoices stay and the job is marked failed; the next
+            # attempt claims it and resumes after them.
             last_exc = exc
     raise RuntimeError("Failed to process upload") from last_exc
 
@@ -0,0 +1,215 @@
+"""Per-request SQL statement profiling and the slow-query log.
+
+When ``sql_profile`` is on, ``instrument`` hooks the engine's cursor events
+and ``SQLProfileMiddleware`` gives every HTTP request a ``RequestQueries``
+collector through a context variable. A request records its statement
+count, total database time and its slowest statements with normalized SQL
+(literals and ``IN`` lists folded). The totals go out in a
+``Server-Timing`` header and are aggregated per request shape (method plus
+route template) for ``/debug/sql-profile``.
+
+Statements slower than ``sql_slow_ms`` are logged to ``app.sql.slow`` and
+kept in a bounded list, with the SQLite ``EXPLAIN QUERY PLAN`` when
+``sql_explain_slow`` is on.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from threading import Lock
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import get_settings
+
+slow_logger = logging.getLogger("app.sql.slow")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def normalize_sql(statement: str) -> str:
+    """Fold literals and parameter lists so equivalent statements group together."""
+
+    text = _STRING.sub("?", statement)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("IN (...)", text)
+    return _SPACE.sub(" ", text).strip()
+
+
+class RequestQueries:
+    """Statements executed while handling one request."""
+
+    def __init__(self, top: int = 5) -> None:
+        self.top = top
+        self.count = 0
+        self.seconds = 0.0
+        self._lock = Lock()
+        # Min-heap of (seconds, sequence, sql) holding the slowest ``top``.
+        self._slowest: List[Tuple[float, int, str]] = []
+
+    def add(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            entry = (seconds, self.count, statement)
+            if len(self._slowest) < self.top:
+                heapq.heappush(self._slowest, entry)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self) -> List[dict]:
+        return [{"ms": seconds * 1000, "sql": normalize_sql(sql)} for seconds, _, sql in sorted(self._slowest, reverse=True)]
+
+
+current_queries: ContextVar[Optional[RequestQueries]] = ContextVar("current_request_queries", default=None)
+
+
+class ProfileStore:
+    """Aggregates per request shape plus the bounded slow-query list."""
+
+    def __init__(self, slow_entries: int = 200) -> None:
+        self._lock = Lock()
+        self._shapes: Dict[str, dict] = {}
+        self.slow: Deque[dict] = deque(maxlen=slow_entries)
+
+    def record(self, shape: str, queries: RequestQueries, seconds: float) -> None:
+        slowest = queries.slowest()
+        with self._lock:
+            entry = self._shapes.setdefault(
+                shape, {"requests": 0, "queries": 0, "max_queries": 0, "db_ms": 0.0, "max_db_ms": 0.0, "request_ms": 0.0, "slowest": []}
+            )
+            entry["requests"] += 1
+            entry["queries"] += queries.count
+            entry["max_queries"] = max(entry["max_queries"], queries.count)
+            entry["db_ms"] += queries.seconds * 1000
+            entry["max_db_ms"] = max(entry["max_db_ms"], queries.seconds * 1000)
+            entry["request_ms"] += seconds * 1000
+            merged = {item["sql"]: item for item in entry["slowest"]}
+            for item in slowest:
+                if item["sql"] not in merged or merged[item["sql"]]["ms"] < item["ms"]:
+                    merged[item["sql"]] = item
+            entry["slowest"] = sorted(merged.values(), key=lambda item: item["ms"], reverse=True)[: queries.top]
+
+    def add_slow(self, entry: dict) -> None:
+        with self._lock:
+            self.slow.append(entry)
+
+    def report(self) -> dict:
+        with self._lock:
+            shapes = []
+            for shape, entry in self._shapes.items():
+                requests = entry["requests"]
+                shapes.append(
+                    {
+                        "shape": shape,
+                        "requests": requests,
+                        "mean_queries": entry["queries"] / requests,
+                        "max_queries": entry["max_queries"],
+                        "mean_db_ms": entry["db_ms"] / requests,
+                        "max_db_ms": entry["max_db_ms"],
+                        "mean_request_ms": entry["request_ms"] / requests,
+                        "slowest": list(entry["slowest"]),
+                    }
+                )
+            slow = list(self.slow)
+        # Worst first: total database time the shape has cost.
+        shapes.sort(key=lambda item: item["mean_db_ms"] * item["requests"], reverse=True)
+        return {"shapes": shapes, "slow_queries": slow}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+            self.slow.clear()
+
+
+profile_store = ProfileStore()
+
+
+def _explain(cursor, statement: str, parameters) -> Optional[List[str]]:
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    try:
+        # A fresh DBAPI cursor on the same connection; engine events do not fire.
+        plan = cursor.connection.cursor()
+        try:
+            plan.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+            return [str(row[-1]) for row in plan.fetchall()]
+        finally:
+            plan.close()
+    except Exception as exc:  # pragma: no cover - best effort diagnostics
+        return [f"explain failed: {exc}"]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    queries = current_queries.get()
+    if queries is not None:
+        queries.add(statement, seconds)
+
+    settings = get_settings()
+    if seconds * 1000 < settings.sql_slow_ms:
+        return
+    entry = {"ms": seconds * 1000, "sql": normalize_sql(statement)}
+    if settings.sql_explain_slow and conn.engine.url.get_backend_name() == "sqlite":
+        entry["plan"] = _explain(cursor, statement, parameters)
+    slow_logger.warning("Slow query (%.1f ms): %s%s", entry["ms"], entry["sql"], f" plan={entry['plan']}" if entry.get("plan") else "")
+    profile_store.add_slow(entry)
+
+
+def instrument(engine: Engine) -> Engine:
+    """Attach the profiling hooks to ``engine`` (idempotent)."""
+
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def request_shape(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None) or _ID_SEGMENT.sub("/{id}", scope.get("path", ""))
+    return f"{scope.get('method', '')} {path}"
+
+
+class SQLProfileMiddleware:
+    """Collect the statements of every HTTP request and report them."""
+
+    def __init__(self, app, top: int = 5) -> None:
+        self.app = app
+        self.top = top
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries(self.top)
+        token = current_queries.set(queries)
+        started = time.perf_counter()
+
+        async def send_with_timing(message) -> None:
+            if message["type"] == "http.response.start":
+                timing = f'db;dur={queries.seconds * 1000:.2f};desc="{queries.count} queries"'
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_queries.reset(token)
+            profile_store.record(request_shape(scope), queries, time.perf_counter() - started)
@@ -1,26 +1,275 @@
+"""Content-addressed storage for uploaded PDFs.
+
+Originals are named by their SHA-256 and laid out in hash-prefix shards
+(``originals/ab/cd/<hash>.pdf``) so no directory grows past a few hundred
+entries, and identical uploads are stored once. Writes go to a temporary
+file in the target directory and are renamed into place, so a crash never
+leaves a truncated PDF behind.
+
+Two retention steps run from ``apply_retention`` (``python -m app.storage
+retention``):
+
+* hot files older than ``storage_compress_after_days`` are gzip-compressed
+  in place (``<hash>.pdf.gz``);
+* files older than ``storage_archive_after_months``, and the oldest files
+  beyond ``storage_hot_max_bytes``, move compressed to the archive tier
+  (``storage_archive_path``, e.g. a cheaper volume).
+
+``Files.original_path`` always points at the current location. Reads go
+through ``open_stored``/``stored_size``, which decompress transparently.
+
+Uploads and retention can run at the same time, in different processes.
+``save`` reuses an existing copy (compressed first) by touching it, which
+fails if the copy was just removed. Retention retires a source by renaming
+it away and only deletes it if no upload touched it since the scan;
+otherwise it is put back for the new upload's row.
+"""
+
 from __future__ import annotations
 
-import shutil
+import argparse
+import gzip
+import hashlib
+import io
+import logging
+import os
+import struct
+import tempfile
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from app.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_SUFFIX = ".gz"
+# Average month length used to turn the retention setting into an age.
+DAYS_PER_MONTH = 30.44
+
+
+def shard_path(root: Path, content_hash: str, depth: int, suffix: str = ".pdf") -> Path:
+    """``root/ab/cd/<hash><suffix>`` for ``depth`` two-character shard levels."""
+
+    shards = [content_hash[i * 2 : i * 2 + 2] for i in range(depth)]
+    return root.joinpath(*shards, content_hash + suffix)
+
+
+def atomic_write(path: Path, chunks: Iterator[bytes] | bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=path.suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in [chunks] if isinstance(chunks, bytes) else chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def is_compressed(path: Path | str) -> bool:
+    return str(path).endswith(COMPRESSED_SUFFIX)
+
+
+def open_stored(path: Path | str) -> BinaryIO:
+    """Open a stored original for reading, decompressing if needed."""
+
+    return gzip.open(path, "rb") if is_compressed(path) else open(path, "rb")
+
+
+def read_stored(path: Path | str) -> bytes:
+    with open_stored(path) as f:
+        return f.read()
+
+
+def stored_size(path: Path | str) -> int:
+    """Uncompressed size; gzip keeps it (mod 2**32) in the last four bytes."""
+
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", f.read(4))[0]
+
+
+def _file_chunks(source: Path) -> Iterator[bytes]:
+    with open(source, "rb") as f:
+        yield from iter(lambda: f.read(1 << 20), b"")
+
 
-from app.config import get_settings
+def _gzip_chunks(source: Path) -> Iterator[bytes]:
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename="", mode="wb", fileobj=buffer, mtime=0) as gz:
+        for block in _file_chunks(source):
+            gz.write(block)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
 
-settings = get_settings()
+
+def hash_stored(path: Path | str) -> str:
+    digest = hashlib.sha256()
+    with open_stored(path) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ShardedStore:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.originals = settings.storage_path / "originals"
+        self.archive = settings.storage_archive_path or settings.storage_path / "archive"
+        self.depth = settings.storage_shard_depth
+
+    def save(self, data: bytes) -> Tuple[str, Path]:
+        content_hash = hashlib.sha256(data).hexdigest()
+        for suffix in (".pdf" + COMPRESSED_SUFFIX, ".pdf"):
+            existing = shard_path(self.originals, content_hash, self.depth, suffix)
+            try:
+                # Touching claims the copy: retention keeps a file whose
+                # mtime changed, and this fails if retention removed it.
+                os.utime(existing)
+                return content_hash, existing
+            except FileNotFoundError:
+                continue
+        path = shard_path(self.originals, content_hash, self.depth)
+        atomic_write(path, data)
+        return content_hash, path
+
+    def compress(self, path: Path, content_hash: str, root: Optional[Path] = None) -> Path:
+        """Gzip ``path`` into ``root`` (same shard layout), removing the source.
+
+        Legacy flat-layout files are moved into the sharded layout on the way.
+        Use ``compress_copy`` and ``retire`` when uploads may be running.
+        """
+
+        target = self.compress_copy(path, content_hash, root)
+        if target != path:
+            path.unlink()
+        return target
+
+    def compress_copy(self, path: Path, content_hash: str, root: Optional[Path] = None) -> Path:
+        """Write the gzip of ``path`` into ``root`` and return it; ``path`` is kept."""
+
+        target = shard_path(root or self.originals, content_hash, self.depth, ".pdf" + COMPRESSED_SUFFIX)
+        if path != target:
+            atomic_write(target, _file_chunks(path) if is_compressed(path) else _gzip_chunks(path))
+        return target
+
+    def retire(self, path: Path, mtime_ns: int) -> bool:
+        """Delete ``path`` unless an upload touched it after ``mtime_ns``.
+
+        The file is renamed away first, so a concurrent ``save`` either
+        touched it before (and it is put back) or no longer finds it.
+        """
+
+        retired = path.with_name(f".retired-{path.name}")
+        try:
+            os.rename(path, retired)
+        except FileNotFoundError:
+            return True
+        if os.stat(retired).st_mtime_ns != mtime_ns:
+            os.replace(retired, path)
+            return False
+        retired.unlink()
+        return True
 
 
 def save_pdf(filename: str, data: bytes) -> Tuple[Path, Path]:
-    originals_dir = settings.storage_path / "originals"
-    summaries_dir = settings.storage_path / "summaries"
-    originals_dir.mkdir(parents=True, exist_ok=True)
-    summaries_dir.mkdir(parents=True, exist_ok=True)
+    """Store an upload and return ``(original_path, summary_path)``.
+
+    ``filename`` is kept on the ``Files`` row only; the stored name is the
+    content hash. The summary is still a placeholder for the original, so
+    it points at the same stored object instead of a second copy.
+    """
+
+    _, path = ShardedStore(get_settings()).save(data)
+    return path, path
+
+
+def apply_retention(db, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Compress cold originals and move old ones to the archive tier."""
+
+    from app.models import Files
+
+    settings = get_settings()
+    store = ShardedStore(settings)
+    now = now or datetime.utcnow()
+    compress_before = now - timedelta(days=settings.storage_compress_after_days) if settings.storage_compress_after_days else None
+    archive_before = now - timedelta(days=settings.storage_archive_after_months * DAYS_PER_MONTH) if settings.storage_archive_after_months else None
+    archive_root = store.archive.resolve()
+
+    files = db.query(Files).order_by(Files.uploaded_at).all()
+    by_path: Dict[str, list] = {}
+    for file in files:
+        by_path.setdefault(file.original_path, []).append(file)
+
+    hot: list[Tuple[datetime, str]] = []
+    for path, rows in by_path.items():
+        if not Path(path).exists() or archive_root in Path(path).resolve().parents:
+            continue
+        # A shared object is only as old as its newest upload.
+        hot.append((max(row.uploaded_at for row in rows), path))
+
+    hot_bytes = sum(os.path.getsize(path) for _, path in hot)
+    moved = {"compressed": 0, "archived": 0, "hot_bytes_freed": 0}
+
+    def relocate(path: str, root: Optional[Path]) -> bool:
+        """Move ``path`` under ``root`` (compressed in place if None); False if it stayed."""
+
+        nonlocal hot_bytes
+        rows = by_path[path]
+        content_hash = next((row.content_hash for row in rows if row.content_hash), None) or hash_stored(path)
+        stat = os.stat(path)
+        target_path = store.compress_copy(Path(path), content_hash, root)
+        target = target_path.as_posix()
+        if target == path:
+            return False
+        # Re-read the rows: uploads may have committed new ones for this path
+        # since the scan. Commit before retiring so no committed row points
+        # at a file that is gone.
+        for row in db.query(Files).filter(Files.original_path == path):
+            if row.summary_path == row.original_path:
+                row.summary_path = target
+            row.original_path = target
+        db.commit()
+        if not store.retire(Path(path), stat.st_mtime_ns):
+            # An upload is reusing the file; its row keeps this path and the
+            # next run moves it.
+            logger.info("Kept %s: reused by an upload during retention", path)
+            return False
+        after = os.path.getsize(target) if root is None else 0
+        hot_bytes -= stat.st_size - after
+        moved["hot_bytes_freed"] += stat.st_size - after
+        return True
+
+    for uploaded_at, path in sorted(hot):
+        over_budget = settings.storage_hot_max_bytes and hot_bytes > settings.storage_hot_max_bytes
+        if (archive_before and uploaded_at < archive_before) or over_budget:
+            moved["archived"] += relocate(path, store.archive)
+        elif compress_before and uploaded_at < compress_before and not is_compressed(path):
+            moved["compressed"] += relocate(path, None)
+    logger.info("Retention: %s", moved)
+    return moved
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description="Storage maintenance")
+    cli.add_argument("command", choices=["retention"])
+    cli.parse_args()
+
+    from app.database import SessionLocal, init_engine
 
-    original_path = originals_dir / filename
-    with open(original_path, "wb") as f:
-        f.write(data)
+    init_engine()
+    with SessionLocal() as db:
+        print(apply_retention(db))
 
-    summary_path = summaries_dir / f"summary-{filename}"
-    # For MVP we keep the same content as a placeholder summary document.
-    shutil.copyfile(original_path, summary_path)
 
-    return original_path, summary_path
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
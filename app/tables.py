@@ -0,0 +1,299 @@
+"""Line-item table extraction restricted to detected table regions.
+
+Two paths share one header vocabulary:
+
+* PDFs are read as positioned characters, taken from the page layout that
+  text extraction already built (``app.extraction``), so no second pdfminer
+  pass is needed. On each page the header row is located, the rows below it
+  are collected until the totals block, and column bands are computed once
+  for the page by merging the horizontal extents of every phrase in the
+  region. This handles left- and right-aligned columns alike.
+* Plain text (fixtures, decode fallback, cached text) only looks at the
+  lines between a table heading and the totals block, mapping tokens onto
+  the labelled columns.
+
+Both produce full ``InvoiceLine`` objects, including list/net price,
+discount and unit of measure when the layout has those columns.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Sequence, Tuple
+
+from app.parser_profile import BUDGET_CHECK_EVERY, check_budget
+from app.schemas import InvoiceLine
+
+# Bump when layout extraction output changes; part of the cache key.
+TABLE_EXTRACTOR_REVISION = 2
+
+HEADER_LABELS: Dict[str, str] = {
+    "part number": "part_number",
+    "part no": "part_number",
+    "part #": "part_number",
+    "part": "part_number",
+    "item": "part_number",
+    "description": "description",
+    "desc": "description",
+    "quantity": "quantity",
+    "qty": "quantity",
+    "unit of measure": "uom",
+    "uom": "uom",
+    "u/m": "uom",
+    "list price": "list_price",
+    "list": "list_price",
+    "discount %": "discount_percent",
+    "discount": "discount_percent",
+    "disc %": "discount_percent",
+    "disc": "discount_percent",
+    "net price": "net_price",
+    "net": "net_price",
+    "unit price": "unit_cost",
+    "unit cost": "unit_cost",
+    "price": "unit_cost",
+    "cost": "unit_cost",
+    "extended": "extended_cost",
+    "ext price": "extended_cost",
+    "ext": "extended_cost",
+    "amount": "extended_cost",
+}
+LABEL_PATTERN = re.compile(
+    r"(?<!\w)(" + "|".join(re.escape(label) for label in sorted(HEADER_LABELS, key=len, reverse=True)) + r")(?!\w)",
+    re.IGNORECASE,
+)
+# Cheap prefilter: a header row always names the part column.
+HEADER_HINT = re.compile(r"part|item", re.IGNORECASE)
+UNLABELLED_HEADING = re.compile(r"^\s*(?:Line\s+Items|Items)\s*:?\s*$", re.IGNORECASE)
+TOTALS_ROW = re.compile(r"^\s*(?:Sub\s*total|Freight|Tax|Total|Fees|Invoice\s+Total)\b", re.IGNORECASE)
+NUMERIC_FIELDS = {"quantity", "unit_cost", "list_price", "net_price", "discount_percent", "extended_cost"}
+# A row is an item only if it carries at least one of these.
+ITEM_EVIDENCE = {"quantity", "unit_cost", "net_price", "extended_cost"}
+
+
+class Word(NamedTuple):
+    x0: float
+    x1: float
+    top: float
+    text: str
+
+
+def header_fields(text: str) -> List[str]:
+    """Fields named by a header row, in reading order, without repeats."""
+
+    fields: List[str] = []
+    for match in LABEL_PATTERN.finditer(text):
+        field = HEADER_LABELS[match.group(1).lower()]
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def is_header(fields: Sequence[str]) -> bool:
+    return "part_number" in fields and len(fields) >= 3
+
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value.strip().replace(",", "").replace("$", "").rstrip("%"))
+    except ValueError:
+        return None
+
+
+def make_line(cells: Dict[str, str]) -> Optional[InvoiceLine]:
+    """Build a line from raw cell text, or None when the row is not an item."""
+
+    part_number = (cells.get("part_number") or "").strip()
+    if not part_number:
+        return None
+    values: Dict[str, object] = {}
+    for field, raw in cells.items():
+        if field not in NUMERIC_FIELDS or not raw:
+            continue
+        number = _number(raw)
+        if number is None:
+            return None
+        values[field] = int(number) if field == "quantity" else number
+    if values.keys().isdisjoint(ITEM_EVIDENCE):
+        return None
+    if "unit_cost" not in values and "net_price" in values:
+        values["unit_cost"] = values["net_price"]
+    description = (cells.get("description") or "").strip() or f"Auto-extracted line for {part_number}"
+    uom = (cells.get("uom") or "").strip() or None
+    return InvoiceLine(part_number=part_number, description=description, uom=uom, **values)
+
+
+# --- plain text ------------------------------------------------------------
+
+
+def _text_row(tokens: List[str], fields: Sequence[str]) -> Optional[Dict[str, str]]:
+    if "description" not in fields:
+        return dict(zip(fields, tokens)) if len(tokens) == len(fields) else None
+    split = fields.index("description")
+    left, right = fields[:split], fields[split + 1 :]
+    if len(tokens) < len(left) + len(right):
+        return None
+    cells = dict(zip(left, tokens[: len(left)]))
+    if right:
+        cells.update(zip(right, tokens[len(tokens) - len(right) :]))
+    cells["description"] = " ".join(tokens[len(left) : len(tokens) - len(right)])
+    return cells
+
+
+def extract_text_table(text: str, row_pattern: Pattern[str]) -> Optional[List[InvoiceLine]]:
+    """Read line items from the table regions of plain text.
+
+    Returns None when the text has no recognizable table, and an empty list
+    when it has one but no rows could be read; callers fall back to scanning
+    the whole document in both cases. Unlabelled regions (a bare "Line
+    Items" heading) are read row by row with ``row_pattern``.
+    """
+
+    lines: Optional[List[InvoiceLine]] = None
+    fields: Optional[List[str]] = None
+    in_region = False
+    for index, row in enumerate(text.splitlines()):
+        if index % BUDGET_CHECK_EVERY == 0:
+            check_budget("lines")
+        labelled = header_fields(row) if HEADER_HINT.search(row) else []
+        if is_header(labelled):
+            fields, in_region = labelled, True
+            lines = lines if lines is not None else []
+            continue
+        if UNLABELLED_HEADING.match(row):
+            fields, in_region = None, True
+            lines = lines if lines is not None else []
+            continue
+        if not in_region:
+            continue
+        if TOTALS_ROW.match(row):
+            in_region = False
+            continue
+        if fields is None:
+            match = row_pattern.search(row)
+            cells = match and {"part_number": match.group("part"), "quantity": match.group("qty"), "unit_cost": match.group("price"), "extended_cost": match.group("ext")}
+        else:
+            cells = _text_row(row.split(), fields)
+        line = make_line(cells) if cells else None
+        if line is not None:
+            lines.append(line)
+    return lines
+
+
+# --- positioned characters -------------------------------------------------
+
+
+def _iter_chars(container) -> Iterable:
+    from pdfminer.layout import LTChar
+
+    for item in container:
+        if isinstance(item, LTChar):
+            yield item
+        elif hasattr(item, "__iter__"):
+            yield from _iter_chars(item)
+
+
+def page_words(layout) -> List[Word]:
+    """Group a page's characters into cell phrases using their coordinates.
+
+    Characters on the same baseline join a phrase while the horizontal gap
+    stays under half the font size, so single spaces ("Unit Price", "Brake
+    pad set") stay together and column gutters split phrases apart.
+    """
+
+    chars = sorted(_iter_chars(layout), key=lambda c: (-round(c.y1, 1), c.x0))
+    words: List[Word] = []
+    text: List[str] = []
+    x0 = x1 = top = 0.0
+
+    def flush() -> None:
+        phrase = "".join(text).strip()
+        if phrase:
+            words.append(Word(x0, x1, top, phrase))
+
+    for char in chars:
+        value = char.get_text()
+        continues = text and abs(char.y1 - top) < 1.0 and char.x0 - x1 < max(char.size, 1.0) * 0.5
+        if not continues:
+            flush()
+            text = []
+            if value.isspace():
+                continue
+            x0, top = char.x0, char.y1
+        text.append(value)
+        # Spaces do not extend the phrase; the gap is measured from the last
+        # visible character, so one space bridges and a gutter does not.
+        if not value.isspace():
+            x1 = char.x1
+    flush()
+    return words
+
+
+def group_rows(words: Sequence[Word], tolerance: float = 2.0) -> List[List[Word]]:
+    rows: List[List[Word]] = []
+    for word in sorted(words, key=lambda w: (-w.top, w.x0)):
+        if rows and abs(rows[-1][0].top - word.top) <= tolerance:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+    for row in rows:
+        row.sort(key=lambda w: w.x0)
+    return rows
+
+
+def column_bands(rows: Sequence[Sequence[Word]]) -> List[Tuple[float, float]]:
+    """Merge the horizontal extents of every phrase into non-overlapping bands."""
+
+    bands: List[List[float]] = []
+    for word in sorted((word for row in rows for word in row), key=lambda w: w.x0):
+        if bands and word.x0 <= bands[-1][1]:
+            bands[-1][1] = max(bands[-1][1], word.x1)
+        else:
+            bands.append([word.x0, word.x1])
+    return [(start, end) for start, end in bands]
+
+
+def _band_index(bands: Sequence[Tuple[float, float]], word: Word) -> int:
+    for index, (start, end) in enumerate(bands):
+        if start <= word.x0 <= end:
+            return index
+    return len(bands) - 1
+
+
+def _cells(row: Sequence[Word], bands: Sequence[Tuple[float, float]]) -> Dict[int, str]:
+    cells: Dict[int, List[str]] = {}
+    for word in row:
+        cells.setdefault(_band_index(bands, word), []).append(word.text)
+    return {index: " ".join(parts) for index, parts in cells.items()}
+
+
+def page_table_lines(words: Sequence[Word]) -> Optional[List[InvoiceLine]]:
+    """Extract the line-item table from one page, or None if none is found."""
+
+    rows = group_rows(words)
+    header_at = next((i for i, row in enumerate(rows) if is_header(header_fields(" ".join(w.text for w in row)))), None)
+    if header_at is None:
+        return None
+    region = [rows[header_at]]
+    for row in rows[header_at + 1 :]:
+        if TOTALS_ROW.match(" ".join(w.text for w in row)):
+            break
+        region.append(row)
+
+    bands = column_bands(region)
+    band_fields: Dict[int, str] = {}
+    for index, label in _cells(region[0], bands).items():
+        fields = header_fields(label)
+        if len(fields) > 1:
+            # Two headers collapsed into one band: the columns overlap and
+            # cannot be separated by position.
+            return None
+        if fields:
+            band_fields[index] = fields[0]
+
+    lines: List[InvoiceLine] = []
+    for row in region[1:]:
+        cells = {band_fields[index]: text for index, text in _cells(row, bands).items() if index in band_fields}
+        line = make_line(cells)
+        if line is not None:
+            lines.append(line)
+    return lines
@@ -0,0 +1,334 @@
+"""Resumable chunked uploads and ``Idempotency-Key`` replay.
+
+A client creates an upload session (``POST /uploads``) and then PUTs
+numbered chunks (``/uploads/{id}/chunks/{n}``, from 0) carrying an
+``X-Chunk-SHA256`` header. Each verified chunk is appended to the session's
+staging file under ``<storage_path>/uploads``. After a dropped connection
+the client reads ``GET /uploads/{id}`` and continues from ``chunk_count``.
+Re-sending a chunk that was already stored, with the same checksum, is a
+no-op. ``POST /uploads/{id}/finalize`` verifies the whole file and parses it
+like ``/upload``; finalizing a completed session returns its invoice again.
+
+Concurrent PUTs for one session are serialized by an exclusive lock on its
+staging file, so the database write lock is never held during file I/O. A
+chunk is written at the committed length, after truncating to it, and
+fsynced; only then is the row advanced in a short conditional update. A
+crash between the write and the commit therefore never leaves stray bytes.
+Every session is capped at ``upload_max_bytes``, whether or not it declared
+a ``total_bytes``.
+
+Requests with an ``Idempotency-Key`` header store their response. A retry
+with the same key gets the stored response back instead of ingesting
+again. A retry that arrives while the first request is still running gets
+409.
+
+A request that dies without releasing its key, or a finalize that dies
+without reopening its session, would block retries for good. Both are
+leases: once ``upload_lease_seconds`` have passed, a retry with the same key
+takes the key over, and finalize reopens a session stuck in "finalizing".
+Expired sessions and keys are purged on session creation, and at most once
+a minute from the claim and finalize paths.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Any, BinaryIO, Iterator, NamedTuple, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import IdempotencyKeys, UploadSessions
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_BYTES = 1024 * 1024
+
+# Stands in for the staging file lock where ``fcntl`` is unavailable.
+_staging_lock = Lock()
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StoredResponse(NamedTuple):
+    status_code: int
+    body: Any
+
+
+# Seconds between purges run from claim and finalize.
+PURGE_INTERVAL_SECONDS = 60.0
+_last_purge = 0.0
+
+
+def staging_path(session_id: str) -> Path:
+    return get_settings().storage_path / "uploads" / f"{session_id}.part"
+
+
+def lease_expired(claimed_at: datetime, now: Optional[datetime] = None) -> bool:
+    return claimed_at < (now or datetime.utcnow()) - timedelta(seconds=get_settings().upload_lease_seconds)
+
+
+def purge_expired(db: Session, now: Optional[datetime] = None) -> int:
+    """Drop sessions untouched past their TTL, with their staged bytes, and old idempotency keys."""
+
+    settings = get_settings()
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=settings.upload_session_ttl_hours)
+    expired = db.scalars(select(UploadSessions.id).where(UploadSessions.updated_at < cutoff)).all()
+    for session_id in expired:
+        staging_path(session_id).unlink(missing_ok=True)
+    if expired:
+        db.execute(delete(UploadSessions).where(UploadSessions.id.in_(expired)))
+        logger.info("Expired %s upload sessions", len(expired))
+    db.execute(delete(IdempotencyKeys).where(IdempotencyKeys.created_at < now - timedelta(hours=settings.idempotency_ttl_hours)))
+    db.commit()
+    return len(expired)
+
+
+def purge_if_due(db: Session) -> None:
+    global _last_purge
+    if time.monotonic() - _last_purge >= PURGE_INTERVAL_SECONDS:
+        _last_purge = time.monotonic()
+        purge_expired(db)
+
+
+def create_session(db: Session, filename: str, total_bytes: Optional[int] = None) -> UploadSessions:
+    limit = get_settings().upload_max_bytes
+    if total_bytes is not None and total_bytes > limit:
+        raise UploadRejected(413, f"Upload of {total_bytes} bytes exceeds the {limit} byte limit")
+    purge_expired(db)
+    session = UploadSessions(id=secrets.token_hex(16), filename=filename, total_bytes=total_bytes)
+    db.add(session)
+    db.commit()
+    path = staging_path(session.id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return session
+
+
+def get_session(db: Session, session_id: str) -> UploadSessions:
+    session = db.get(UploadSessions, session_id)
+    if session is None:
+        raise UploadRejected(404, f"Upload session {session_id} not found")
+    return session
+
+
+def _check_resend(session: UploadSessions, index: int, checksum: str) -> UploadSessions:
+    """Answer a PUT for a chunk that is not the next one expected."""
+
+    hashes = session.chunk_hashes.split(",") if session.chunk_hashes else []
+    if index < len(hashes):
+        if hashes[index] == checksum:
+            return session
+        raise UploadRejected(409, f"Chunk {index} was already stored with a different checksum")
+    raise UploadRejected(409, f"Expected chunk {session.chunk_count}, got {index}")
+
+
+def _sha256_prefix(f: BinaryIO, size: int) -> str:
+    """Hash the first ``size`` bytes of ``f`` without holding them in memory."""
+
+    digest = hashlib.sha256()
+    while size > 0:
+        block = f.read(min(size, HASH_BLOCK_BYTES))
+        if not block:
+            break
+        digest.update(block)
+        size -= len(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _locked_staging_file(session_id: str) -> Iterator[BinaryIO]:
+    """Open the staging file, holding an exclusive lock on it across processes."""
+
+    with open(staging_path(session_id), "r+b") as f:
+        if fcntl is None:  # pragma: no cover - Windows
+            with _staging_lock:
+                yield f
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def append_chunk(db: Session, session_id: str, index: int, data: bytes, checksum: str) -> UploadSessions:
+    """Verify ``data`` against ``checksum`` and append it as chunk ``index``.
+
+    Writers of one session are serialized by a lock on its staging file, not
+    by the database: the bytes are written and fsynced first, and the row is
+    only updated, in a short transaction, once they are durable.
+    """
+
+    checksum = checksum.strip().lower()
+    if hashlib.sha256(data).hexdigest() != checksum:
+        raise UploadRejected(400, f"Chunk {index} does not match its X-Chunk-SHA256")
+    session = get_session(db, session_id)
+    if session.status != "open":
+        raise UploadRejected(409, f"Upload session {session_id} is {session.status}")
+    if index != session.chunk_count:
+        return _check_resend(session, index, checksum)
+
+    with _locked_staging_file(session_id) as f:
+        # Another request may have stored this chunk while we waited.
+        db.refresh(session)
+        if session.status != "open":
+            raise UploadRejected(409, f"Upload session {session_id} is {session.status}")
+        if index != session.chunk_count:
+            return _check_resend(session, index, checksum)
+        offset = session.received_bytes
+        if session.total_bytes is not None and offset + len(data) > session.total_bytes:
+            raise UploadRejected(413, f"Chunk {index} would exceed the declared {session.total_bytes} bytes")
+        limit = get_settings().upload_max_bytes
+        if offset + len(data) > limit:
+            raise UploadRejected(413, f"Chunk {index} would exceed the {limit} byte upload limit")
+
+        # Drop bytes from an append whose commit never happened.
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+        claimed = db.execute(
+            update(UploadSessions)
+            .where(UploadSessions.id == session_id, UploadSessions.chunk_count == index)
+            .values(
+                chunk_count=index + 1,
+                received_bytes=offset + len(data),
+                chunk_hashes=f"{session.chunk_hashes},{checksum}" if session.chunk_hashes else checksum,
+                updated_at=datetime.utcnow(),
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+    db.refresh(session)
+    if not claimed:  # pragma: no cover - the file lock serializes writers
+        return _check_resend(session, index, checksum)
+    return session
+
+
+def _set_status(db: Session, session_id: str, current: str, status: str) -> bool:
+    changed = db.execute(
+        update(UploadSessions)
+        .where(UploadSessions.id == session_id, UploadSessions.status == current)
+        .values(status=status, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return bool(changed)
+
+
+def begin_finalize(db: Session, session_id: str, checksum: Optional[str] = None) -> bytes:
+    """Mark the session as finalizing and return the complete, verified upload."""
+
+    purge_if_due(db)
+    session = get_session(db, session_id)
+    if session.status == "finalizing" and lease_expired(session.updated_at):
+        # The finalize that claimed it died without reopening it.
+        if _set_status(db, session_id, "finalizing", "open"):
+            logger.warning("Reopened upload session %s, finalizing since %s", session_id, session.updated_at)
+        db.refresh(session)
+    if session.status != "open":
+        raise UploadRejected(409, f"Upload session {session_id} is {session.status}")
+    if session.total_bytes is not None and session.received_bytes != session.total_bytes:
+        raise UploadRejected(409, f"Upload incomplete: {session.received_bytes} of {session.total_bytes} bytes received")
+    with open(staging_path(session_id), "rb") as f:
+        if checksum and _sha256_prefix(f, session.received_bytes) != checksum.strip().lower():
+            raise UploadRejected(400, "Upload does not match its X-Content-SHA256")
+        f.seek(0)
+        data = f.read(session.received_bytes)
+    if not _set_status(db, session_id, "open", "finalizing"):
+        raise UploadRejected(409, f"Upload session {session_id} is already being finalized")
+    return data
+
+
+def reopen_session(db: Session, session_id: str) -> None:
+    """Return a session whose parse failed to ``open`` so finalize can be retried."""
+
+    db.rollback()
+    _set_status(db, session_id, "finalizing", "open")
+
+
+def complete_session(db: Session, session_id: str, invoice_id: int) -> None:
+    session = get_session(db, session_id)
+    session.status = "completed"
+    session.invoice_id = invoice_id
+    db.commit()
+    staging_path(session_id).unlink(missing_ok=True)
+
+
+def claim_idempotency_key(db: Session, key: str, request: str) -> Optional[StoredResponse]:
+    """Reserve ``key`` for ``request``, or return the response already stored for it."""
+
+    purge_if_due(db)
+    db.add(IdempotencyKeys(key=key, request=request))
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+    record = db.get(IdempotencyKeys, key)
+    if record is None:  # pragma: no cover - released between the insert and the read
+        return claim_idempotency_key(db, key, request)
+    if record.request != request:
+        raise UploadRejected(422, "Idempotency-Key was already used for a different request")
+    if record.status != "completed":
+        if lease_expired(record.created_at) and _take_over_key(db, record):
+            return None
+        raise UploadRejected(409, "A request with this Idempotency-Key is still in progress")
+    return StoredResponse(record.status_code, json.loads(record.response_body))
+
+
+def _take_over_key(db: Session, record: IdempotencyKeys) -> bool:
+    """Claim a key whose request stopped without storing or releasing it."""
+
+    claimed_at = record.created_at
+    taken = db.execute(
+        update(IdempotencyKeys)
+        .where(IdempotencyKeys.key == record.key, IdempotencyKeys.status != "completed", IdempotencyKeys.created_at == claimed_at)
+        .values(created_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if taken:
+        logger.warning("Took over Idempotency-Key %s, in progress since %s", record.key, claimed_at)
+    return bool(taken)
+
+
+def store_idempotent_response(db: Session, key: str, body: Any, status_code: int = 200) -> None:
+    record = db.get(IdempotencyKeys, key)
+    record.status = "completed"
+    record.status_code = status_code
+    record.response_body = json.dumps(body)
+    db.commit()
+
+
+def release_idempotency_key(db: Session, key: str) -> None:
+    """Forget a failed request so the client can retry it with the same key."""
+
+    db.rollback()
+    db.execute(delete(IdempotencyKeys).where(IdempotencyKeys.key == key, IdempotencyKeys.status != "completed"))
+    db.commit()
@@ -0,0 +1,134 @@
+"""Vendor invoice templates and fingerprint-based dispatch.
+
+Each template declares the literal markers that identify its layout plus the
+precompiled rules used to read header fields, line items, charges, GL
+allocations and summary pages. ``registry.select`` scans the first page of an
+invoice once with a single alternation of every registered marker and
+returns the most specific match, so an invoice only ever runs its own
+template's rules.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from threading import Lock
+from typing import Dict, Iterator, List, Mapping, Optional, Pattern, Tuple
+
+# Only the start of the document is fingerprinted; vendor names and invoice
+# banners live in the page header.
+FINGERPRINT_CHARS = 4000
+
+
+def _compile(pattern: str, flags: int = re.IGNORECASE) -> Pattern[str]:
+    return re.compile(pattern, flags)
+
+
+@dataclass(frozen=True)
+class VendorTemplate:
+    name: str
+    markers: Tuple[str, ...] = ()
+    header_fields: Mapping[str, Pattern[str]] = field(default_factory=dict)
+    fields: Mapping[str, Pattern[str]] = field(default_factory=dict)
+    charge_fields: Mapping[str, Pattern[str]] = field(default_factory=dict)
+    line_pattern: Pattern[str] = _compile(r"(?P<part>\w{3,})\s+(?P<qty>\d+)\s+(?P<price>[\d,.]+)\s+(?P<ext>[\d,.]+)", 0)
+    allocation_pattern: Pattern[str] = _compile(r"^GL\s*(?P<acct>\d{3,})\s+(?P<amount>[\d,.]+)\s*(?P<memo>.*)$", 0)
+    summary_pattern: Pattern[str] = _compile(r"Summary|GL|Allocation")
+    date_formats: Tuple[str, ...] = ("%m/%d/%Y", "%Y-%m-%d", "%m-%d-%Y")
+    confidence_bonus: float = 0.0
+
+
+GENERIC = VendorTemplate(
+    name="generic",
+    header_fields={
+        "invoice_number": _compile(r"Invoice\s*#:?\s*([\w-]+)"),
+        "invoice_date": _compile(r"Date\s*:?\s*([\d/.-]{6,10})"),
+    },
+    fields={
+        "order_number": _compile(r"(?:PO|Order)\s*#:?\s*([\w-]+)"),
+        # Names stop at the end of their line; letting the class include
+        # newlines made these capture arbitrarily long spans of the document.
+        "vendor_name": _compile(r"Vendor[ \t]*:?[ \t]*([\w ,&.]+)"),
+        "customer_name": _compile(r"Customer[ \t]*:?[ \t]*([\w ,&.]+)"),
+        "subtotal": _compile(r"Subtotal\s*:?\s*([\d,.]+)"),
+        "tax": _compile(r"Tax\s*:?\s*([\d,.]+)"),
+        "freight": _compile(r"Freight\s*:?\s*([\d,.]+)"),
+        "total": _compile(r"Total\s*:?\s*([\d,.]+)"),
+    },
+    charge_fields={
+        "freight": _compile(r"Freight\s*:?\s*([\d,.]+)"),
+        "tax": _compile(r"Tax\s*:?\s*([\d,.]+)"),
+        "fees": _compile(r"Fees\s*:?\s*([\d,.]+)"),
+    },
+)
+
+# Only the generic rules ship. FCA statements are read with them; this
+# template only adds the FCA confidence bonus and keeps FCA parse timings
+# apart from other vendors. Give it its own rules (or split it per entity)
+# once a sample layout that differs is available.
+FCA = replace(GENERIC, name="fca", markers=("FCA US LLC", "FCA Invoice", "FCA Canada", "FCA"), confidence_bonus=0.2)
+
+
+class TemplateRegistry:
+    def __init__(self, fallback: VendorTemplate) -> None:
+        self.fallback = fallback
+        self._templates: Dict[str, VendorTemplate] = {}
+        self._owners: Dict[str, VendorTemplate] = {}
+        self._matcher: Optional[Pattern[str]] = None
+        self._timings: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self._lock = Lock()
+
+    def register(self, template: VendorTemplate) -> VendorTemplate:
+        self._templates[template.name] = template
+        for marker in template.markers:
+            self._owners[marker.lower()] = template
+        markers = sorted(self._owners, key=len, reverse=True)
+        # Longest markers first so "FCA US LLC" wins over its "FCA" prefix.
+        self._matcher = re.compile("|".join(re.escape(marker) for marker in markers), re.IGNORECASE) if markers else None
+        return template
+
+    def get(self, name: str) -> VendorTemplate:
+        return self._templates[name] if name in self._templates else self.fallback
+
+    def select(self, text: str) -> VendorTemplate:
+        """Pick the template whose longest marker appears on the first page."""
+
+        if self._matcher is None:
+            return self.fallback
+        first_page = text[:FINGERPRINT_CHARS].split("\f", 1)[0]
+        best: Optional[str] = None
+        for match in self._matcher.finditer(first_page):
+            hit = match.group(0).lower()
+            if best is None or len(hit) > len(best):
+                best = hit
+        return self._owners[best] if best is not None else self.fallback
+
+    @contextmanager
+    def timed(self, template: VendorTemplate) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                entry = self._timings[template.name]
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def timings(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                name: {"invoices": count, "total_seconds": total, "mean_seconds": total / count if count else 0.0}
+                for name, (count, total) in self._timings.items()
+            }
+
+    def reset_timings(self) -> None:
+        with self._lock:
+            self._timings.clear()
+
+
+registry = TemplateRegistry(fallback=GENERIC)
+registry.register(FCA)
@@ -0,0 +1,101 @@
+"""Read latency during an upload storm, with and without admission control.
+
+Runs the app in-process over ASGI (no network) against a temporary
+database. Readers fetch an invoice in a loop while uploaders post packet
+PDFs as fast as they are answered. The read p50/p99 is printed for a
+reads-only baseline and for the storm with admission control off and on.
+
+Run with ``python -m benchmarks.bench_admission``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
+
+import httpx
+
+from app.config import Settings
+from app.main import create_app
+from benchmarks.loadtest import percentile
+from benchmarks.synthetic import packet_pdf
+
+
+async def run(args, workdir: Path, max_jobs: int, storm: bool) -> Tuple[List[float], Counter]:
+    settings = Settings(
+        database_url=f"sqlite:///{workdir}/bench.db",
+        storage_path=workdir / "storage",
+        invoice_cache_size=0,
+        extraction_cache_max_bytes=0,
+        admission_max_jobs=max_jobs,
+        admission_queue_size=args.queue,
+        admission_queue_timeout=1.0,
+    )
+    app = create_app(settings)
+    packet = packet_pdf(args.invoices, args.lines)
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            seeded = await client.post("/upload", files={"files": ("seed.pdf", packet_pdf(1, 20, start=90_000), "application/pdf")})
+            invoice_id = seeded.json()[0]["invoice"]["id"]
+            deadline = time.perf_counter() + args.seconds
+
+            async def reader() -> None:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = await client.get(f"/invoices/{invoice_id}")
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+
+            async def uploader(worker: int) -> None:
+                sequence = 0
+                while time.perf_counter() < deadline:
+                    sequence += 1
+                    name = f"storm-{worker}-{sequence}.pdf"
+                    response = await client.post("/upload", files={"files": (name, packet, "application/pdf")})
+                    outcomes[response.status_code] += 1
+                    if response.status_code in (429, 503):
+                        await asyncio.sleep(0.05)
+
+            tasks = [reader() for _ in range(args.readers)]
+            if storm:
+                tasks += [uploader(worker) for worker in range(args.uploaders)]
+            await asyncio.gather(*tasks)
+    return latencies, outcomes
+
+
+def report(label: str, latencies: List[float], outcomes: Counter) -> None:
+    uploads = ", ".join(f"{status}: {count}" for status, count in sorted(outcomes.items())) or "-"
+    print(
+        f"{label:>14}: reads {len(latencies):5d}  p50 {statistics.median(latencies) * 1000:7.2f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:8.2f} ms  uploads {uploads}"
+    )
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description=__doc__)
+    cli.add_argument("--seconds", type=float, default=5.0)
+    cli.add_argument("--readers", type=int, default=4)
+    cli.add_argument("--uploaders", type=int, default=16)
+    cli.add_argument("--invoices", type=int, default=5, help="invoices per uploaded packet")
+    cli.add_argument("--lines", type=int, default=40)
+    cli.add_argument("--jobs", type=int, default=2, help="admission_max_jobs for the controlled run")
+    cli.add_argument("--queue", type=int, default=2)
+    args = cli.parse_args()
+
+    for label, max_jobs, storm in (("baseline", args.jobs, False), ("no admission", 0, True), ("admission", args.jobs, True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            report(label, *asyncio.run(run(args, Path(tmp), max_jobs, storm)))
+
+
+if __name__ == "__main__":
+    main()
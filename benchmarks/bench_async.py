@@ -0,0 +1,84 @@
+"""Requests per second for the sync and async read paths.
+
+Runs the app in-process over ASGI against a temporary SQLite database,
+seeds a few invoices, and has ``--clients`` concurrent clients fetch
+invoice details for ``--seconds``. The invoice cache is off so every
+request reaches the database.
+
+Run with ``python -m benchmarks.bench_async``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+
+from app.config import Settings
+from app.main import create_app
+from benchmarks.loadtest import percentile
+from benchmarks.synthetic import packet_pdf
+
+
+async def run(args, workdir: Path, async_mode: bool) -> None:
+    settings = Settings(
+        database_url=f"sqlite:///{workdir}/bench.db",
+        storage_path=workdir / "storage",
+        invoice_cache_size=0,
+        extraction_cache_max_bytes=0,
+        worker_threads=args.threads,
+        async_mode=async_mode,
+    )
+    app = create_app(settings)
+    latencies: List[float] = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            seeded = await client.post("/upload", files={"files": ("seed.pdf", packet_pdf(args.invoices, args.lines), "application/pdf")})
+            seeded.raise_for_status()
+            ids = [invoice["id"] for invoice in (await client.get("/invoices")).json()]
+            deadline = time.perf_counter() + args.seconds
+
+            async def reader(offset: int) -> None:
+                index = offset
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = await client.get(f"/invoices/{ids[index % len(ids)]}")
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                    index += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(reader(offset) for offset in range(args.clients)))
+            elapsed = time.perf_counter() - started
+
+    label = "async" if async_mode else "sync"
+    print(
+        f"{label:>6}: {len(latencies) / elapsed:8.1f} req/s  p50 {statistics.median(latencies) * 1000:7.2f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:8.2f} ms  ({args.clients} clients, {args.threads} threads)"
+    )
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description=__doc__)
+    cli.add_argument("--seconds", type=float, default=5.0)
+    cli.add_argument("--clients", type=int, default=64)
+    cli.add_argument("--threads", type=int, default=8, help="worker threads for sync routes")
+    cli.add_argument("--invoices", type=int, default=20)
+    cli.add_argument("--lines", type=int, default=20)
+    args = cli.parse_args()
+
+    for async_mode in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(run(args, Path(tmp), async_mode))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Prefix search latency: in-memory part index versus a SQL ``LIKE`` query.
+
+Builds a catalog of ``--parts`` synthetic Mopar-style part numbers in a
+temporary SQLite database, loads the index and times type-ahead prefixes
+of increasing length against both paths.
+
+Run with ``python -m benchmarks.bench_parts``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import tempfile
+import time
+from typing import Callable, List
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Parts
+from app.part_index import PartIndex
+from benchmarks.loadtest import percentile
+
+
+def part_numbers(count: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    numbers = set()
+    while len(numbers) < count:
+        numbers.add(f"{rng.randrange(10**7, 10**8)}{rng.choice(['AA', 'AB', 'AC', 'AD', ''])}")
+    return sorted(numbers)
+
+
+def timed(fn: Callable[[str], object], prefixes: List[str]) -> List[float]:
+    samples = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        fn(prefix)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description=__doc__)
+    cli.add_argument("--parts", type=int, default=300_000)
+    cli.add_argument("--queries", type=int, default=2000)
+    cli.add_argument("--limit", type=int, default=20)
+    args = cli.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/parts.db")
+        Base.metadata.create_all(bind=engine)
+        numbers = part_numbers(args.parts)
+        with engine.begin() as conn:
+            conn.execute(insert(Parts), [{"part_number": number, "description": "Synthetic part"} for number in numbers])
+
+        with sessionmaker(bind=engine)() as db:
+            index = PartIndex()
+            start = time.perf_counter()
+            index.load(db)
+            print(f"loaded {len(index)} parts in {time.perf_counter() - start:.2f} s")
+
+            rng = random.Random(1)
+            for length in (2, 4, 6, 8):
+                prefixes = [rng.choice(numbers)[:length] for _ in range(args.queries)]
+                memory = timed(lambda prefix: index.search(prefix, args.limit), prefixes)
+                like = timed(
+                    lambda prefix: db.execute(
+                        select(Parts).where(Parts.part_number.like(f"{prefix}%")).order_by(Parts.part_number).limit(args.limit)
+                    ).all(),
+                    prefixes[: max(args.queries // 10, 1)],
+                )
+                print(
+                    f"prefix {length}: index p50 {percentile(memory, 0.5) * 1e6:7.1f} us  p99 {percentile(memory, 0.99) * 1e6:7.1f} us"
+                    f"   LIKE p50 {percentile(like, 0.5) * 1e6:9.1f} us  p99 {percentile(like, 0.99) * 1e6:9.1f} us"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare the pydantic read path with the Core-to-JSON fast path.
+
+Run with ``python -m benchmarks.bench_serialization``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from typing import Callable, List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import parser
+from app.database import Base
+from app.models import Invoices
+from app.schemas import Invoice as InvoiceSchema
+from app.serializers import invoice_json
+from app.services import persist_invoice
+from benchmarks.synthetic import invoice_text
+
+
+def pydantic_path(db: Session, invoice_id: int) -> bytes:
+    invoice = db.get(Invoices, invoice_id)
+    return TypeAdapter(InvoiceSchema).dump_json(InvoiceSchema.model_validate(invoice))
+
+
+def fast_path(db: Session, invoice_id: int) -> bytes:
+    return invoice_json(db, invoice_id)
+
+
+def timed(label: str, factory: Callable[[], Session], fn: Callable[[Session, int], bytes], invoice_id: int, rounds: int) -> float:
+    samples: List[float] = []
+    for _ in range(rounds):
+        with factory() as db:
+            start = time.perf_counter()
+            fn(db, invoice_id)
+            samples.append(time.perf_counter() - start)
+    best = min(samples)
+    print(f"{label:>10}: best {best * 1000:8.2f} ms  mean {sum(samples) / rounds * 1000:8.2f} ms")
+    return best
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description=__doc__)
+    cli.add_argument("--lines", type=int, default=2000)
+    cli.add_argument("--rounds", type=int, default=10)
+    args = cli.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            invoice = persist_invoice(db, parser.parse_invoice_text(invoice_text(1, args.lines)), "bench.pdf", "bench.pdf", "bench.pdf")
+            db.commit()
+            invoice_id = invoice.id
+
+        print(f"invoice with {args.lines} lines, {args.rounds} rounds")
+        slow = timed("pydantic", factory, pydantic_path, invoice_id, args.rounds)
+        fast = timed("fast", factory, fast_path, invoice_id, args.rounds)
+        print(f"speedup: {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Line-item extraction: speed of the table-region path and layout accuracy.
+
+Run with ``python -m benchmarks.bench_tables``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from app.extraction import extract_pdf
+from app.parser import extract_line_items, to_float
+from app.schemas import InvoiceLine
+from app.vendor_templates import GENERIC
+from benchmarks.synthetic import packet_text, table_packet_pdf
+
+
+def whole_text_lines(text: str) -> list:
+    """The previous extractor: one pattern over the entire document."""
+
+    return [
+        InvoiceLine(
+            part_number=m.group("part"),
+            quantity=int(m.group("qty")),
+            unit_cost=to_float(m.group("price")),
+            extended_cost=to_float(m.group("ext")),
+            description=f"Auto-extracted line for {m.group('part')}",
+        )
+        for m in GENERIC.line_pattern.finditer(text)
+    ]
+
+
+def best_of(rounds: int, fn) -> float:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return min(samples)
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description=__doc__)
+    cli.add_argument("--invoices", type=int, default=200)
+    cli.add_argument("--lines", type=int, default=50)
+    cli.add_argument("--pages", type=int, default=20)
+    cli.add_argument("--rounds", type=int, default=5)
+    args = cli.parse_args()
+
+    text = packet_text(args.invoices, args.lines)
+    legacy = best_of(args.rounds, lambda: whole_text_lines(text))
+    region = best_of(args.rounds, lambda: extract_line_items(text, GENERIC))
+    print(f"text, {len(text) / 1e6:.1f} MB: whole-text regex {legacy * 1000:.1f} ms, table regions {region * 1000:.1f} ms")
+
+    data, expected = table_packet_pdf(args.pages, line_count=30)
+    start = time.perf_counter()
+    _, tables = extract_pdf(data, tables=True)
+    elapsed = time.perf_counter() - start
+    fields = list(expected[0][0])
+    total = sum(len(lines) * len(fields) for lines in expected)
+    correct = 0
+    for page, lines in enumerate(expected):
+        extracted = tables.get(page, [])
+        for got, want in zip(extracted, lines):
+            correct += sum(getattr(got, field) == value for field, value in want.items())
+    print(f"layout (text and tables in one pass), {args.pages} pages: {elapsed / args.pages * 1000:.1f} ms/page, field accuracy {correct / total:.1%}")
+
+
+if __name__ == "__main__":
+    main()
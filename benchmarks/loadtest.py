@@ -0,0 +1,253 @@
+"""Load generator with scripted traffic mixes and per-endpoint percentiles.
+
+Targets the app in-process over ASGI (default; a temporary database and
+storage directory are created) or a running server by base URL. Workers
+pick operations at random by weight from a traffic mix, and each endpoint
+gets throughput and p50/p95/p99 latency. Results can be written as JSON and
+compared against an earlier run.
+
+    python -m benchmarks.loadtest --mix read-heavy --duration 30
+    python -m benchmarks.loadtest --target http://localhost:8000 --mix upload=1,detail=10
+    python -m benchmarks.loadtest --output run.json --compare baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from benchmarks.synthetic import packet_pdf
+
+OPERATIONS = ("upload", "list", "detail", "file", "not_received")
+MIXES: Dict[str, Dict[str, int]] = {
+    "read-heavy": {"upload": 1, "list": 5, "detail": 40, "file": 10, "not_received": 4},
+    "month-end": {"upload": 10, "list": 5, "detail": 20, "file": 5, "not_received": 5},
+    "uploads": {"upload": 1},
+    "reads": {"list": 1, "detail": 8, "file": 2, "not_received": 1},
+}
+# Upload invoice numbers start here so they never collide with seeded ones.
+UPLOAD_NUMBER_BASE = 500_000
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    if spec in MIXES:
+        return dict(MIXES[spec])
+    mix: Dict[str, int] = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip().replace("-", "_")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; expected one of {', '.join(OPERATIONS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+@dataclass
+class Recorder:
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    statuses: Dict[str, Counter] = field(default_factory=lambda: defaultdict(Counter))
+
+    def add(self, operation: str, seconds: float, status: int) -> None:
+        self.latencies[operation].append(seconds)
+        self.statuses[operation][status] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        endpoints: Dict[str, dict] = {}
+        for operation in sorted(self.latencies):
+            samples = self.latencies[operation]
+            statuses = self.statuses[operation]
+            endpoints[operation] = {
+                "requests": len(samples),
+                "errors": sum(count for status, count in statuses.items() if status >= 400 or status == 0),
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(samples, 0.50) * 1000,
+                "p95_ms": percentile(samples, 0.95) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+                "max_ms": max(samples) * 1000,
+            }
+        everything = [sample for samples in self.latencies.values() for sample in samples]
+        endpoints["all"] = {
+            "requests": len(everything),
+            "errors": sum(entry["errors"] for entry in endpoints.values()),
+            "throughput_rps": len(everything) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(everything, 0.50) * 1000,
+            "p95_ms": percentile(everything, 0.95) * 1000,
+            "p99_ms": percentile(everything, 0.99) * 1000,
+        }
+        return endpoints
+
+
+class Traffic:
+    """Issues one operation of the mix against the client."""
+
+    def __init__(self, client: httpx.AsyncClient, args) -> None:
+        self.client = client
+        self.args = args
+        self.invoice_ids: List[int] = []
+        self.file_ids: List[int] = []
+        self.uploads = 0
+
+    async def upload(self, name: str, start: int) -> httpx.Response:
+        data = packet_pdf(self.args.invoices_per_upload, self.args.lines, start=start)
+        response = await self.client.post("/upload", files={"files": (name, data, "application/pdf")})
+        if response.status_code == 200:
+            for item in response.json():
+                self.invoice_ids.append(item["invoice"]["id"])
+                self.file_ids.append(item["file"]["id"])
+        return response
+
+    async def seed(self) -> None:
+        for batch in range(self.args.seed_uploads):
+            response = await self.upload(f"seed-{batch}.pdf", start=batch * self.args.invoices_per_upload)
+            response.raise_for_status()
+        self.invoice_ids = [invoice["id"] for invoice in (await self.client.get("/invoices")).json()] or self.invoice_ids
+
+    async def run(self, operation: str, rng: random.Random) -> httpx.Response:
+        if operation == "upload":
+            self.uploads += 1
+            start = UPLOAD_NUMBER_BASE + self.uploads * self.args.invoices_per_upload
+            return await self.upload(f"load-{self.uploads}.pdf", start)
+        if operation == "list":
+            return await self.client.get("/invoices")
+        if operation == "detail":
+            return await self.client.get(f"/invoices/{rng.choice(self.invoice_ids)}")
+        if operation == "file":
+            return await self.client.get(f"/files/{rng.choice(self.file_ids)}")
+        return await self.client.get("/reports/not-received")
+
+
+@contextlib.asynccontextmanager
+async def open_client(args) -> AsyncIterator[httpx.AsyncClient]:
+    if args.target != "inprocess":
+        async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout) as client:
+            yield client
+        return
+
+    from app.config import Settings, configure_settings, get_settings
+    from app.main import create_app
+
+    previous = get_settings()
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = Settings(
+            database_url=f"sqlite:///{tmp}/loadtest.db",
+            storage_path=Path(tmp) / "storage",
+            async_mode=args.async_mode,
+        )
+        app = create_app(settings)
+        try:
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+                    yield client
+        finally:
+            configure_settings(previous)
+
+
+async def run_load(args) -> dict:
+    mix = parse_mix(args.mix)
+    recorder = Recorder()
+    async with open_client(args) as client:
+        traffic = Traffic(client, args)
+        await traffic.seed()
+        operations, weights = zip(*mix.items())
+        deadline = time.perf_counter() + args.duration
+
+        async def worker(index: int) -> None:
+            rng = random.Random(args.seed + index)
+            while time.perf_counter() < deadline:
+                operation = rng.choices(operations, weights)[0]
+                start = time.perf_counter()
+                try:
+                    status = (await traffic.run(operation, rng)).status_code
+                except httpx.HTTPError:
+                    status = 0
+                recorder.add(operation, time.perf_counter() - start, status)
+                if args.think_ms:
+                    await asyncio.sleep(args.think_ms / 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(index) for index in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "target": args.target,
+            "async_mode": args.async_mode,
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "duration_s": elapsed,
+        },
+        "endpoints": recorder.summary(elapsed),
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: dict, baseline: Optional[dict] = None) -> None:
+    previous = (baseline or {}).get("endpoints", {})
+    print(f"{'endpoint':>13} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, entry in result["endpoints"].items():
+        line = (
+            f"{name:>13} {entry['requests']:9d} {entry['errors']:7d} {entry['throughput_rps']:9.1f}"
+            f" {entry['p50_ms']:9.2f} {entry['p95_ms']:9.2f} {entry['p99_ms']:9.2f}"
+        )
+        if name in previous and previous[name]["p99_ms"]:
+            change = entry["p99_ms"] / previous[name]["p99_ms"] - 1
+            line += f"  p99 {change:+.0%} vs baseline"
+        print(line)
+
+
+def main() -> None:
+    cli = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    cli.add_argument("--target", default="inprocess", help="'inprocess' or a base URL such as http://localhost:8000")
+    cli.add_argument("--mix", default="read-heavy", help=f"preset ({', '.join(MIXES)}) or op=weight list")
+    cli.add_argument("--duration", type=float, default=10.0, help="seconds of load after seeding")
+    cli.add_argument("--concurrency", type=int, default=16)
+    cli.add_argument("--think-ms", type=float, default=0.0, help="pause between a worker's requests")
+    cli.add_argument("--seed-uploads", type=int, default=2)
+    cli.add_argument("--invoices-per-upload", type=int, default=5)
+    cli.add_argument("--lines", type=int, default=20)
+    cli.add_argument("--seed", type=int, default=1)
+    cli.add_argument("--timeout", type=float, default=60.0)
+    cli.add_argument("--async-mode", action="store_true", help="in-process only: enable PARTSUITE_ASYNC_MODE")
+    cli.add_argument("--output", type=Path, help="write results as JSON")
+    cli.add_argument("--compare", type=Path, help="earlier JSON result to compare p99 against")
+    args = cli.parse_args()
+
+    result = asyncio.run(run_load(args))
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(result, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Synthetic FCA-style invoices for benchmarks and load tests."""
+
+from __future__ import annotations
+
+import random
+from datetime import date, timedelta
+from typing import List, Sequence, Tuple
+
+VENDORS = ["FCA US LLC", "FCA Canada", "Mopar Parts Distribution"]
+
+
+def invoice_text(number: int, line_count: int = 20, seed: int | None = None) -> str:
+    rng = random.Random(number if seed is None else seed)
+    invoice_date = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+    lines: List[str] = [
+        VENDORS[number % len(VENDORS)],
+        f"Invoice # {100000 + number}",
+        f"Date: {invoice_date:%m/%d/%Y}",
+        f"PO #: PO-{rng.randrange(1000, 9999)}",
+        "Vendor: FCA Vendor",
+        "Customer: Sample Plant",
+        "",
+        "Line Items",
+    ]
+    subtotal = 0.0
+    for _ in range(line_count):
+        qty = rng.randrange(1, 20)
+        price = round(rng.uniform(1, 500), 2)
+        extended = round(qty * price, 2)
+        subtotal += extended
+        lines.append(f"P{rng.randrange(10**6, 10**7)} {qty} {price:.2f} {extended:.2f}")
+    freight = round(rng.uniform(5, 50), 2)
+    tax = round(subtotal * 0.06, 2)
+    total = round(subtotal + freight + tax, 2)
+    lines += [
+        "",
+        f"Freight: {freight:.2f}",
+        f"Tax: {tax:.2f}",
+        f"Total: {total:.2f}",
+        "",
+        f"GL 5000 {subtotal + freight:.2f} Materials",
+        "Summary Page",
+    ]
+    return "\n".join(lines)
+
+
+def packet_text(invoice_count: int, line_count: int = 20, start: int = 0) -> str:
+    return "\n".join(invoice_text(start + i, line_count) for i in range(invoice_count))
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages: Sequence[Sequence[Tuple[float, float, str]]]) -> bytes:
+    """Write a minimal PDF with Helvetica text placed at (x, y) on each page."""
+
+    objects: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids: List[int] = []
+    for items in pages:
+        stream = "BT /F1 10 Tf " + " ".join(f"1 0 0 1 {x:.2f} {y:.2f} Tm ({_pdf_escape(text)}) Tj" for x, y, text in items) + " ET"
+        content = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def text_pdf(pages: Sequence[str]) -> bytes:
+    """Render each page's lines top to bottom at the left margin."""
+
+    return build_pdf([[(50, 750 - 14 * row, line) for row, line in enumerate(page.splitlines()) if line] for page in pages])
+
+
+def packet_pdf(invoice_count: int, line_count: int = 20, start: int = 0) -> bytes:
+    return text_pdf([invoice_text(start + i, line_count) for i in range(invoice_count)])
+
+
+# Approximate Helvetica advance widths (per 1000 units) for right alignment.
+_WIDTHS = {**{d: 556 for d in "0123456789"}, ".": 278, ",": 278, " ": 278, "%": 889, "-": 333}
+
+
+def helvetica_width(text: str, size: float = 10) -> float:
+    return sum(_WIDTHS.get(ch, 667 if ch.isupper() else 556) for ch in text) * size / 1000
+
+
+# (header, field, x, right aligned)
+TABLE_COLUMNS = [
+    ("Part Number", "part_number", 40, False),
+    ("Description", "description", 110, False),
+    ("Qty", "quantity", 300, True),
+    ("UOM", "uom", 315, False),
+    ("List Price", "list_price", 400, True),
+    ("Disc %", "discount_percent", 450, True),
+    ("Net Price", "net_price", 510, True),
+    ("Ext Price", "extended_cost", 580, True),
+]
+DESCRIPTIONS = ["Brake pad set", "Oil filter", "Wiper blade 22in", "Spark plug", "Cabin air filter", "Door seal LH"]
+
+
+def table_invoice(number: int, line_count: int = 15) -> Tuple[List[Tuple[float, float, str]], List[dict]]:
+    """One page with a positioned line-item table, plus the expected lines."""
+
+    rng = random.Random(number)
+    items: List[Tuple[float, float, str]] = [
+        (40, 760, "FCA US LLC"),
+        (40, 746, f"Invoice # {200000 + number}"),
+        (40, 732, "Date: 02/01/2024"),
+        (40, 718, "Vendor: FCA Vendor"),
+    ]
+
+    def place(x: float, right: bool, y: float, text: str) -> None:
+        items.append((x - helvetica_width(text) if right else x, y, text))
+
+    y = 690
+    for header, _, x, right in TABLE_COLUMNS:
+        place(x, right, y, header)
+    expected: List[dict] = []
+    for _ in range(line_count):
+        y -= 14
+        qty = rng.randrange(1, 40)
+        list_price = round(rng.uniform(2, 300), 2)
+        discount = rng.choice([0.0, 5.0, 10.0, 12.5])
+        net = round(list_price * (1 - discount / 100), 2)
+        row = {
+            "part_number": f"68{rng.randrange(100000, 999999)}AA",
+            "description": rng.choice(DESCRIPTIONS),
+            "quantity": qty,
+            "uom": rng.choice(["EA", "PK", "BX"]),
+            "list_price": list_price,
+            "discount_percent": discount,
+            "net_price": net,
+            "extended_cost": round(qty * net, 2),
+        }
+        expected.append({**row, "unit_cost": net})
+        cells = {**row, "quantity": str(qty), "list_price": f"{list_price:.2f}", "discount_percent": f"{discount:.1f}", "net_price": f"{net:.2f}", "extended_cost": f"{row['extended_cost']:,.2f}"}
+        for _, field, x, right in TABLE_COLUMNS:
+            place(x, right, y, cells[field])
+    y -= 24
+    items.append((40, y, f"Total: {sum(line['extended_cost'] for line in expected):.2f}"))
+    return items, expected
+
+
+def table_packet_pdf(invoice_count: int, line_count: int = 15) -> Tuple[bytes, List[List[dict]]]:
+    pages, expected = zip(*(table_invoice(number, line_count) for number in range(invoice_count)))
+    return build_pdf(list(pages)), list(expected)
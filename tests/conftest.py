@@ -1,6 +1,17 @@
 import sys
 from pathlib import Path
 
+import pytest
+
 ROOT_DIR = Path(__file__).resolve().parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(tmp_path, monkeypatch):
+    # The module-level app, the extraction cache and the stores read the
+    # process settings; keep everything they write inside tmp_path.
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "storage_path", tmp_path / "storage")
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("starlette")
+
+from app.admission import AdmissionController, AdmissionMiddleware  # noqa: E402
+
+
+def run_requests(controller, count, nbytes=10, hold=0.05):
+    """Send ``count`` concurrent requests through the middleware."""
+
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(hold)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(slow_app, controller)
+
+    async def one():
+        scope = {"type": "http", "method": "POST", "path": "/upload", "headers": [(b"content-length", str(nbytes).encode())]}
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(scope, receive, send)
+        start = messages[0]
+        return start["status"], dict(start["headers"])
+
+    async def main():
+        return await asyncio.gather(*(one() for _ in range(count)))
+
+    return asyncio.run(main())
+
+
+def test_jobs_beyond_slots_queue_then_run():
+    controller = AdmissionController(max_bytes=1000, max_jobs=2, queue_size=4)
+    results = run_requests(controller, 6)
+
+    assert [status for status, _ in results] == [200] * 6
+    stats = controller.stats()
+    assert stats["peak_queue_depth"] == 4
+    assert stats["active_jobs"] == 0 and stats["inflight_bytes"] == 0
+    assert stats["admitted"] == 6
+
+
+def test_full_queue_and_byte_limit_reject_with_retry_after():
+    controller = AdmissionController(max_bytes=1000, max_jobs=1, queue_size=1, retry_after=7)
+    statuses = sorted(status for status, _ in run_requests(controller, 4))
+    assert statuses == [200, 200, 503, 503]
+
+    controller = AdmissionController(max_bytes=25, max_jobs=4, queue_size=4)
+    results = run_requests(controller, 3)
+    rejected = [headers for status, headers in results if status == 429]
+    assert len(rejected) == 1
+    assert rejected[0][b"retry-after"] == b"5"
+    assert controller.stats()["rejected"] == {"bytes": 1}
+
+
+def test_queue_timeout_releases_reservation():
+    controller = AdmissionController(max_bytes=1000, max_jobs=1, queue_size=2, queue_timeout=0.01)
+    statuses = sorted(status for status, _ in run_requests(controller, 2, hold=0.1))
+
+    assert statuses == [200, 503]
+    assert controller.stats()["rejected"] == {"queue_timeout": 1}
+    assert controller.stats()["inflight_bytes"] == 0
@@ -10,9 +10,11 @@ from fastapi.testclient import TestClient  # noqa: E402
 from sqlalchemy import create_engine  # noqa: E402
 from sqlalchemy.orm import sessionmaker  # noqa: E402
 
-from app.config import Settings  # noqa: E402
+from app.cache import invoice_cache  # noqa: E402
+from app.config import Settings, get_settings  # noqa: E402
 from app.database import Base, get_db  # noqa: E402
 from app.main import app  # noqa: E402
+from app.part_index import part_index  # noqa: E402
 
 
 def setup_test_app(tmp_path):
@@ -29,6 +31,8 @@ def setup_test_app(tmp_path):
             db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    invoice_cache.clear()
+    part_index.clear()
     return TestClient(app), settings
 
 
@@ -47,3 +51,347 @@ def test_upload_and_list_invoices(tmp_path, monkeypatch):
     response = client.get("/invoices")
     assert response.status_code == 200
     assert len(response.json()) == 1
+
+
+def test_reupload_skips_exact_duplicates(tmp_path):
+    client, settings = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+
+    first = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")})
+    second = client.post("/upload", files={"files": ("rescan.pdf", BytesIO(sample + b"\n"), "application/pdf")})
+    assert first.json()[0]["invoice"]["id"] == second.json()[0]["invoice"]["id"]
+    assert len(client.get("/invoices").json()) == 1
+
+    changed = sample.replace(b"Total: 40.00", b"Total: 41.00")
+    client.post("/upload", files={"files": ("corrected.pdf", BytesIO(changed), "application/pdf")})
+    groups = client.get("/reports/duplicates").json()
+    assert [group["reason"] for group in groups] == ["same_number"]
+    assert len(groups[0]["invoice_ids"]) == 2
+
+
+def test_conditional_gets_on_invoice_and_file(tmp_path):
+    client, settings = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    payload = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")}).json()[0]
+    invoice_id, file_id = payload["invoice"]["id"], payload["file"]["id"]
+
+    response = client.get(f"/invoices/{invoice_id}")
+    etag = response.headers["etag"]
+    assert response.json()["invoice_number"] == "12345"
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert client.get(f"/invoices/{invoice_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/parse/trigger", json={"file_ids": [file_id]})
+    refreshed = client.get(f"/invoices/{invoice_id}", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["etag"] != etag
+    assert len(refreshed.json()["lines"]) == 2
+
+    response = client.get(f"/files/{file_id}")
+    assert response.content == sample
+    assert response.headers["cache-control"] == "private, max-age=86400"
+    assert client.get(f"/files/{file_id}", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_legacy_file_paths_are_rehashed_and_revalidated(tmp_path):
+    from app.models import Files
+
+    client, _ = setup_test_app(tmp_path)
+    legacy = tmp_path / "originals" / "invoice.pdf"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"first")
+    with next(app.dependency_overrides[get_db]()) as db:
+        file = Files(filename="invoice.pdf", original_path=legacy.as_posix())
+        db.add(file)
+        db.commit()
+        file_id = file.id
+
+    first = client.get(f"/files/{file_id}")
+    assert first.headers["cache-control"] == "private, no-cache"
+    # Files stored under their upload name were overwritten by re-uploads.
+    legacy.write_bytes(b"second")
+    second = client.get(f"/files/{file_id}", headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert second.content == b"second"
+
+
+def test_debug_parser_profile_hidden_unless_enabled(tmp_path, monkeypatch):
+    client, _ = setup_test_app(tmp_path)
+    assert client.get("/debug/parser-profile").status_code == 404
+
+    monkeypatch.setattr(get_settings(), "debug_endpoints", True)
+    response = client.get("/debug/parser-profile")
+    assert response.status_code == 200
+    assert set(response.json()) == {"profile", "templates", "extraction_cache"}
+
+
+def test_upload_rejects_body_over_admission_limit(tmp_path, monkeypatch):
+    client, _ = setup_test_app(tmp_path)
+    monkeypatch.setattr(app.state.admission, "max_bytes", 10)
+    response = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(b"x" * 100), "application/pdf")})
+
+    assert response.status_code == 413
+    status = client.get("/status/admission").json()
+    assert status["rejected"]["too_large"] >= 1
+    assert status["inflight_bytes"] == 0
+
+
+def test_compressed_original_supports_range_requests(tmp_path, monkeypatch):
+    from app import storage
+    from app.models import Files
+
+    client, settings = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    file_id = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")}).json()[0]["file"]["id"]
+
+    with next(app.dependency_overrides[get_db]()) as db:
+        file = db.get(Files, file_id)
+        file.original_path = storage.ShardedStore(get_settings()).compress(Path(file.original_path), file.content_hash).as_posix()
+        db.commit()
+
+    full = client.get(f"/files/{file_id}")
+    assert full.status_code == 200 and full.content == sample
+    partial = client.get(f"/files/{file_id}", headers={"Range": "bytes=4-15"})
+    assert partial.status_code == 206
+    assert partial.content == sample[4:16]
+    assert partial.headers["content-range"] == f"bytes 4-15/{len(sample)}"
+    assert client.get(f"/files/{file_id}", headers={"Range": "bytes=-10"}).content == sample[-10:]
+    assert client.get(f"/files/{file_id}", headers={"Range": f"bytes={len(sample)}-"}).status_code == 416
+
+
+def test_async_mode_serves_same_responses(tmp_path):
+    pytest.importorskip("aiosqlite")
+    from app.config import configure_settings, get_settings
+    from app.main import create_app
+
+    previous = get_settings()
+    settings = Settings(database_url=f"sqlite:///{tmp_path}/async.db", storage_path=tmp_path / "storage", async_mode=True)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    try:
+        with TestClient(create_app(settings)) as client:
+            uploaded = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")})
+            assert uploaded.status_code == 200
+            invoice_id = uploaded.json()[0]["invoice"]["id"]
+            file_id = uploaded.json()[0]["file"]["id"]
+
+            detail = client.get(f"/invoices/{invoice_id}")
+            assert detail.status_code == 200
+            assert detail.json()["invoice_number"] == "12345"
+            assert client.get(f"/invoices/{invoice_id}", headers={"If-None-Match": detail.headers["etag"]}).status_code == 304
+            assert [invoice["id"] for invoice in client.get("/invoices").json()] == [invoice_id]
+            assert client.get(f"/files/{file_id}").content == sample
+            assert client.get("/reports/duplicates").json() == []
+            assert client.post("/parse/trigger", json={"file_ids": [file_id]}).json()[0]["id"] == invoice_id
+            assert client.get("/invoices/999").status_code == 404
+    finally:
+        configure_settings(previous)
+
+
+def test_spend_analytics_endpoint(tmp_path):
+    client, _ = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")})
+
+    by_vendor = client.get("/analytics/spend", params={"by": "vendor"}).json()
+    assert by_vendor[0]["month"] == "2024-01"
+    assert by_vendor[0]["invoice_count"] == 1
+    by_account = client.get("/analytics/spend", params={"by": "account", "by_month": False}).json()
+    assert by_account[0]["account_code"] == "5000"
+    assert client.get("/analytics/spend", params={"month_from": "2024-13"}).status_code == 422
+
+
+def test_part_search_returns_prefix_matches_with_status(tmp_path):
+    client, _ = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")})
+
+    matches = client.get("/parts/search", params={"prefix": "abc"}).json()
+    assert [part["part_number"] for part in matches] == ["ABC123"]
+    assert matches[0]["outstanding"] is True and matches[0]["received"] is False
+    assert client.get("/parts/search", params={"prefix": "Q"}).json() == []
+    assert client.get("/parts/search", params={"prefix": ""}).status_code == 422
+
+
+def test_upload_memory_profile_reports_stages(tmp_path, monkeypatch, caplog):
+    client, settings = setup_test_app(tmp_path)
+    monkeypatch.setattr(get_settings(), "memory_profile", True)
+    monkeypatch.setattr(get_settings(), "memory_budget_mb", 0.001)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+
+    with caplog.at_level("WARNING", logger="app.memory_profile"):
+        response = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")})
+
+    assert response.status_code == 200
+    memory = response.json()[0]["memory"]
+    assert memory["filename"] == "invoice.pdf"
+    assert {"read", "store", "extract", "parse", "persist", "commit"} <= set(memory["stages"])
+    assert memory["stages"]["parse"]["calls"] >= 1
+    assert memory["over_budget"] is True
+    assert "over the 0.001 MB budget" in caplog.text
+
+
+def test_overlapping_memory_profiles_keep_tracing_until_the_last_finishes():
+    import tracemalloc
+
+    from app.memory_profile import MemoryProfile
+
+    was_tracing = tracemalloc.is_tracing()
+    first = MemoryProfile("first.pdf")
+    second = MemoryProfile("second.pdf")
+    first.finish()
+    assert tracemalloc.is_tracing()
+
+    second.enter("parse")
+    data = [bytes(1024) for _ in range(100)]
+    second.exit()
+    assert second.finish()["stages"]["parse"]["retained_mb"] > 0
+    assert tracemalloc.is_tracing() == was_tracing
+    del data
+
+
+def test_resumable_upload_in_chunks(tmp_path, monkeypatch):
+    import hashlib
+
+    client, settings = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    chunks = [sample[i : i + 64] for i in range(0, len(sample), 64)]
+
+    def put(session_id, index, data, checksum=None):
+        headers = {"X-Chunk-SHA256": checksum or hashlib.sha256(data).hexdigest(), "Content-Type": "application/octet-stream"}
+        return client.put(f"/uploads/{session_id}/chunks/{index}", content=data, headers=headers)
+
+    session = client.post("/uploads", json={"filename": "invoice.pdf", "total_bytes": len(sample)})
+    assert session.status_code == 201
+    session_id = session.json()["id"]
+
+    assert put(session_id, 0, chunks[0]).json()["chunk_count"] == 1
+    # Connection dropped before the client saw the reply: resending is harmless.
+    assert put(session_id, 0, chunks[0]).json()["received_bytes"] == len(chunks[0])
+    assert put(session_id, 0, chunks[1]).status_code == 409
+    assert put(session_id, 2, chunks[2]).status_code == 409
+    assert put(session_id, 1, chunks[1], checksum="0" * 64).status_code == 400
+    assert client.post(f"/uploads/{session_id}/finalize").status_code == 409
+
+    resume_from = client.get(f"/uploads/{session_id}").json()["chunk_count"]
+    for index in range(resume_from, len(chunks)):
+        assert put(session_id, index, chunks[index]).status_code == 200
+
+    headers = {"X-Content-SHA256": hashlib.sha256(sample).hexdigest()}
+    finalized = client.post(f"/uploads/{session_id}/finalize", headers=headers)
+    assert finalized.status_code == 200
+    invoice = finalized.json()["invoice"]
+    assert invoice["invoice_number"] == "12345"
+    assert not (settings.storage_path / "uploads" / f"{session_id}.part").exists()
+
+    retried = client.post(f"/uploads/{session_id}/finalize", headers=headers)
+    assert retried.json()["invoice"]["id"] == invoice["id"]
+    assert client.get(f"/uploads/{session_id}").json()["status"] == "completed"
+
+
+def test_upload_session_size_cap(tmp_path, monkeypatch):
+    import hashlib
+
+    client, _ = setup_test_app(tmp_path)
+    monkeypatch.setattr(get_settings(), "upload_max_bytes", 100)
+    chunk = bytes(64)
+    headers = {"X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(), "Content-Type": "application/octet-stream"}
+
+    assert client.post("/uploads", json={"filename": "big.pdf", "total_bytes": 101}).status_code == 413
+    # Without a declared size the cap still applies to the bytes received.
+    session_id = client.post("/uploads", json={"filename": "big.pdf"}).json()["id"]
+    assert client.put(f"/uploads/{session_id}/chunks/0", content=chunk, headers=headers).status_code == 200
+    assert client.put(f"/uploads/{session_id}/chunks/1", content=chunk, headers=headers).status_code == 413
+    assert client.get(f"/uploads/{session_id}").json()["received_bytes"] == 64
+
+
+def test_idempotency_key_replays_upload(tmp_path, monkeypatch):
+    from app import main
+    client, settings = setup_test_app(tmp_path)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    calls = []
+    ingest = main.ingest_upload
+    monkeypatch.setattr(main, "ingest_upload", lambda *args: calls.append(args) or ingest(*args))
+
+    def upload(key):
+        return client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")}, headers={"Idempotency-Key": key})
+
+    first = upload("retry-1")
+    second = upload("retry-1")
+
+    assert first.status_code == second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert len(calls) == 1
+    assert client.post("/uploads/abc/finalize", headers={"Idempotency-Key": "retry-1"}).status_code == 422
+
+
+def test_abandoned_key_and_finalize_are_reclaimed_after_the_lease(tmp_path):
+    import hashlib
+    from datetime import datetime, timedelta
+
+    from app.models import IdempotencyKeys, UploadSessions
+
+    client, settings = setup_test_app(tmp_path)
+    db = next(app.dependency_overrides[get_db]())
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    stale = datetime.utcnow() - timedelta(seconds=get_settings().upload_lease_seconds + 1)
+
+    def upload(key):
+        return client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")}, headers={"Idempotency-Key": key})
+
+    # Keys left "processing" by requests that died.
+    db.add(IdempotencyKeys(key="fresh", request="POST /upload"))
+    db.add(IdempotencyKeys(key="stale", request="POST /upload", created_at=stale))
+    db.commit()
+    assert upload("fresh").status_code == 409
+    taken = upload("stale")
+    assert taken.status_code == 200
+    assert upload("stale").headers["Idempotent-Replayed"] == "true"
+
+    # A session left "finalizing" by a finalize that died.
+    session_id = client.post("/uploads", json={"filename": "invoice.pdf", "total_bytes": len(sample)}).json()["id"]
+    client.put(f"/uploads/{session_id}/chunks/0", content=sample, headers={"X-Chunk-SHA256": hashlib.sha256(sample).hexdigest()})
+    session = db.get(UploadSessions, session_id)
+    session.status = "finalizing"
+    db.commit()
+    assert client.post(f"/uploads/{session_id}/finalize").status_code == 409
+    session.updated_at = stale
+    db.commit()
+    finalized = client.post(f"/uploads/{session_id}/finalize")
+    assert finalized.status_code == 200
+    assert finalized.json()["invoice"]["id"] == taken.json()[0]["invoice"]["id"]
+    db.close()
+
+
+def test_sql_profile_reports_queries_per_request_shape(tmp_path):
+    from app.config import configure_settings
+    from app.main import create_app
+    from app.sql_profile import profile_store
+
+    previous = get_settings()
+    settings = Settings(
+        database_url=f"sqlite:///{tmp_path}/profile.db",
+        storage_path=tmp_path / "storage",
+        sql_profile=True,
+        sql_slow_ms=0.0,
+        sql_explain_slow=True,
+        debug_endpoints=True,
+        invoice_cache_size=0,
+    )
+    profile_store.clear()
+    try:
+        with TestClient(create_app(settings)) as client:
+            sample = Path("fixtures/sample_invoice.txt").read_bytes()
+            invoice_id = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")}).json()[0]["invoice"]["id"]
+            detail = client.get(f"/invoices/{invoice_id}")
+            assert detail.headers["server-timing"].startswith("db;dur=")
+
+            report = client.get("/debug/sql-profile", params={"reset": True}).json()
+            shapes = {shape["shape"]: shape for shape in report["shapes"]}
+            assert shapes["GET /invoices/{invoice_id}"]["max_queries"] >= 2
+            assert shapes["POST /upload"]["slowest"]
+            assert all("?" in item["sql"] or "IN (...)" in item["sql"] for item in shapes["GET /invoices/{invoice_id}"]["slowest"])
+            assert any(entry.get("plan") for entry in report["slow_queries"])
+    finally:
+        profile_store.clear()
+        configure_settings(previous)
@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from benchmarks.loadtest import parse_mix, percentile, run_load  # noqa: E402
+
+
+def test_parse_mix_accepts_presets_and_weights():
+    assert parse_mix("uploads") == {"upload": 1}
+    assert parse_mix("detail=3,not-received=1") == {"detail": 3, "not_received": 1}
+    with pytest.raises(ValueError):
+        parse_mix("delete=1")
+
+
+def test_percentile_picks_nearest_rank():
+    samples = [float(value) for value in range(1, 101)]
+    assert percentile(samples, 0.5) == 51.0
+    assert percentile(samples, 0.99) == 100.0
+    assert percentile([], 0.99) == 0.0
+
+
+def test_in_process_run_reports_every_endpoint_in_mix():
+    args = argparse.Namespace(
+        target="inprocess",
+        mix="upload=1,list=1,detail=2,file=1,not_received=1",
+        duration=0.5,
+        concurrency=2,
+        think_ms=0.0,
+        seed_uploads=1,
+        invoices_per_upload=2,
+        lines=3,
+        seed=1,
+        timeout=30.0,
+        async_mode=False,
+    )
+    result = asyncio.run(run_load(args))
+
+    endpoints = result["endpoints"]
+    assert result["meta"]["mix"]["detail"] == 2
+    assert endpoints["all"]["requests"] > 0
+    assert endpoints["all"]["errors"] == 0
+    for entry in endpoints.values():
+        assert entry["p50_ms"] <= entry["p95_ms"] <= entry["p99_ms"]
@@ -20,3 +20,255 @@ def test_parse_invoice_text_extracts_fields():
     assert invoice.order_number == "PO-7788"
     assert any(line.part_number == "ABC123" for line in invoice.lines)
     assert any(alloc.account_code == "5000" for alloc in invoice.allocations)
+
+
+def test_template_dispatch_uses_most_specific_marker():
+    from app.vendor_templates import registry
+
+    assert registry.select("FCA US LLC\nInvoice # 1").name == "fca"
+    assert registry.select("fca canada inc.\nInvoice # 1").name == "fca"
+    assert registry.select("Acme Supply\nInvoice # 1").name == "generic"
+    # Only the first page is fingerprinted.
+    assert registry.select("Acme Supply\n\fFCA US LLC").name == "generic"
+
+
+def test_parse_records_per_template_timings():
+    from app.vendor_templates import registry
+
+    registry.reset_timings()
+    parser.parse_pdf_bytes(Path("fixtures/sample_invoice.txt").read_bytes())
+    timings = registry.timings()
+    assert list(timings) == ["fca"]
+    assert timings["fca"]["invoices"] == 1
+
+
+def test_mixed_vendor_packet_selects_template_per_invoice():
+    from app.vendor_templates import registry
+
+    packet = b"Acme Supply\nInvoice # A-1\nTotal: 5.00\n\fFCA US LLC\nInvoice # F-2\nTotal: 7.00\n"
+    registry.reset_timings()
+    acme, fca = parser.parse_pdf_bytes(packet)
+    assert (acme.invoice_number, fca.invoice_number) == ("A-1", "F-2")
+    assert fca.parsing_confidence == pytest.approx(acme.parsing_confidence + 0.2)
+    assert {name: entry["invoices"] for name, entry in registry.timings().items()} == {"generic": 1, "fca": 1}
+
+
+def test_page_parallel_extraction_matches_serial(tmp_path, monkeypatch):
+    from app.config import get_settings
+    from app import extraction
+    from app.extraction import extract_pdf_text
+    from benchmarks.synthetic import packet_pdf, table_packet_pdf
+
+    data = packet_pdf(12, line_count=3)
+    path = tmp_path / "packet.pdf"
+    path.write_bytes(data)
+    serial = extract_pdf_text(data)
+    table_data, _ = table_packet_pdf(12, line_count=3)
+    serial_tables = extraction.extract_pdf(table_data, tables=True)
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "extract_workers", 3)
+    monkeypatch.setattr(settings, "extract_chunk_pages", 5)
+    try:
+        assert extract_pdf_text(data, path) == serial
+        pool = extraction._pool
+        assert extract_pdf_text(data) == serial
+        assert extraction._pool is pool is not None
+        assert extraction.extract_pdf(table_data, tables=True) == serial_tables
+        assert [inv.invoice_number for inv in parser.parse_pdf_bytes(data, path)] == [str(100000 + i) for i in range(12)]
+        # A new worker count replaces the pool.
+        monkeypatch.setattr(settings, "extract_workers", 2)
+        assert extract_pdf_text(data) == serial
+        assert extraction._pool is not pool and extraction._pool_workers == 2
+    finally:
+        extraction.shutdown_extract_pool()
+    assert extraction._pool is None
+
+
+def test_extraction_cache_skips_repeat_extraction(tmp_path, monkeypatch):
+    from app.config import get_settings
+    from app.extraction_cache import get_extraction_cache
+
+    from benchmarks.synthetic import packet_pdf
+
+    monkeypatch.setattr(get_settings(), "storage_path", tmp_path)
+    monkeypatch.setattr(get_settings(), "table_layout", False)
+    sample = packet_pdf(2, line_count=2)
+    first = parser.parse_pdf_bytes(sample)
+
+    def fail(*args):
+        raise AssertionError("extraction should come from the cache")
+
+    monkeypatch.setattr(parser, "_extract_uncached", fail)
+    second = parser.parse_pdf_bytes(sample)
+    assert [inv.model_dump() for inv in second] == [inv.model_dump() for inv in first]
+    stats = get_extraction_cache().stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    get_extraction_cache().close()
+
+
+def test_failed_extraction_is_not_cached(tmp_path, monkeypatch):
+    from app.config import get_settings
+    from app.extraction_cache import get_extraction_cache
+
+    monkeypatch.setattr(get_settings(), "storage_path", tmp_path)
+    calls = []
+
+    def broken(data, path=None, tables=False):
+        calls.append(data)
+        raise MemoryError("worker killed")
+
+    monkeypatch.setattr(parser, "extract_pdf", broken)
+    data = b"%PDF-1.4 truncated"
+    assert parser.extract_document(data) == ("%PDF-1.4 truncated", {})
+    assert parser.extract_document(data) == ("%PDF-1.4 truncated", {})
+    assert len(calls) == 2
+    assert get_extraction_cache().stats()["entries"] == 0
+    get_extraction_cache().close()
+
+
+def test_locked_extraction_cache_never_fails_parsing(tmp_path, monkeypatch):
+    import sqlite3
+
+    from app.config import get_settings
+    from app.extraction_cache import get_extraction_cache
+
+    monkeypatch.setattr(get_settings(), "storage_path", tmp_path)
+    cache = get_extraction_cache()
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(cache, "_connection", locked)
+    sample = Path("fixtures/sample_invoice.txt").read_bytes()
+    assert parser.parse_pdf_bytes(sample)[0].invoice_number == "12345"
+    assert cache.stats()["entries"] is None
+    monkeypatch.undo()
+    cache.close()
+
+
+def test_extraction_cache_evicts_least_recently_used(tmp_path):
+    import os
+
+    from app.extraction_cache import ExtractionCache
+
+    cache = ExtractionCache(tmp_path / "cache.sqlite3", max_bytes=1800)
+    # Random text compresses to roughly 750 bytes per entry.
+    blobs = {name: os.urandom(700).hex() for name in "abc"}
+    cache.put("a", blobs["a"])
+    cache.put("b", blobs["b"])
+    assert cache.get("a") == blobs["a"]
+    cache.put("c", blobs["c"])
+    assert cache.get("b") is None
+    assert cache.get("a") == blobs["a"] and cache.get("c") == blobs["c"]
+    assert cache.stats()["evictions"] == 1
+    cache.close()
+
+
+def test_text_table_reads_labelled_columns_inside_region_only():
+    import json
+
+    text = Path("fixtures/table_invoice.txt").read_text()
+    expected = json.loads(Path("fixtures/table_invoice.expected.json").read_text())
+    invoice = parser.parse_invoice_text(text)
+    assert [line.model_dump(include=set(expected[0])) for line in invoice.lines] == expected
+    # The footer matches the old whole-text pattern but sits outside the table.
+    assert "Batch" in [m.group("part") for m in parser.registry.fallback.line_pattern.finditer(text)]
+
+
+def test_table_header_without_rows_falls_back_to_line_scan():
+    # The header names columns the rows do not fill, so no row is read.
+    text = "Part Number  Qty  UOM  Unit Price  Extended\nABC123 4 10.00 40.00\nTotal 40.00\n"
+    lines = parser.extract_line_items(text)
+    assert [(line.part_number, line.quantity, line.extended_cost) for line in lines] == [("ABC123", 4, 40.0)]
+
+
+def test_layout_tables_match_synthetic_ground_truth(tmp_path, monkeypatch):
+    from app.config import get_settings
+    from benchmarks.synthetic import table_packet_pdf
+
+    monkeypatch.setattr(get_settings(), "storage_path", tmp_path)
+    data, expected = table_packet_pdf(3, line_count=12)
+    passes = []
+    extract_pdf = parser.extract_pdf
+    monkeypatch.setattr(parser, "extract_pdf", lambda *args, **kwargs: passes.append(kwargs) or extract_pdf(*args, **kwargs))
+    invoices = parser.parse_pdf_bytes(data)
+    # Text and tables come from a single pdfminer pass.
+    assert passes == [{"tables": True}]
+    assert [inv.invoice_number for inv in invoices] == ["200000", "200001", "200002"]
+    for invoice, lines in zip(invoices, expected):
+        assert [line.model_dump(include=set(lines[0])) for line in invoice.lines] == lines
+    # Second parse reads the tables from the extraction cache.
+    assert parser.parse_pdf_bytes(data)[2].lines == invoices[2].lines
+
+
+def test_parse_budget_returns_partial_invoice(monkeypatch):
+    from app import parser_profile
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "parser_time_budget_ms", 1)
+    real_check = parser_profile.check_budget
+
+    def check(name=""):
+        if name == "lines":
+            parser_profile.current_budget.get().deadline = 0.0
+        real_check(name)
+
+    monkeypatch.setattr(parser_profile, "check_budget", check)
+    # Budget enforcement alone does not build profiles.
+    monkeypatch.setattr(parser, "ParseProfile", None)
+    text = Path("fixtures/sample_invoice.txt").read_text()
+    invoice = parser.parse_invoice_text(text)
+
+    assert invoice.invoice_number == "12345"
+    assert invoice.lines == []
+    assert invoice.parsing_confidence == parser.ABORTED_CONFIDENCE
+
+
+def test_parse_budget_charges_parsing_only_and_stops_between_invoices(monkeypatch):
+    import time
+
+    from app import parser_profile
+    from app.config import get_settings
+    from benchmarks.synthetic import packet_text
+
+    monkeypatch.setattr(get_settings(), "parser_time_budget_ms", 200)
+    data = packet_text(3, line_count=2).encode()
+
+    # Time the consumer spends between invoices is not charged.
+    invoices = []
+    for invoice in parser.iter_parsed_invoices(data):
+        time.sleep(0.15)
+        invoices.append(invoice)
+    assert all(invoice.parsing_confidence > parser.ABORTED_CONFIDENCE for invoice in invoices)
+
+    parse = parser._parse_with_template
+
+    def slow_parse(*args, **kwargs):
+        # Each invoice fits the budget on its own; the packet does not.
+        time.sleep(0.15)
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(parser, "_parse_with_template", slow_parse)
+    parsed = parser.iter_parsed_invoices(data)
+    assert next(parsed).parsing_confidence > parser.ABORTED_CONFIDENCE
+    with pytest.raises(parser_profile.ParseBudgetExceeded):
+        next(parsed)
+    # A resumed run starts at the same invoice with a fresh budget.
+    assert next(parser.iter_parsed_invoices(data, skip=1)).invoice_number == invoices[1].invoice_number
+
+
+def test_parser_profile_records_pattern_timings(monkeypatch):
+    from app.config import get_settings
+    from app.parser_profile import profile_log
+
+    monkeypatch.setattr(get_settings(), "parser_profile", True)
+    profile_log.clear()
+    parser.parse_invoice_text(Path("fixtures/sample_invoice.txt").read_text())
+
+    report = profile_log.aggregate()
+    assert report["invoices"] == 1
+    assert report["aborted"] == 0
+    assert report["patterns"]["header.invoice_number"]["matches"] == 1
+    assert report["patterns"]["lines"]["calls"] == 1
+    profile_log.clear()
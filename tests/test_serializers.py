@@ -0,0 +1,49 @@
+from typing import List
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import parser  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Invoices, OrderReferences  # noqa: E402
+from app.schemas import Invoice as InvoiceSchema  # noqa: E402
+from app.serializers import invoice_json, invoice_list_json  # noqa: E402
+from app.services import list_invoices, persist_invoice  # noqa: E402
+from benchmarks.synthetic import invoice_text  # noqa: E402
+
+
+def test_fast_path_matches_pydantic_bytes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    for number in range(3):
+        data = parser.parse_invoice_text(invoice_text(number, line_count=25))
+        data.customer_name = "Usine Québec — Ünïcode"
+        invoice = persist_invoice(db, data, "packet.pdf", "packet.pdf", "packet.pdf")
+        db.add(OrderReferences(invoice_id=invoice.id, order_number=f"PO-{number}", order_type="PO"))
+    db.commit()
+    db.query(Invoices).filter(Invoices.id == 2).update({"total": 10, "subtotal": None})
+    db.commit()
+    db.expire_all()
+
+    expected = TypeAdapter(List[InvoiceSchema]).dump_json([InvoiceSchema.model_validate(inv) for inv in list_invoices(db)])
+    assert invoice_list_json(db) == expected
+
+    single = TypeAdapter(InvoiceSchema).dump_json(InvoiceSchema.model_validate(db.get(Invoices, 2)))
+    assert invoice_json(db, 2) == single
+    assert invoice_json(db, 99) is None
+
+
+def test_openapi_still_documents_invoice_models():
+    paths = app.openapi()["paths"]
+    detail = paths["/invoices/{invoice_id}"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    listing = paths["/invoices"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert detail == {"$ref": "#/components/schemas/Invoice"}
+    assert listing["items"] == {"$ref": "#/components/schemas/Invoice"}
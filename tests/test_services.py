@@ -0,0 +1,323 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import parser, services  # noqa: E402
+from app.config import get_settings  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.models import IngestionJobs, Invoices  # noqa: E402
+from benchmarks.synthetic import packet_text  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_settings(), "storage_path", tmp_path / "storage")
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_partial_packet_resumes_after_last_commit(db, monkeypatch):
+    monkeypatch.setattr(get_settings(), "ingest_commit_every", 2)
+    data = packet_text(5, line_count=2).encode()
+    persist = services.persist_invoice
+    calls = {"persist": 0, "parse": 0}
+
+    def flaky_persist(*args, **kwargs):
+        calls["persist"] += 1
+        if calls["persist"] == 4:
+            raise RuntimeError("worker died")
+        return persist(*args, **kwargs)
+
+    monkeypatch.setattr(services, "persist_invoice", flaky_persist)
+    with pytest.raises(RuntimeError):
+        services.process_upload(db, "packet.pdf", data)
+    db.rollback()
+    assert db.query(Invoices).count() == 2
+    job = db.query(IngestionJobs).one()
+    assert (job.status, job.invoices_done) == ("failed", 2)
+
+    parse = parser.parse_invoice_text
+
+    def counting_parse(*args, **kwargs):
+        calls["parse"] += 1
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(parser, "parse_invoice_text", counting_parse)
+    first = services.process_upload(db, "packet.pdf", data)
+    assert calls["parse"] == 3
+    assert first.invoice_number == "100000"
+    assert [inv.invoice_number for inv in db.query(Invoices).order_by(Invoices.id)] == [str(100000 + i) for i in range(5)]
+    job = db.query(IngestionJobs).one()
+    assert (job.status, job.invoices_done) == ("completed", 5)
+
+
+def test_large_packet_parses_fully_under_the_default_budget(db):
+    services.process_upload(db, "packet.pdf", packet_text(300, line_count=20).encode())
+
+    invoices = db.query(Invoices).all()
+    assert len(invoices) == 300
+    assert all(invoice.invoice_number and invoice.parsing_confidence > parser.ABORTED_CONFIDENCE for invoice in invoices)
+
+
+def test_spent_parse_budget_resumes_instead_of_storing_placeholders(db, monkeypatch):
+    import time
+
+    monkeypatch.setattr(get_settings(), "parser_time_budget_ms", 200)
+    parse = parser._parse_with_template
+
+    def slow_parse(*args, **kwargs):
+        time.sleep(0.15)
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(parser, "_parse_with_template", slow_parse)
+    with pytest.raises(parser.ParseBudgetExceeded):
+        services.process_upload(db, "packet.pdf", packet_text(3, line_count=2).encode())
+    job = db.query(IngestionJobs).one()
+    assert (job.status, job.invoices_done) == ("failed", 1)
+
+    # Each retry resumes with a fresh budget.
+    services.retryable_process(db, "packet.pdf", packet_text(3, line_count=2).encode())
+    invoices = db.query(Invoices).order_by(Invoices.id).all()
+    assert [invoice.invoice_number for invoice in invoices] == ["100000", "100001", "100002"]
+    assert all(invoice.parsing_confidence > parser.ABORTED_CONFIDENCE for invoice in invoices)
+
+
+def test_running_job_is_left_to_its_owner_until_its_lease_expires(db):
+    from datetime import datetime, timedelta
+
+    running = services.start_or_resume_job(db, "a" * 64, "packet.pdf")
+    concurrent = services.start_or_resume_job(db, "a" * 64, "packet.pdf")
+    assert concurrent.id != running.id
+
+    running.updated_at = datetime.utcnow() - timedelta(seconds=get_settings().ingest_job_lease_seconds + 1)
+    db.commit()
+    assert services.start_or_resume_job(db, "a" * 64, "packet.pdf").id == running.id
+
+    assert services.set_job_status(db, concurrent.id, "running", "failed")
+    assert services.start_or_resume_job(db, "a" * 64, "packet.pdf").id == concurrent.id
+    # Claimed once: nothing is left to resume.
+    assert services.start_or_resume_job(db, "a" * 64, "packet.pdf").id not in {running.id, concurrent.id}
+
+
+def test_retention_compresses_cold_and_archives_old_originals(db, monkeypatch):
+    from datetime import datetime, timedelta
+
+    from app import storage
+    from app.models import Files
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "storage_compress_after_days", 30)
+    monkeypatch.setattr(settings, "storage_archive_after_months", 12)
+    payloads = {name: packet_text(1, line_count=3, start=i).encode() for i, name in enumerate(["new.pdf", "cold.pdf", "old.pdf"])}
+    for name, data in payloads.items():
+        services.process_upload(db, name, data)
+    files = {file.filename: file for file in db.query(Files)}
+    assert files["new.pdf"].original_path.startswith((settings.storage_path / "originals").as_posix())
+    now = datetime.utcnow()
+    files["cold.pdf"].uploaded_at = now - timedelta(days=60)
+    files["old.pdf"].uploaded_at = now - timedelta(days=400)
+    db.commit()
+
+    result = storage.apply_retention(db, now=now)
+
+    assert (result["compressed"], result["archived"]) == (1, 1)
+    assert not storage.is_compressed(files["new.pdf"].original_path)
+    assert files["cold.pdf"].original_path.endswith(".pdf.gz")
+    assert files["old.pdf"].original_path.startswith((settings.storage_path / "archive").as_posix())
+    for name, data in payloads.items():
+        assert storage.read_stored(files[name].original_path) == data
+        assert storage.stored_size(files[name].original_path) == len(data)
+    assert storage.apply_retention(db, now=now)["compressed"] == 0
+
+
+def test_retention_and_uploads_share_stored_originals(db, monkeypatch):
+    from datetime import datetime, timedelta
+    from pathlib import Path
+
+    from app import storage
+    from app.models import Files
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "storage_compress_after_days", 30)
+    data = packet_text(1, line_count=2).encode()
+    services.process_upload(db, "first.pdf", data)
+    plain = Path(db.query(Files).one().original_path)
+    db.query(Files).update({Files.uploaded_at: datetime.utcnow() - timedelta(days=60)})
+    db.commit()
+
+    # An upload of the same bytes reuses the file while it is being compressed.
+    compress_copy = storage.ShardedStore.compress_copy
+
+    def racing_copy(self, path, content_hash, root=None):
+        assert storage.save_pdf("again.pdf", data)[0] == path
+        return compress_copy(self, path, content_hash, root)
+
+    monkeypatch.setattr(storage.ShardedStore, "compress_copy", racing_copy)
+    # The row moves to the compressed copy, but the plain file stays, so
+    # nothing is counted or freed.
+    result = storage.apply_retention(db)
+    assert (result["compressed"], result["hot_bytes_freed"]) == (0, 0)
+    compressed = Path(db.query(Files).one().original_path)
+    assert storage.is_compressed(compressed)
+    assert plain.exists() and storage.read_stored(compressed) == data
+
+    # Once compressed, re-uploads reuse the compressed copy.
+    monkeypatch.setattr(storage.ShardedStore, "compress_copy", compress_copy)
+    plain.unlink()
+    assert storage.save_pdf("third.pdf", data)[0] == compressed
+    assert not plain.exists()
+
+
+def rollup_rows(db):
+    from app.analytics import ROLLUPS
+
+    return {model.__tablename__: sorted(tuple(row) for row in db.execute(model.__table__.select())) for model in ROLLUPS}
+
+
+def test_reparse_updates_the_files_invoices_when_totals_change(db, monkeypatch):
+    from app.models import Files
+
+    data = packet_text(3, line_count=2).encode()
+    services.process_upload(db, "packet.pdf", data)
+    before = {invoice.id: invoice.total for invoice in db.query(Invoices)}
+    parse = parser.iter_parsed_invoices
+
+    def changed(*args, **kwargs):
+        for index, invoice in enumerate(parse(*args, **kwargs)):
+            # New totals change every duplicate key; the last loses its number.
+            yield invoice.model_copy(update={"total": invoice.total + 1, "invoice_number": None if index == 2 else invoice.invoice_number})
+
+    monkeypatch.setattr(parser, "iter_parsed_invoices", changed)
+    file = db.query(Files).order_by(Files.id).first()
+    services.process_upload(db, "packet.pdf", data, reparse=services.file_invoice_ids(db, file))
+
+    after = {invoice.id: invoice for invoice in db.query(Invoices)}
+    assert set(after) == set(before)
+    assert all(after[invoice_id].total == total + 1 and after[invoice_id].version == 2 for invoice_id, total in before.items())
+    assert sorted(invoice.dedupe_key is None for invoice in after.values()) == [False, False, True]
+
+
+def test_spend_rollups_track_ingest_and_reparse(db):
+    from app import analytics
+
+    services.process_upload(db, "packet.pdf", packet_text(6, line_count=3).encode())
+    vendor_total = sum(row["total"] for row in analytics.spend_report(db, by="vendor", by_month=False))
+    assert round(vendor_total, 2) == round(sum(invoice.total for invoice in db.query(Invoices)), 2)
+
+    # Re-parse one invoice with different content; the rollups swap its contribution.
+    invoice = db.query(Invoices).order_by(Invoices.id).first()
+    changed = parser.parse_invoice_text(invoice.raw_text.replace("Total:", "Total: 1").replace("GL 5000", "GL 6100"))
+    services.refresh_invoice(db, invoice, changed)
+    db.commit()
+
+    incremental = rollup_rows(db)
+    assert any(row[1] == "6100" for row in incremental["account_spend_monthly"])
+    analytics.rebuild(db)
+    assert rollup_rows(db) == incremental
+
+    # Emptied rollups are reported, not rebuilt, until the explicit rebuild.
+    for model in analytics.ROLLUPS:
+        db.execute(model.__table__.delete())
+    db.commit()
+    assert not analytics.check_rollups(db)
+    assert rollup_rows(db)["vendor_spend_monthly"] == []
+    analytics.rebuild(db)
+    assert analytics.check_rollups(db)
+    assert rollup_rows(db) == incremental
+
+
+def test_spend_report_filters_and_groups(db):
+    from app import analytics
+
+    services.process_upload(db, "packet.pdf", packet_text(6, line_count=3).encode())
+    months = analytics.spend_report(db, by="account")
+    assert all(row["account_code"] == "5000" for row in months)
+    assert months == sorted(months, key=lambda row: row["month"])
+
+    first = months[0]["month"]
+    only_first = analytics.spend_report(db, by="account", month_from=first, month_to=first)
+    assert [row["month"] for row in only_first] == [first]
+    parts = analytics.spend_report(db, by="part", by_month=False, limit=3)
+    assert len(parts) == 3
+    assert parts[0]["extended"] >= parts[-1]["extended"]
+
+    # The limit applies within each month.
+    per_month = analytics.spend_report(db, by="part", limit=1)
+    assert [row["month"] for row in per_month] == [row["month"] for row in months]
+    vendor = db.query(Invoices.vendor_name).first()[0]
+    assert analytics.spend_report(db, by="vendor", key=f" {vendor.upper()}. ", by_month=False)[0]["vendor"] == services.normalize_vendor(vendor)
+
+
+def test_part_index_follows_commits_and_ignores_rollbacks(db):
+    from app.models import Parts
+    from app.part_index import PartEntry, PartIndex, normalize_part_number, part_index
+
+    part_index.clear()
+    part_index.load(db)
+    services.get_or_create_part(db, "68211-234AA", "Filter")
+    db.commit()
+    services.get_or_create_part(db, "68211-999ZZ", "Rolled back")
+    db.rollback()
+
+    assert [entry.part_number for entry in part_index.search("68211234")] == ["68211-234AA"]
+    assert part_index.search("68211999") == []
+    assert normalize_part_number("ab-12 c") == "AB12C"
+
+    # Another process's insert shows up on sync.
+    other = PartIndex()
+    other.load(db)
+    db.add(Parts(part_number="68211-555BB"))
+    db.commit()
+    assert other.sync(db) == 1
+    assert [entry.part_number for entry in other.search("6821", limit=5)] == ["68211-234AA", "68211-555BB"]
+
+    # A part this worker added with a high id does not hide a lower id
+    # another worker commits afterwards.
+    other.add(PartEntry(1000, "68211-900CC", None, False, False, False))
+    db.add(Parts(part_number="68211-600DD"))
+    db.commit()
+    assert other.sync(db) == 1
+    assert [entry.part_number for entry in other.search("682116")] == ["68211-600DD"]
+
+    # Flags changed elsewhere are picked up by the periodic full reload.
+    db.query(Parts).filter(Parts.part_number == "68211-234AA").update({"received": True})
+    db.commit()
+    other.ensure_current(db, max_age=0)
+    assert not other.search("68211234")[0].received
+    other.loaded_at -= 10
+    other.ensure_current(db, max_age=0, reload_age=5)
+    assert other.search("68211234")[0].received
+    part_index.clear()
+
+
+def test_archived_invoices_rehydrate_and_reparse_hot(db):
+    from datetime import date
+
+    from app import archive
+    from app.models import ArchivedInvoices, InvoicePages
+    from app.serializers import invoice_json
+
+    data = packet_text(3, line_count=2).encode()
+    services.process_upload(db, "packet.pdf", data)
+    ids = [invoice.id for invoice in db.query(Invoices).order_by(Invoices.id)]
+    before = {invoice_id: invoice_json(db, invoice_id) for invoice_id in ids}
+
+    result = archive.archive_invoices(db, before=date(2100, 1, 1), batch_size=2)
+
+    assert result["invoices"] == 3
+    assert result["stored_bytes"] < result["raw_bytes"]
+    assert db.query(InvoicePages).count() == 0
+    assert db.query(Invoices).filter(Invoices.raw_text.isnot(None)).count() == 0
+    assert {invoice_id: invoice_json(db, invoice_id) for invoice_id in ids} == before
+    assert archive.archive_invoices(db, before=date(2100, 1, 1))["invoices"] == 0
+
+    services.process_upload(db, "packet.pdf", data, reparse=ids)
+    assert db.query(ArchivedInvoices).count() == 0
+    assert db.query(InvoicePages).count() > 0
+    assert archive.get_invoice_archive().prune([]) == 3
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.config import Settings, configure_settings, get_settings  # noqa: E402
+from app.main import create_app  # noqa: E402
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+# Generous default so slow CI machines pass; tighten locally to catch regressions.
+IMPORT_BUDGET_SECONDS = float(os.environ.get("PARTSUITE_IMPORT_BUDGET", "2.0"))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+print(json.dumps({"seconds": time.perf_counter() - start, "pdfminer": "pdfminer" in sys.modules, "async_orm": "sqlalchemy.ext.asyncio" in sys.modules}))
+"""
+
+
+def test_import_is_fast_and_side_effect_free(tmp_path):
+    env = {**os.environ, "PYTHONPATH": str(ROOT_DIR)}
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=tmp_path, env=env, capture_output=True, text=True, check=True)
+    probe = json.loads(result.stdout)
+
+    assert not probe["pdfminer"]
+    assert not probe["async_orm"]
+    assert list(tmp_path.iterdir()) == []
+    assert probe["seconds"] < IMPORT_BUDGET_SECONDS, f"import app.main took {probe['seconds']:.3f}s"
+
+
+def test_create_app_sets_up_database_in_lifespan(tmp_path):
+    previous = get_settings()
+    settings = Settings(database_url=f"sqlite:///{tmp_path}/factory.db", storage_path=tmp_path / "storage")
+    try:
+        with TestClient(create_app(settings)) as client:
+            assert (tmp_path / "storage" / "originals").is_dir()
+            sample = Path("fixtures/sample_invoice.txt").read_bytes()
+            response = client.post("/upload", files={"files": ("invoice.pdf", BytesIO(sample), "application/pdf")})
+            assert response.status_code == 200
+            digest = hashlib.sha256(sample).hexdigest()
+            assert (tmp_path / "storage" / "originals" / digest[:2] / digest[2:4] / f"{digest}.pdf").exists()
+            assert len(client.get("/invoices").json()) == 1
+    finally:
+        configure_settings(previous)
+
+
+def test_second_app_cannot_start_while_one_is_running(tmp_path):
+    previous = get_settings()
+    first = Settings(database_url=f"sqlite:///{tmp_path}/first.db", storage_path=tmp_path / "first")
+    second = Settings(database_url=f"sqlite:///{tmp_path}/second.db", storage_path=tmp_path / "second")
+    try:
+        with TestClient(create_app(first)):
+            with pytest.raises(RuntimeError, match="already running"):
+                with TestClient(create_app(second)):
+                    pass
+            assert get_settings() is first
+        with TestClient(create_app(second)) as client:
+            assert client.get("/invoices").json() == []
+    finally:
+        configure_settings(previous)
+
+
+def test_ensure_schema_adds_new_columns_without_dropping_data(tmp_path):
+    from sqlalchemy import create_engine, inspect, text
+
+    from sqlalchemy.orm import Session
+
+    from app.database import ensure_schema
+    from app.services import find_duplicate, find_near_duplicates
+
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        # invoices and files as they were before dedupe keys, versions and content hashes.
+        conn.execute(text("CREATE TABLE invoices (id INTEGER PRIMARY KEY, invoice_number VARCHAR, created_at DATETIME)"))
+        conn.execute(text("CREATE TABLE files (id INTEGER PRIMARY KEY, filename VARCHAR NOT NULL, original_path VARCHAR NOT NULL)"))
+        conn.execute(text("INSERT INTO invoices (id, invoice_number) VALUES (1, 'INV-1')"))
+        # A re-scan stored twice before duplicate keys existed.
+        conn.execute(text("INSERT INTO invoices (id, invoice_number) VALUES (2, 'INV-1')"))
+        conn.execute(text("INSERT INTO files (id, filename, original_path) VALUES (1, 'a.pdf', 'originals/a.pdf')"))
+
+    ensure_schema(engine)
+
+    with engine.connect() as conn:
+        # Existing invoices get the duplicate key a re-scan of them would have.
+        assert conn.execute(text("SELECT invoice_number, version, dedupe_key FROM invoices")).all() == [("INV-1", 1, "|INV1||")] * 2
+        assert conn.execute(text("SELECT filename, content_hash FROM files")).all() == [("a.pdf", None)]
+    with Session(bind=engine) as db:
+        assert find_duplicate(db, "|INV1||").id == 1
+        assert find_near_duplicates(db) == []
+    assert "ix_files_content_hash" in {index["name"] for index in inspect(engine).get_indexes("files")}
+    assert "ix_invoice_lines_invoice_id" in {index["name"] for index in inspect(engine).get_indexes("invoice_lines")}
+
+
+def test_normalize_sql_folds_literals_and_in_lists():
+    from app.sql_profile import normalize_sql
+
+    statement = "SELECT id FROM invoices\n WHERE id IN (?, ?, ?) AND total > 10.5 AND vendor = 'FCA'"
+    assert normalize_sql(statement) == "SELECT id FROM invoices WHERE id IN (...) AND total > ? AND vendor = ?"